@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
-from .trainer import Trainer
-from .tagger import Tagger
-from .transmodel import TransModel
-from .argparser import parse_args
+from importlib import import_module
+
 from .version import __version__
 
 __all__ = ['Trainer', 'Tagger', 'TransModel', 'parse_args', __version__]
+
+# The classes are imported on first use (PEP 562), so importing the package does not load scikit-learn, scipy etc.
+_lazy_attributes = {'Trainer': '.trainer', 'Tagger': '.tagger', 'TransModel': '.transmodel',
+                    'parse_args': '.argparser'}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        value = getattr(import_module(_lazy_attributes[name], __name__), name)
+        globals()[name] = value  # Only the first access goes through __getattr__
+        return value
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_lazy_attributes.keys()))
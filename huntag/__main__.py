@@ -3,11 +3,12 @@
 
 import sys
 from os import listdir
-from os.path import join as os_path_join
+from os.path import join as os_path_join, getsize
+from time import perf_counter
 
-from . import Trainer, Tagger, TransModel, parse_args
+from .argparser import parse_args  # The modules of the tasks are imported in their branches (CLI startup time)
 
-from xtsv import process, parser_skeleton, jnius_config, build_pipeline
+from xtsv import process, parser_skeleton, jnius_config, build_pipeline, singleton_store_factory
 
 
 def main():
@@ -40,9 +41,14 @@ def main():
     tools = [(huntag_tagger, ('huntag', 'HunTag3'))]
 
     if options['task'] == 'transmodel-train':  # TRANSMODEL TRAIN
+        from .transmodel import TransModel
 
-        trans_model = TransModel(source_fields={options['gold_tag_field']}, lmw=options['lmw'],
-                                 order=options['transmodel_order'])
+        if options['continue_from'] is None:
+            trans_model = TransModel(source_fields={options['gold_tag_field']}, lmw=options['lmw'],
+                                     order=options['transmodel_order'])
+        else:  # Add the counts of the new data to the loaded ones, then compile() again
+            trans_model = TransModel.load_from_file('{0}.transmodel'.format(options['continue_from']))
+            trans_model.source_fields = {options['gold_tag_field']}
 
         # It's possible to train multiple times incrementally... (Just call process on different data, then compile())
         # Exhaust training process iterator...
@@ -52,24 +58,68 @@ def main():
         # Close training, compute probabilities
         trans_model.compile()
         trans_model.save_to_file(options['transmodel_filename'])
-    elif options['task'] in {'train', 'most-informative-features', 'train-featurize'}:  # TRAIN
+    elif options['task'] in {'train', 'most-informative-features', 'train-featurize', 'train-sweep',
+                             'evaluate', 'train-all'}:  # TRAIN (train-all: with the transition model in one pass)
+        from .trainer import Trainer
 
         trainer = Trainer(options, source_fields={options['gold_tag_field']})
 
-        # Exhaust training process iterator...
-        for _ in process(input_data, trainer):
-            pass
-        trainer.cutoff_feats()
+        if options['mini_batch_size'] is not None:  # Count features in the first pass then stream them each epoch
+            for _ in process(input_data, trainer):
+                pass
+            trainer.fix_feature_space()
+
+            for epoch in range(1, options['epochs'] + 1):
+                input_data.seek(0)
+                for _ in process(input_data, trainer):
+                    pass
+                trainer.end_epoch(epoch)
+            trainer.save()
+            return
+
+        if options['task'] == 'train-featurize' and options['cutoff'] < 2 and options['save_dataset_dir'] is None \
+                and options['load_dataset_dir'] is None:  # Nothing to count: write the features while featurizing
+            trainer.stream_featurized_input(output_iterator)
+            for _ in process(input_data, trainer):
+                pass
+            trainer.end_featurized_input()
+            return
+
+        if options['load_dataset_dir'] is not None:  # Skip featurization
+            trainer.load_dataset(options['load_dataset_dir'])
+        else:
+            # Exhaust training process iterator...
+            for _ in process(input_data, trainer):
+                pass
+            if options['save_dataset_dir'] is not None:
+                trainer.cutoff_feats(1)  # Keep every feature to be able to apply any cutoff on the saved dataset
+            else:
+                trainer.cutoff_feats()
 
         if options['task'] == 'most-informative-features':
             trainer.most_informative_features(output_iterator)
+        elif options['task'] == 'train-featurize' and options['save_dataset_dir'] is not None:
+            trainer.save_dataset(options['save_dataset_dir'])
         elif options['task'] == 'train-featurize':
             trainer.write_featurized_input(output_iterator)
+        elif options['task'] == 'train-sweep':  # Evaluate the grid then train the best on the whole input
+            trainer.sweep(options['sweep_grid'], options['held_out'], options['jobs'], output_iterator)
+            trainer.train()
+            trainer.save()
+        elif options['task'] == 'evaluate':
+            trainer.evaluate(options['folds'], options['jobs'], output_iterator)
         else:
+            if options['subsample_report']:  # Compare on held-out sentences, then train on the whole input
+                trainer.subsample_report(options['held_out'], options['jobs'], output_iterator)
+            if options['sparsity'] is not None:  # Search C for the target sparsity on held-out sentences
+                trainer.sparsify(options['held_out'], options['jobs'], output_stream=output_iterator)
             trainer.train()
+            if options['sparsity'] is not None:
+                trainer.template_report(output_iterator)
             trainer.save()
 
     elif options['task'] in {'print-weights', 'tag-featurize'}:  # TAG (minus real tagging handled by xtsv)
+        from .tagger import Tagger
 
         tagger = Tagger(options, target_fields=[options['label_tag_field']])
 
@@ -81,11 +131,113 @@ def main():
                         open(os_path_join(out_dir, '{0}.tagged'.format(fn)), 'w', encoding='UTF-8') as ofh:
                     ofh.writelines(process(ifh, tagger))
         elif options['task'] == 'print-weights':  # Print MaxEnt weights to output stream
-            tagger.print_weights(output_iterator, options['num_weights'])
+            tagger.print_weights(output_iterator, options['num_weights'], options['weights_format'])
+        elif options['save_dataset_dir'] is not None:  # options['task'] == 'tag-featurize'
+            for _ in process(input_data, tagger):
+                pass
+            tagger.save_dataset(options['save_dataset_dir'])
+    elif options['task'] == 'compact-model':  # Prune features, then compare the compact model to the original
+        from .tagger import Tagger
+
+        start = perf_counter()
+        tagger = Tagger(options, target_fields=[options['label_tag_field']])
+        load_time = perf_counter() - start
+        feat_num, kept_num = tagger.save_compact(options['weight_threshold'], options['compact_options'],
+                                                   options['quantize'])
+
+        compact_options = dict(options, **options['compact_options'])
+        start = perf_counter()
+        compact_tagger = Tagger(compact_options, target_fields=[options['label_tag_field']])
+        compact_load_time = perf_counter() - start
+
+        # Tag the input with both models and compare the output token by token
+        input_lines = list(input_data)
+        tagged_lines = zip(process(iter(input_lines), tagger), process(iter(input_lines), compact_tagger))
+        next(tagged_lines, None)  # Header
+        tokens, agreeing = 0, 0
+        for line, compact_line in tagged_lines:
+            if line.strip() != '':
+                tokens += 1
+                agreeing += line == compact_line
+
+        sizes = [sum(getsize(model_options[file_name])
+                     for file_name in ('model_filename', 'featcounter_filename', 'labelcounter_filename'))
+                 for model_options in (options, compact_options)]
+        print('Model', 'Features', 'Size (bytes)', 'Load time (s)', 'Tag agreement', sep='\t', file=output_iterator)
+        print('original', feat_num, sizes[0], '{0:.3f}'.format(load_time), '{0:.6f}'.format(1), sep='\t',
+              file=output_iterator)
+        print('compact', kept_num, sizes[1], '{0:.3f}'.format(compact_load_time),
+              '{0:.6f}'.format(agreeing / max(tokens, 1)), sep='\t', file=output_iterator)
+        print('reduction', '{0:.1%}'.format(1 - kept_num / max(feat_num, 1)),
+              '{0:.1%}'.format(1 - sizes[1] / max(sizes[0], 1)),
+              '{0:.1%}'.format(1 - compact_load_time / max(load_time, 1e-9)), '', sep='\t', file=output_iterator)
+    elif options['task'] == 'bundle':  # Pack the model set into one file, then compare the loading times
+        from .tagger import Tagger
+        from .bundle import verify_bundle
+
+        start = perf_counter()
+        tagger = Tagger(options, target_fields=[options['label_tag_field']])
+        load_time = perf_counter() - start
+        bundle_size = tagger.save_bundle(options['bundle_filename'])
+        verify_bundle(options['bundle_filename'])  # Once: the loads read only the pages used
+
+        start = perf_counter()
+        Tagger(dict(options, use_bundle=True), target_fields=[options['label_tag_field']])
+        bundle_load_time = perf_counter() - start
+
+        file_names = [options[file_name] for file_name in ('model_filename', 'featcounter_filename',
+                                                           'labelcounter_filename', 'transmodel_filename')]
+        if options['cfg_file'] is not None:
+            file_names.append(options['cfg_file'])
+        file_names.extend(feature.action_name for feature in (tagger.features or {}).values() if feature.kind == 'lex')
+        print('Model', 'Files', 'Size (bytes)', 'Load time (s)', sep='\t', file=output_iterator)
+        print('separate', len(file_names), sum(getsize(file_name) for file_name in file_names),
+              '{0:.3f}'.format(load_time), sep='\t', file=output_iterator)
+        print('bundle', 1, bundle_size, '{0:.3f}'.format(bundle_load_time), sep='\t', file=output_iterator)
+    elif options['task'] == 'serve':  # Load the model once, then tag the documents of the clients
+        from .tagger import Tagger
+
+        tagger = Tagger(options, target_fields=[options['label_tag_field']])
+        if options['http_address'] is not None:  # Tag the sentences of concurrent requests in micro-batches
+            from .http_server import serve_http
+
+            serve_http(tagger, options['http_address'], options['max_batch_size'], options['max_batch_wait'] / 1000,
+                       options['max_pending'], options['request_timeout'], conll_comments=opts.conllu_comments)
+        else:
+            from .server import serve
+
+            serve(tagger, options['socket_path'], options['jobs'], opts.conllu_comments)
+    elif options['load_dataset_dir'] is not None:  # options['task'] == tag on binary dataset
+        from .tagger import Tagger
+
+        tagger = Tagger(options, target_fields=[options['label_tag_field']])
+        tagger.tag_dataset(options['load_dataset_dir'], output_iterator)
+    elif options['jobs'] != 1:  # options['task'] == tag in worker processes sharing the memory-mapped bundle
+        from .tagger import Tagger, tag_parallel
+
+        Tagger(options, target_fields=[options['label_tag_field']])  # Check (and verify if set) the bundle once
+        tag_parallel(input_data, output_iterator, options, [options['label_tag_field']], options['jobs'],
+                     opts.conllu_comments)
+    elif options['cache_file'] is not None:  # options['task'] == tag only the sentences which are not in the cache
+        from .tagger import Tagger
+        from .cache import TaggingCache, CachedTagger
+
+        tagger = CachedTagger(Tagger(options, target_fields=[options['label_tag_field']]),
+                              TaggingCache(options['cache_file'], options['cache_size']))
+        output_iterator.writelines(process(input_data, tagger, opts.conllu_comments))
+        tagger.close()
+    elif options['threads'] != 1:  # options['task'] == tag in threads sharing the Tagger
+        from .tagger import Tagger, tag_threaded
+
+        tagger = Tagger(options, target_fields=[options['label_tag_field']])
+        tag_threaded(input_data, output_iterator, tagger, options['threads'], opts.conllu_comments)
     else:  # options['task'] == tag
         # Tag a featurized or unfeaturized file or write the featurized format to to output_stream
         # Run the pipeline on input and write result to the output...
-        output_iterator.writelines(build_pipeline(input_data, used_tools, tools, presets, opts.conllu_comments))
+        singleton_store = singleton_store_factory()  # To get the Tagger back for its report
+        output_iterator.writelines(build_pipeline(input_data, used_tools, tools, presets, opts.conllu_comments,
+                                                  singleton_store))
+        singleton_store[0]['huntag'].report_scoring()
 
     # TODO this method is recommended when debugging the tool
     # Alternative: Run specific tool for input (still in emtsv format):
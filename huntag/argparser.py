@@ -20,6 +20,27 @@ def valid_dir(input_dir):
     return input_dir, out_dir
 
 
+def valid_dataset_dir(dataset_dir):
+    if not isdir(dataset_dir):
+        raise ArgumentTypeError('"{0}" must be a featurized dataset directory!'.format(dataset_dir))
+    return dataset_dir
+
+
+def valid_parameters(parameters):  # YAML mapping e.g. "{C: 0.5, max_iter: 1000}"
+    try:
+        parameters = yaml.load(parameters, Loader=yaml.SafeLoader)
+    except yaml.YAMLError as e:
+        raise ArgumentTypeError('"{0}" is not valid YAML: {1}'.format(parameters, e))
+    if not isinstance(parameters, dict):
+        raise ArgumentTypeError('"{0}" must be a mapping (e.g. "{{C: 0.5, max_iter: 1000}}")!'.format(parameters))
+    return parameters
+
+
+def valid_grid(grid):  # YAML mapping of lists e.g. "{C: [0.1, 1, 10], solver: [lbfgs, saga]}"
+    grid = valid_parameters(grid)
+    return {name: values if isinstance(values, list) else [values] for name, values in grid.items()}
+
+
 def valid_file(input_file_name):  # Config and model file is also searched relatve to the module directory
     for input_file in (input_file_name, join(dirname(abspath(__file__)), input_file_name)):
         if isfile(input_file):
@@ -30,9 +51,11 @@ def valid_file(input_file_name):  # Config and model file is also searched relat
 
 def parse_args(parser=ArgumentParser()):
     parser.add_argument('task', choices=['transmodel-train', 'most-informative-features', 'train', 'tag',
-                                         'print-weights', 'train-featurize', 'tag-featurize'],
+                                         'print-weights', 'train-featurize', 'tag-featurize', 'train-sweep',
+                                         'evaluate', 'train-all', 'compact-model', 'bundle', 'serve'],
                         help='avaliable tasks: transmodel-train, most-informative-features, train, tag, '
-                             'print-weights, train-featurize, tag-featurize)')
+                             'print-weights, train-featurize, tag-featurize, train-sweep, evaluate, train-all, '
+                             'compact-model, bundle, serve)')
 
     parser.add_argument('-c', '--config-file', dest='cfg_file', type=valid_file,
                         help='read feature configuration from FILE',
@@ -62,6 +85,17 @@ def parse_args(parser=ArgumentParser()):
                         help='extension of label numbers file to be read/written',
                         metavar='EXT')
 
+    parser.add_argument('--bundle-ext', dest='bundle_ext', default='.bundle',
+                        help='extension of the model bundle file to be read/written',
+                        metavar='EXT')
+
+    parser.add_argument('--bundle', dest='use_bundle', action='store_true', default=False,
+                        help='load the model set (and the features) from the single-file bundle (see the bundle task) '
+                             'instead of the separate files and the config (tag, print-weights, tag-featurize)')
+
+    parser.add_argument('--verify-bundle', dest='verify_bundle', action='store_true', default=False,
+                        help='verify the checksum of the bundle before loading it (reads the whole file)')
+
     parser.add_argument('--language-model-weight', dest='lmw',  type=float, default=1,
                         help='set relative weight of the language model to L',
                         metavar='L')
@@ -70,10 +104,98 @@ def parse_args(parser=ArgumentParser()):
                         help='set global cutoff to C',
                         metavar='C')
 
-    parser.add_argument('-p', '--parameters', dest='train_params',
-                        help='pass PARAMS to trainer',
+    parser.add_argument('-p', '--parameters', dest='train_params', type=valid_parameters,
+                        help='pass PARAMS to trainer (YAML mapping e.g. "{C: 0.5, max_iter: 1000}")',
                         metavar='PARAMS')
 
+    parser.add_argument('--grid', dest='sweep_grid', type=valid_grid,
+                        help='parameter GRID for train-sweep (YAML mapping of lists e.g. "{C: [0.1, 1, 10]}")',
+                        metavar='GRID')
+
+    parser.add_argument('--held-out', dest='held_out', type=float, default=0.1,
+                        help='use F fraction of the sentences for evaluation in train-sweep and --subsample-report',
+                        metavar='F')
+
+    parser.add_argument('--folds', dest='folds', type=int, default=10,
+                        help='number of folds (split by sentences) for cross-validation in evaluate',
+                        metavar='K')
+
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='number of parallel processes (-1: one for each CPU)',
+                        metavar='N')
+
+    parser.add_argument('--threads', dest='threads', type=int, default=1,
+                        help='tag in N threads sharing the model (-1: one for each CPU)',
+                        metavar='N')
+
+    parser.add_argument('--score-cache', dest='score_cache_size', type=int,
+                        help='score the tokens by the cached weights of the features of the field values of the tokens '
+                             '(at most N values are cached, tag)',
+                        metavar='N')
+
+    parser.add_argument('--cache', dest='cache_file',
+                        help='keep the labels of the tagged sentences in FILE and tag only the sentences which are not '
+                             'in it (tag)',
+                        metavar='FILE')
+
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=1000000,
+                        help='keep at most N sentences in the cache, the least recently used ones are evicted '
+                             '(default: 1000000)',
+                        metavar='N')
+
+    parser.add_argument('--one-vs-rest', dest='one_vs_rest', action='store_true', default=False,
+                        help='train independent binary models for each label in parallel (-j) and combine them into '
+                             'one (one-vs-rest) model')
+
+    parser.add_argument('--continue-from', dest='continue_from',
+                        help='continue training MODEL on new data: extend its feature and label numbers and keep its '
+                             'coefficients as prior (train) or update its transition counts (transmodel-train)',
+                        metavar='MODEL')
+
+    parser.add_argument('--deduplicate', dest='deduplicate', action='store_true', default=False,
+                        help='train on the distinct training events weighted by their number of occurences')
+
+    parser.add_argument('--subsample', dest='subsample', type=float,
+                        help='keep only F stratified fraction of the training events with the majority label '
+                             '(reweighted to keep the class prior)',
+                        metavar='F')
+
+    parser.add_argument('--subsample-label', dest='subsample_label',
+                        help='the label to subsample instead of the most frequent one',
+                        metavar='LABEL')
+
+    parser.add_argument('--subsample-report', dest='subsample_report', action='store_true', default=False,
+                        help='before training compare the fit time and the accuracy on held-out sentences (--held-out) '
+                             'with and without subsampling')
+
+    parser.add_argument('--sparsity', dest='sparsity', type=float,
+                        help='train a sparse L1 or elastic-net (saga) model with the C closest to the target where '
+                             'at least F fraction of the features have no weight (searched on log scale from the '
+                             'default or supplied one, evaluated on held-out sentences: --held-out) and report the '
+                             'feature templates without surviving features',
+                        metavar='F')
+
+    parser.add_argument('--l1-ratio', dest='l1_ratio', type=float, default=1.0,
+                        help='the elastic-net mixing parameter for --sparsity (1.0: L1, default: %(default)s)',
+                        metavar='R')
+
+    parser.add_argument('--mini-batch', dest='mini_batch_size', type=int,
+                        help='train incrementally (SGD) on mini-batches of N sentences instead of the whole input at '
+                             'once (needs -i/--input)',
+                        metavar='N')
+
+    parser.add_argument('--epochs', dest='epochs', type=int, default=5,
+                        help='number of passes over the input in mini-batch training',
+                        metavar='N')
+
+    parser.add_argument('--shuffle-buffer', dest='shuffle_buffer', type=int, default=10000,
+                        help='shuffle sentences in a buffer of N sentences in mini-batch training',
+                        metavar='N')
+
+    parser.add_argument('--random-seed', dest='random_seed', type=int, default=0,
+                        help='seed for every random choice during training',
+                        metavar='SEED')
+
     parser.add_argument('-u', '--used-feats', dest='used_feats', type=valid_file,
                         help='limit used features to those in FILE',
                         metavar='FILE')
@@ -89,10 +211,61 @@ def parse_args(parser=ArgumentParser()):
     parser.add_argument('--input-featurized', dest='inp_featurized', action='store_true', default=False,
                         help='use training events in FILE (already featurized input, see {train,tag}-featurize)')
 
+    parser.add_argument('--save-dataset', dest='save_dataset_dir',
+                        help='write the featurized input as binary dataset to DIR (train-featurize, tag-featurize)',
+                        metavar='DIR')
+
+    parser.add_argument('--load-dataset', dest='load_dataset_dir', type=valid_dataset_dir,
+                        help='use the binary dataset in DIR instead of featurizing the input '
+                             '(see --save-dataset)',
+                        metavar='DIR')
+
     parser.add_argument('-w', '--num-weights', dest='num_weights', type=int, default=100,
                         help='Print only the first N weights',
                         metavar='N')
 
+    parser.add_argument('--weight-threshold', dest='weight_threshold', type=float,
+                        help='drop the features whose maximal absolute weight is below T (compact-model)',
+                        metavar='T')
+
+    parser.add_argument('--quantize', dest='quantize', choices=['float16', 'int8'],
+                        help='store the coefficients as float16 or as int8 with per-label scales (compact-model)')
+
+    parser.add_argument('--compact-model', dest='compact_model_name',
+                        help='name of the compact model set to be written (compact-model)',
+                        metavar='NAME')
+
+    parser.add_argument('--weights-format', dest='weights_format', choices=['columns', 'tsv'], default='columns',
+                        help='print-weights output: two lines per label (columns, default) or one line per label and '
+                             'feature (tsv: label, best/worst, rank, feature, weight)')
+
+    parser.add_argument('--socket', dest='socket_path',
+                        help='the Unix socket to serve the tagger on (serve, see python3 -m huntag.client)',
+                        metavar='PATH')
+
+    parser.add_argument('--http', dest='http_address',
+                        help='serve the tagger over HTTP on [HOST:]PORT with micro-batching (serve, see '
+                             'python3 -m huntag.loadgen)',
+                        metavar='[HOST:]PORT')
+
+    parser.add_argument('--max-batch-size', dest='max_batch_size', type=int, default=64,
+                        help='tag at most N sentences of the requests at once (serve --http, default: 64)',
+                        metavar='N')
+
+    parser.add_argument('--max-batch-wait', dest='max_batch_wait', type=float, default=5.0,
+                        help='wait at most MS milliseconds for more sentences to fill a batch (serve --http, '
+                             'default: 5)',
+                        metavar='MS')
+
+    parser.add_argument('--max-pending', dest='max_pending', type=int, default=10000,
+                        help='reject the requests (503) while N sentences are waiting (serve --http, default: 10000)',
+                        metavar='N')
+
+    parser.add_argument('--request-timeout', dest='request_timeout', type=float, default=30.0,
+                        help='answer 408/504 if a request is not received/tagged in S seconds (serve --http, '
+                             'default: 30)',
+                        metavar='S')
+
     parser.add_argument('-d', '--input-dir', dest='io_dirs', type=valid_dir,
                         help='process all files in DIR (instead of stdin)',
                         metavar='DIR')
@@ -103,11 +276,148 @@ def parse_args(parser=ArgumentParser()):
         print('Error: -i/--input and -d/--input-dir are mutually exclusive arguments!', file=sys.stderr)
         sys.exit(1)
 
+    if options.mini_batch_size is not None:
+        if options.task not in {'train', 'train-all'}:
+            print('Error: --mini-batch can only be used with train and train-all tasks!', file=sys.stderr)
+            sys.exit(1)
+        if options.input_stream == sys.stdin or not options.input_stream.seekable():
+            print('Error: --mini-batch reads the input multiple times, use -i/--input with a file!', file=sys.stderr)
+            sys.exit(1)
+
+    if options.subsample is not None and not 0.0 < options.subsample <= 1.0:
+        print('Error: --subsample must be greater than 0 and at most 1!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.subsample_report and (options.task not in {'train', 'train-all'} or options.subsample is None):
+        print('Error: --subsample-report can only be used with train and train-all tasks and --subsample!',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if options.subsample is not None and options.mini_batch_size is not None:
+        print('Error: --subsample and --mini-batch are mutually exclusive arguments!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.deduplicate and options.mini_batch_size is not None:
+        print('Error: --deduplicate and --mini-batch are mutually exclusive arguments!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.sparsity is not None:
+        if options.task not in {'train', 'train-all'} or options.mini_batch_size is not None:
+            print('Error: --sparsity can only be used with train and train-all tasks without --mini-batch!',
+                  file=sys.stderr)
+            sys.exit(1)
+        if not 0.0 < options.sparsity < 1.0 or not 0.0 <= options.l1_ratio <= 1.0:
+            print('Error: --sparsity must be between 0 and 1 and --l1-ratio must be at least 0 and at most 1!',
+                  file=sys.stderr)
+            sys.exit(1)
+
+    if options.one_vs_rest and options.mini_batch_size is not None:
+        print('Error: --one-vs-rest and --mini-batch are mutually exclusive arguments!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.continue_from is not None:
+        if options.task not in {'train', 'transmodel-train', 'train-all'}:
+            print('Error: --continue-from can only be used with train, transmodel-train and train-all tasks!',
+                  file=sys.stderr)
+            sys.exit(1)
+        if options.load_dataset_dir is not None or options.one_vs_rest or options.sparsity is not None:
+            print('Error: --continue-from can not be used with --load-dataset, --one-vs-rest or --sparsity!',
+                  file=sys.stderr)
+            sys.exit(1)
+        exts = {'train': ('.model', '.featureNumbers.gz', '.labelNumbers.gz'),
+                'transmodel-train': ('.transmodel',),
+                'train-all': ('.model', '.featureNumbers.gz', '.labelNumbers.gz', '.transmodel')}
+        for ext in exts[options.task]:
+            if not isfile('{0}{1}'.format(options.continue_from, ext)):
+                print('Error: {0}{1} does not exist!'.format(options.continue_from, ext), file=sys.stderr)
+                sys.exit(1)
+
+    if options.task == 'tag' and options.jobs != 1 and \
+            (not options.use_bundle or options.inp_featurized or options.io_dirs is not None or
+             options.load_dataset_dir is not None):
+        print('Error: tag with -j/--jobs requires --bundle and can not be used with --input-featurized, '
+              '-d/--input-dir or --load-dataset!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.threads != 1 and (options.task != 'tag' or options.jobs != 1 or options.io_dirs is not None or
+                                 options.load_dataset_dir is not None):
+        print('Error: --threads can only be used with tag and can not be used with -j/--jobs, -d/--input-dir or '
+              '--load-dataset!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.cache_file is not None and (options.task != 'tag' or options.jobs != 1 or options.threads != 1 or
+                                           options.inp_featurized or options.io_dirs is not None or
+                                           options.load_dataset_dir is not None or options.cache_size < 1):
+        print('Error: --cache can only be used with tag and can not be used with -j/--jobs, --threads, '
+              '--input-featurized, -d/--input-dir or --load-dataset, --cache-size must be positive!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.score_cache_size is not None and (options.task != 'tag' or options.inp_featurized or
+                                                 options.load_dataset_dir is not None or options.score_cache_size < 1):
+        print('Error: --score-cache can only be used with tag and can not be used with --input-featurized or '
+              '--load-dataset, N must be positive!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.use_bundle and options.task not in {'tag', 'print-weights', 'tag-featurize', 'serve'}:
+        print('Error: --bundle can only be used with tag, print-weights, tag-featurize and serve tasks!',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if options.verify_bundle and not options.use_bundle:
+        print('Error: --verify-bundle can only be used with --bundle!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.task == 'serve' and ((options.socket_path is None) == (options.http_address is None) or
+                                    options.inp_featurized or options.io_dirs is not None or
+                                    options.load_dataset_dir is not None):
+        print('Error: serve requires either --socket or --http and can not be used with --input-featurized, '
+              '-d/--input-dir or --load-dataset!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.http_address is not None and (options.task != 'serve' or options.jobs != 1 or
+                                             options.max_batch_size < 1 or options.max_batch_wait < 0 or
+                                             options.max_pending < 1 or options.request_timeout <= 0):
+        print('Error: --http can only be used with serve without -j/--jobs, --max-batch-size and --max-pending must '
+              'be positive, --max-batch-wait must be at least 0 and --request-timeout must be positive!',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if options.task == 'compact-model' and (options.compact_model_name is None or
+                                            (options.weight_threshold is None and options.quantize is None)):
+        print('Error: compact-model requires --compact-model and --weight-threshold or --quantize!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.task == 'train-sweep' and options.sweep_grid is None:
+        print('Error: train-sweep requires --grid!', file=sys.stderr)
+        sys.exit(1)
+
+    if not 0.0 < options.held_out < 1.0:
+        print('Error: --held-out must be between 0 and 1!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.save_dataset_dir is not None and options.task not in {'train-featurize', 'tag-featurize'}:
+        print('Error: --save-dataset can only be used with train-featurize and tag-featurize tasks!', file=sys.stderr)
+        sys.exit(1)
+
+    if options.load_dataset_dir is not None and \
+            options.task not in {'train', 'most-informative-features', 'train-featurize', 'tag', 'train-sweep',
+                                 'evaluate'}:
+        print('Error: --load-dataset can only be used with train, most-informative-features, train-featurize, '
+              'train-sweep, evaluate and tag tasks!', file=sys.stderr)
+        sys.exit(1)
+
     # Put together model filenames...
     options.model_filename = '{0}{1}'.format(options.model_name, options.model_ext)
     options.featcounter_filename = '{0}{1}'.format(options.model_name, options.featurenumbers_ext)
     options.labelcounter_filename = '{0}{1}'.format(options.model_name, options.labelnumbers_ext)
     options.transmodel_filename = '{0}{1}'.format(options.model_name, options.transmodel_ext)
+    options.bundle_filename = '{0}{1}'.format(options.model_name, options.bundle_ext)
+    if options.compact_model_name is not None:
+        options.compact_options = {
+            'model_filename': '{0}{1}'.format(options.compact_model_name, options.model_ext),
+            'featcounter_filename': '{0}{1}'.format(options.compact_model_name, options.featurenumbers_ext),
+            'labelcounter_filename': '{0}{1}'.format(options.compact_model_name, options.labelnumbers_ext),
+            'transmodel_filename': '{0}{1}'.format(options.compact_model_name, options.transmodel_ext)}
 
     if options.inp_featurized and options.task in {'train-featurize', 'tag-featurize'}:
         print('Error: Can not featurize input, which is already featurized according to CLI options!', file=sys.stderr,
@@ -136,7 +446,7 @@ def load_options_and_features(opts, source_fields, target_fields):
     options.update(opts)  # Update defaults with supplied options
 
     # Load features
-    if options['inp_featurized']:  # Use with featurized input or raw input
+    if options['inp_featurized'] or options.get('load_dataset_dir') is not None:  # Featurized input or raw input
         features = None
     elif 'features' not in options:  # Load features
         features = get_featureset_yaml(options['cfg_file'])
@@ -152,7 +462,8 @@ def load_options_and_features(opts, source_fields, target_fields):
     source_fields = source_fields
     target_fields = target_fields
 
-    source_fields = source_fields.union({field for feat in features.values() for field in feat.fields})
+    if features is not None:
+        source_fields = source_fields.union({field for feat in features.values() for field in feat.fields})
     return features, source_fields, target_fields, options
 
 
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+bundle.py is a module of HunTag and is used to pack a model set (observation model, vocabularies, transition model,
+feature plan and lexicons) into one versioned, memory-mappable file
+
+File layout: magic, format version (uint32), header length (uint64), SHA-256 checksum of the rest of the file,
+UTF-8 JSON header, then the arrays each aligned to ALIGNMENT bytes. The header holds the metadata and the dtype, shape
+and offset (from the start of the payload) of each array
+"""
+
+import sys
+import json
+import gzip
+import mmap
+import hashlib
+from zlib import crc32
+from collections import namedtuple
+
+import numpy as np
+
+from .feature import Feature, Lexicon
+from .transmodel import TransModel
+from .quantized import QuantizedLinearModel
+from .version import __version__
+
+BUNDLE_MAGIC = b'HUNTAGMB'
+BUNDLE_VERSION = 1
+ALIGNMENT = 64
+PREFIX_LEN = len(BUNDLE_MAGIC) + 4 + 8 + 32  # Magic, version, header length, checksum
+
+ModelBundle = namedtuple('ModelBundle', ['model', 'feat_counter', 'label_counter', 'trans_model', 'features',
+                                         'metadata'])
+
+
+class MappedVocabulary:
+    """
+    Read-only name <-> number mapping on (memory-mapped) arrays with the interface of BookKeeper used by the Tagger.
+     The UTF-8 encoded names are concatenated in number order (offsets: the start of each name and the end of the last)
+     and an open addressing hash table (CRC32, linear probing) holds the number of the name in each slot (-1: empty),
+     so nothing is decoded or hashed when it is loaded
+    """
+    def __init__(self, blob, offsets, table):
+        self._blob = memoryview(blob)  # Indexing memoryviews yields Python objects (faster than numpy scalars)
+        self._offsets = memoryview(offsets)
+        self._table = memoryview(table)
+        self._mask = len(table) - 1
+        self.no_to_name = self  # no_to_name[no] and len(no_to_name) as with BookKeeper
+
+    @staticmethod
+    def build_arrays(names):
+        """
+        :return: the blob, the offsets and the hash table of the names (numbered in the given order)
+        """
+        encoded = [name.encode('UTF-8') for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(name) for name in encoded])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        size = 8
+        while size < 2 * len(encoded):  # Load factor at most 0.5
+            size *= 2
+        mask = size - 1
+        table = [-1] * size
+        for no, name in enumerate(encoded):
+            slot = crc32(name) & mask
+            while table[slot] != -1:
+                slot = (slot + 1) & mask
+            table[slot] = no
+        return blob, offsets, np.array(table, dtype=np.int64)
+
+    def get_no_tag(self, name):
+        encoded = name.encode('UTF-8')
+        table, offsets, blob, mask = self._table, self._offsets, self._blob, self._mask
+        slot = crc32(encoded) & mask
+        no = table[slot]
+        while no != -1:
+            if blob[offsets[no]:offsets[no + 1]] == encoded:
+                return no
+            slot = (slot + 1) & mask
+            no = table[slot]
+        return None
+
+    def __contains__(self, name):
+        return self.get_no_tag(name) is not None
+
+    def __getitem__(self, no):
+        return str(self._blob[self._offsets[no]:self._offsets[no + 1]], 'UTF-8')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def num_of_names(self):
+        return len(self._offsets) - 1
+
+    def save(self, filename):
+        with gzip.open(filename, mode='wt', encoding='UTF-8') as f:
+            f.writelines('{}\t{}\n'.format(self[no], no) for no in range(len(self)))
+
+
+def _add_vocabulary(arrays, prefix, names):
+    arrays['{0}.blob'.format(prefix)], arrays['{0}.offsets'.format(prefix)], arrays['{0}.table'.format(prefix)] = \
+        MappedVocabulary.build_arrays(names)
+
+
+def _get_vocabulary(arrays, prefix):
+    return MappedVocabulary(arrays['{0}.blob'.format(prefix)], arrays['{0}.offsets'.format(prefix)],
+                            arrays['{0}.table'.format(prefix)])
+
+
+def save_bundle(file_name, model, feat_counter, label_counter, trans_model, features):
+    """
+    Write the model set into one file. The coefficients are stored transposed (features x labels) as in
+     QuantizedLinearModel (float64 unless the model is already quantized), the lexicons are compiled to hash tables
+    :return: the size of the file in bytes
+    """
+    if not isinstance(model, QuantizedLinearModel):
+        model = QuantizedLinearModel(model, 'float64')
+    weights, scales, intercept, classes, dtype, use_softmax = model.arrays()
+    arrays = {'model.weights': weights, 'model.scales': scales, 'model.intercept': intercept,
+              'model.classes': np.asarray(classes)}
+    _add_vocabulary(arrays, 'features', [feat_counter.no_to_name[no] for no in range(feat_counter.num_of_names())])
+    _add_vocabulary(arrays, 'labels', [label_counter.no_to_name[no] for no in range(label_counter.num_of_names())])
+    symbols, (unigram, bigram, trigram), trans_params = trans_model.to_tensors()
+    arrays['trans.unigram'], arrays['trans.bigram'], arrays['trans.trigram'] = unigram, bigram, trigram
+
+    feature_plan = []
+    for name, feature in (features or {}).items():
+        feature_plan.append({'kind': feature.kind, 'name': name, 'action_name': feature.action_name,
+                             'fields': feature.fields, 'radius': feature.radius, 'cutoff': feature.cutoff,
+                             'options': feature.options})
+        if feature.kind == 'lex':
+            for part in ('phrase_list', 'end_parts', 'start_parts', 'mid_parts'):
+                _add_vocabulary(arrays, 'lex.{0}.{1}'.format(name, part), sorted(getattr(feature.lexicon, part)))
+
+    metadata = {'huntag_version': __version__, 'model': {'dtype': dtype, 'softmax': use_softmax},
+                'trans_model': dict(trans_params, symbols=symbols), 'features': feature_plan}
+
+    # Lay out the payload, then checksum the header and the payload
+    array_table = {}
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        arrays[name] = arr
+        offset += -offset % ALIGNMENT
+        array_table[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset += arr.nbytes
+    header = json.dumps({'metadata': metadata, 'arrays': array_table}, ensure_ascii=False).encode('UTF-8')
+    header += b' ' * (-(PREFIX_LEN + len(header)) % ALIGNMENT)  # The payload starts aligned too
+
+    chunks = [header]
+    written = 0
+    for name, arr in arrays.items():
+        chunks.append(bytes(array_table[name]['offset'] - written))  # Padding
+        chunks.append(memoryview(arr).cast('B'))
+        written = array_table[name]['offset'] + arr.nbytes
+    checksum = hashlib.sha256()
+    for chunk in chunks:
+        checksum.update(chunk)
+
+    with open(file_name, 'wb') as fh:
+        fh.write(BUNDLE_MAGIC)
+        fh.write(np.array([BUNDLE_VERSION], dtype='<u4').tobytes())
+        fh.write(np.array([len(header)], dtype='<u8').tobytes())
+        fh.write(checksum.digest())
+        for chunk in chunks:
+            fh.write(chunk)
+        size = fh.tell()
+    return size
+
+
+def _map_bundle(file_name):
+    """
+    Memory-map the bundle and check its magic and version
+    :return: the mapped buffer, the length of the header
+    """
+    with open(file_name, 'rb') as fh:
+        buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)  # The mapping stays valid after close
+    if len(buffer) < PREFIX_LEN or buffer[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+        print('Error: {0} is not a HunTag model bundle!'.format(file_name), file=sys.stderr, flush=True)
+        sys.exit(1)
+    version = int(np.frombuffer(buffer, dtype='<u4', count=1, offset=len(BUNDLE_MAGIC))[0])
+    if version != BUNDLE_VERSION:
+        print('Error: {0} has bundle format version {1}, but version {2} is supported!'.
+              format(file_name, version, BUNDLE_VERSION), file=sys.stderr, flush=True)
+        sys.exit(1)
+    header_len = int(np.frombuffer(buffer, dtype='<u8', count=1, offset=len(BUNDLE_MAGIC) + 4)[0])
+    return buffer, header_len
+
+
+def verify_bundle(file_name):
+    """
+    Check the SHA-256 checksum of the header and the payload (every page of the file is read), exit if it does not
+     match. It is not done by load_bundle(), which reads only the pages used
+    """
+    buffer, _ = _map_bundle(file_name)
+    if hashlib.sha256(memoryview(buffer)[PREFIX_LEN:]).digest() != buffer[PREFIX_LEN - 32:PREFIX_LEN]:
+        print('Error: The checksum of {0} does not match, the file is corrupted!'.format(file_name), file=sys.stderr,
+              flush=True)
+        sys.exit(1)
+
+
+def load_bundle(file_name):
+    """
+    Memory-map the bundle and build the model set on the mapped arrays (the pages are shared by the processes which
+     map the same file and are read on first use, see verify_bundle() for the checksum)
+    :return: ModelBundle
+    """
+    buffer, header_len = _map_bundle(file_name)
+    header = json.loads(str(buffer[PREFIX_LEN:PREFIX_LEN + header_len], 'UTF-8'))
+    payload_start = PREFIX_LEN + header_len
+
+    arrays = {}
+    for name, desc in header['arrays'].items():
+        dtype = np.dtype(desc['dtype'])
+        count = int(np.prod(desc['shape'], dtype=np.int64))
+        if count == 0:  # Nothing to map (e.g. a lexicon without multi-word phrases)
+            arrays[name] = np.empty(desc['shape'], dtype=dtype)
+        else:
+            arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                         offset=payload_start + desc['offset']).reshape(desc['shape'])
+
+    metadata = header['metadata']
+    model = QuantizedLinearModel.from_arrays(arrays['model.weights'], arrays['model.scales'],
+                                             arrays['model.intercept'], arrays['model.classes'],
+                                             metadata['model']['dtype'], metadata['model']['softmax'])
+    trans_params = metadata['trans_model']
+    trans_model = TransModel.from_tensors(trans_params['symbols'], (arrays['trans.unigram'], arrays['trans.bigram'],
+                                                                    arrays['trans.trigram']), trans_params)
+    features = {}
+    for feat in metadata['features']:
+        lexicon = None
+        if feat['kind'] == 'lex':
+            lexicon = Lexicon()
+            for part in ('phrase_list', 'end_parts', 'start_parts', 'mid_parts'):
+                setattr(lexicon, part, _get_vocabulary(arrays, 'lex.{0}.{1}'.format(feat['name'], part)))
+        features[feat['name']] = Feature(feat['kind'], feat['name'], feat['action_name'], feat['fields'],
+                                         feat['radius'], feat['cutoff'], feat['options'], lexicon)
+
+    return ModelBundle(model, _get_vocabulary(arrays, 'features'), _get_vocabulary(arrays, 'labels'), trans_model,
+                       features, metadata)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+cache.py is a module of HunTag and is used to store the labels of the tagged sentences on disk (SQLite), so the
+ sentences tagged with the same model before (e.g. boilerplate in a re-tagged corpus) are not featurized and decoded
+ again. The key of a sentence is the hash of the model fingerprint (see Tagger.fingerprint()), the names of the
+ columns used by the features and the values of these columns in the sentence
+"""
+
+import sys
+import json
+import sqlite3
+import hashlib
+from time import time
+
+
+class TaggingCache:
+    """
+    Size-bounded persistent cache: the least recently used sentences are evicted above max_entries when it is closed
+    """
+    def __init__(self, file_name, max_entries=1000000, commit_every=1000):
+        self._db = sqlite3.connect(file_name)
+        self._db.execute('CREATE TABLE IF NOT EXISTS sentences (key BLOB PRIMARY KEY, labels TEXT NOT NULL, '
+                         'last_used INTEGER NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sentences_last_used ON sentences (last_used)')
+        self._max_entries = max_entries
+        self._commit_every = commit_every
+        self._now = int(time())
+        self._new_entries = {}  # Written in batches
+        self._used_keys = set()  # The last use of the hits is updated in one batch
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: the labels of the sentence or None
+        """
+        labels = self._new_entries.get(key)
+        if labels is None:
+            row = self._db.execute('SELECT labels FROM sentences WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                labels = row[0].split('\n')
+                self._used_keys.add(key)
+        if labels is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return labels
+
+    def put(self, key, labels):
+        self._new_entries[key] = labels
+        if len(self._new_entries) >= self._commit_every:
+            self._flush()
+
+    def _flush(self):
+        with self._db:  # One transaction
+            self._db.executemany('INSERT OR REPLACE INTO sentences VALUES (?, ?, ?)',
+                                 (((key, '\n'.join(labels), self._now) for key, labels in self._new_entries.items())))
+            self._db.executemany('UPDATE sentences SET last_used = ? WHERE key = ?',
+                                 ((self._now, key) for key in self._used_keys))
+        self._new_entries.clear()
+        self._used_keys.clear()
+
+    def close(self):
+        """
+        Write the new sentences, evict the least recently used ones above the size limit
+        :return: the number of entries and the number of evicted entries
+        """
+        self._flush()
+        with self._db:
+            entries = self._db.execute('SELECT COUNT(*) FROM sentences').fetchone()[0]
+            evicted = max(0, entries - self._max_entries)
+            if evicted > 0:
+                self._db.execute('DELETE FROM sentences WHERE key IN '
+                                 '(SELECT key FROM sentences ORDER BY last_used LIMIT ?)', (evicted,))
+        if evicted > 0:
+            self._db.execute('VACUUM')  # Give the space back
+        self._db.close()
+        return entries - evicted, evicted
+
+
+class CachedTagger:
+    """
+    xtsv module which tags the sentences with the Tagger only if they are not in the cache
+    """
+    pass_header = True
+
+    def __init__(self, tagger, cache):
+        self._tagger = tagger
+        self._cache = cache
+        self._fingerprint = tagger.fingerprint().encode('UTF-8')
+        self.source_fields = tagger.source_fields
+        self.target_fields = tagger.target_fields
+
+    def prepare_fields(self, field_names):
+        bound_fields = self._tagger.prepare_fields(field_names)
+        key_fields = sorted({field for feature in bound_fields.features.values() for field in feature.fields})
+        key_prefix = self._fingerprint + json.dumps(key_fields).encode('UTF-8')
+        return bound_fields, [field_names[field] for field in key_fields], key_prefix
+
+    def process_sentence(self, sen, prepared_fields):
+        bound_fields, key_indices, key_prefix = prepared_fields
+        checksum = hashlib.blake2b(key_prefix, digest_size=16)
+        for tok in sen:
+            checksum.update('{0}\n'.format('\t'.join(tok[i] for i in key_indices)).encode('UTF-8'))
+        key = checksum.digest()
+
+        labels = self._cache.get(key)
+        if labels is not None:
+            return self._tagger.add_tagging(sen, labels, bound_fields.tag_index)
+        tagged_sen = self._tagger.process_sentence(sen, bound_fields)
+        self._cache.put(key, [tok[bound_fields.tag_index] for tok in tagged_sen])
+        return tagged_sen
+
+    def close(self):
+        """
+        Close the cache and report its hit rate
+        """
+        entries, evicted = self._cache.close()
+        hits, sentences = self._cache.hits, self._cache.hits + self._cache.misses
+        print('tagging cache: {0} of {1} sentences hit ({2:.1%}), {3} added, {4} evicted, {5} entries'.
+              format(hits, sentences, hits / max(sentences, 1), self._cache.misses, evicted, entries),
+              file=sys.stderr, flush=True)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+client.py is a module of HunTag and is used to tag a document with a running tagger server (huntag serve)
+ using only the standard library, so it starts fast:
+
+    python3 -m huntag.client --socket PATH < INPUT > OUTPUT
+"""
+
+import sys
+import socket
+from threading import Thread
+from argparse import ArgumentParser, FileType
+
+ERROR_MARK = '\0ERROR\t'  # See server.py (not imported to keep the client light)
+
+
+def tag_with_server(socket_path, input_stream, output_stream):
+    """
+    Stream the input to the server while the output is read back (so large documents do not block on full buffers)
+    :return: True on success, False if the server reported an error
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+
+        def send():
+            with sock.makefile('w', encoding='UTF-8') as out_stream:
+                try:
+                    for line in input_stream:
+                        out_stream.write(line)
+                except BrokenPipeError:  # The server stopped reading (error)
+                    return
+            sock.shutdown(socket.SHUT_WR)
+
+        sender = Thread(target=send, daemon=True)
+        sender.start()
+        success = True
+        with sock.makefile('r', encoding='UTF-8') as in_stream:
+            for line in in_stream:
+                if line.startswith(ERROR_MARK):
+                    print('Error: {0}'.format(line[len(ERROR_MARK):].rstrip('\n')), file=sys.stderr, flush=True)
+                    success = False
+                    break
+                output_stream.write(line)
+        sender.join()
+    return success
+
+
+def main():
+    parser = ArgumentParser(description='HunTag3 client for the tagger server (huntag serve --socket PATH)')
+    parser.add_argument('-s', '--socket', dest='socket_path', required=True,
+                        help='the Unix socket of the server', metavar='PATH')
+    parser.add_argument('-i', '--input', dest='input_stream', type=FileType(encoding='UTF-8'), default=sys.stdin,
+                        help='use input file instead of STDIN', metavar='FILE')
+    parser.add_argument('-o', '--output', dest='output_stream', type=FileType('w', encoding='UTF-8'),
+                        default=sys.stdout, help='use output file instead of STDOUT', metavar='FILE')
+    opts = parser.parse_args()
+    try:
+        success = tag_with_server(opts.socket_path, opts.input_stream, opts.output_stream)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print('Error: No server is listening on {0}!'.format(opts.socket_path), file=sys.stderr, flush=True)
+        sys.exit(1)
+    except ConnectionResetError:  # e.g. the server was shut down before serving this client
+        print('Error: The server closed the connection!', file=sys.stderr, flush=True)
+        sys.exit(1)
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,15 +9,17 @@ created by the getFeatureSet function in __main__.py.
 import sys
 
 from . import features
+from .registry import registry
 
 
 class Feature:
-    def __init__(self, kind, name, action_name, fields, radius, cutoff, options):
+    def __init__(self, kind, name, action_name, fields, radius, cutoff, options, lexicon=None):
         self.kind = kind
         self.name = name
         self.action_name = action_name
         self.fields = fields
         self.field_indices = None
+        self.lexicon_key = None
         self.radius = int(radius)
         self.cutoff = int(cutoff)
         self.options = options
@@ -29,7 +31,9 @@ class Feature:
             if len(self.options) > 0:
                 print('Lexicon features do not yet support options', file=sys.stderr, flush=True)
                 sys.exit(1)
-            self.lexicon = Lexicon(action_name)  # Load input file
+            if lexicon is None:  # Load input file (or share the one loaded by an other Feature in the process)
+                self.lexicon_key, lexicon = registry.acquire('lexicon', [action_name], Lexicon)
+            self.lexicon = lexicon  # Or use the supplied one (e.g. from a model bundle)
 
         elif self.kind in ('token', 'sentence'):
             function_name = '{0}_{1}'.format(self.kind, self.action_name)
@@ -41,6 +45,14 @@ class Feature:
             print('Unknown kind named {0}'.format(self.kind), file=sys.stderr, flush=True)
             sys.exit(1)
 
+    def release(self):
+        """
+        Release the shared lexicon (see registry.py)
+        """
+        if self.lexicon_key is not None:
+            registry.release(self.lexicon_key)
+            self.lexicon_key = None
+
     def eval_sentence(self, sentence):
         if self.kind == 'token':
             # Pick the relevant fields (label can be not just the last field)
@@ -75,11 +87,13 @@ class Lexicon:
     the Lexicon class generates so-called lexicon features
     an instance of Lexicon() should be initialized for each lexicon file
     """
-    def __init__(self, input_file):
+    def __init__(self, input_file=None):
         self.phrase_list = set()
         self.end_parts = set()
         self.mid_parts = set()
         self.start_parts = set()
+        if input_file is None:  # The sets are filled by the caller (e.g. from a model bundle)
+            return
         with open(input_file, encoding='UTF-8') as fh:
             for line in fh:
                 phrase = line.strip()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+http_server.py is a module of HunTag and is used to serve a loaded Tagger over HTTP (asyncio) tagging the sentences
+ of concurrent requests together in micro-batches (see loadgen.py for measuring it)
+
+Endpoints: POST /tag with a TSV document (header, sentences) as body, the tagged TSV document is sent back;
+ GET /stats for the counters of the server (JSON)
+"""
+
+import sys
+import json
+import signal
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from xtsv.tsvhandler import process_header, sentence_iterator, HeaderError
+
+_Item = namedtuple('_Item', ['field_names', 'sentence', 'future'])
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 408: 'Request Timeout',
+            411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error',
+            503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+class _HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MicroBatcher:
+    """
+    Collect the sentences of concurrent requests and tag them in batches of at most max_batch_size sentences:
+     a batch is started when it is full or max_wait seconds after its first sentence arrived. The batches are
+     featurized, scored (one predict_proba() call for the unique rows) and decoded in a worker thread one after
+     the other, so the event loop keeps accepting requests meanwhile. At most max_pending sentences wait at a time
+     (backpressure: the requests above the limit are rejected at once instead of queueing without bound)
+    """
+    def __init__(self, tagger, max_batch_size=64, max_wait=0.005, max_pending=10000):
+        self._tagger = tagger
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._max_pending = max_pending
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+        self.pending = 0
+        self.stats = {'requests': 0, 'rejected': 0, 'timed_out': 0, 'sentences': 0, 'batches': 0}
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown()
+
+    async def tag(self, field_names, sentences, timeout):
+        """
+        :return: the tagged sentences, raises _HTTPError if the server is overloaded or the timeout is exceeded
+        """
+        if self.pending + len(sentences) > self._max_pending:
+            self.stats['rejected'] += 1
+            raise _HTTPError(503, 'The server is overloaded ({0} sentences are waiting), try again later!'.
+                             format(self.pending))
+        self.stats['requests'] += 1
+        self.pending += len(sentences)
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in sentences]
+        for sen, future in zip(sentences, futures):
+            self._queue.put_nowait(_Item(field_names, sen, future))
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        except asyncio.TimeoutError:  # The sentences not yet tagged are cancelled (skipped by the batch loop)
+            self.stats['timed_out'] += 1
+            raise _HTTPError(504, 'The request was not tagged in {0} seconds!'.format(timeout))
+        finally:
+            self.pending -= len(sentences)
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self._queue.get_nowait())
+            batch = [item for item in batch if not item.future.done()]  # Drop the cancelled ones
+            if len(batch) == 0:
+                continue
+            results = await loop.run_in_executor(self._executor, self._tag_batch, batch)
+            self.stats['batches'] += 1
+            self.stats['sentences'] += len(batch)
+            for item, result in zip(batch, results):
+                if item.future.done():
+                    continue
+                if isinstance(result, Exception):
+                    item.future.set_exception(result)
+                else:
+                    item.future.set_result(result)
+
+    def _tag_batch(self, batch):
+        """
+        Runs in the worker thread
+        :return: the tagged sentence or the exception for each item
+        """
+        tagger = self._tagger
+        results, feat_numbers, tagged_items = [None] * len(batch), [], []
+        bound_field_names, bound_fields = None, None
+        for i, item in enumerate(batch):
+            try:
+                if item.field_names is not bound_field_names:  # The sentences of a request are consecutive
+                    bound_fields = tagger.prepare_fields(item.field_names)
+                    bound_field_names = item.field_names
+                feat_numbers.append(tagger.featurize(item.sentence, bound_fields.features))
+                tagged_items.append(i)
+            except Exception as e:  # Only the request of the wrong sentence fails
+                results[i] = e
+        try:
+            best_taggings = tagger.tag_batch(feat_numbers) if len(feat_numbers) > 0 else []
+        except Exception as e:
+            return [e] * len(batch)
+        for i, best_tagging in zip(tagged_items, best_taggings):
+            item = batch[i]
+            results[i] = tagger.add_tagging(item.sentence, best_tagging, item.field_names[tagger.target_fields[0]])
+        return results
+
+
+async def _read_request(reader, max_body_size):
+    """
+    :return: the method, the path, the headers (lowercase names) and the body of the request or None at EOF
+    """
+    request_line = await reader.readline()
+    if len(request_line) == 0:
+        return None
+    try:
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise _HTTPError(400, 'Malformed request line!')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in {b'\r\n', b'\n', b''}:
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = b''
+    if method == 'POST':
+        if 'content-length' not in headers:
+            raise _HTTPError(411, 'Content-Length is required!')
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise _HTTPError(400, 'Malformed Content-Length!')
+        if length > max_body_size:
+            raise _HTTPError(413, 'The body is larger than {0} bytes!'.format(max_body_size))
+        body = await reader.readexactly(length)
+    return method, path, headers, body
+
+
+def _write_response(writer, status, body, content_type='text/plain; charset=utf-8', keep_alive=True):
+    body = body.encode('UTF-8')
+    writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: {2}\r\nContent-Length: {3}\r\nConnection: {4}\r\n\r\n'.
+                 format(status, _REASONS[status], content_type, len(body), 'keep-alive' if keep_alive else 'close').
+                 encode('latin-1') + body)
+
+
+def _parse_document(tagger, body, conll_comments):
+    """
+    :return: the output header, the field names (see xtsv) and the sentences of the TSV document
+    """
+    lines = iter(body.decode('UTF-8').splitlines(keepends=True))
+    header = next(lines, None)
+    if header is None:
+        raise _HTTPError(400, 'The document is empty!')
+    track_stream = {'file_name': 'request', 'curr_line_number': 1}
+    try:
+        header, field_names = process_header(header.strip().split('\t'), tagger.source_fields, tagger.target_fields,
+                                             track_stream)
+    except HeaderError as e:
+        raise _HTTPError(400, str(e))
+    # Comments are allowed (and dropped) if conll_comments is set
+    sentences = [sen for sen, _ in sentence_iterator(lines, conll_comments, track_stream)]
+    return header, field_names, sentences
+
+
+async def _handle_request(batcher, tagger, method, path, body, request_timeout, conll_comments):
+    """
+    :return: the status, the body and the content type of the response
+    """
+    if path == '/stats':
+        if method != 'GET':
+            raise _HTTPError(405, 'Use GET!')
+        scoring = tagger.scoring_stats  # The share of the rows scored (see predict_proba_unique())
+        stats = dict(batcher.stats, pending=batcher.pending,
+                     mean_batch_size=batcher.stats['sentences'] / max(batcher.stats['batches'], 1),
+                     scored_rows=scoring['rows'], unique_rows=scoring['unique_rows'],
+                     unique_row_ratio=scoring['unique_rows'] / max(scoring['rows'], 1),
+                     last_batch_unique_row_ratio=scoring['last_batch_unique_row_ratio'])
+        return 200, json.dumps(stats), 'application/json'
+    if path != '/tag':
+        raise _HTTPError(404, 'Unknown path: {0}'.format(path))
+    if method != 'POST':
+        raise _HTTPError(405, 'Use POST!')
+    try:
+        header, field_names, sentences = _parse_document(tagger, body, conll_comments)
+    except UnicodeDecodeError:
+        raise _HTTPError(400, 'The document is not UTF-8!')
+    try:
+        tagged_sentences = await batcher.tag(field_names, sentences, request_timeout)
+    except _HTTPError:
+        raise
+    except Exception as e:  # E.g. a missing column in a sentence
+        raise _HTTPError(400, str(e))
+    output = [header]
+    for sen in tagged_sentences:
+        output.extend('{0}\n'.format('\t'.join(tok)) for tok in sen)
+        output.append('\n')
+    return 200, ''.join(output), 'text/tab-separated-values; charset=utf-8'
+
+
+async def _handle_connection(reader, writer, batcher, tagger, options, idle):
+    """
+    Serve the requests of a (keep-alive) connection. The task is in the idle set while it waits for a request
+    """
+    task = asyncio.current_task()
+    try:
+        while not options['stopping'].is_set():
+            idle.add(task)
+            try:
+                request = await asyncio.wait_for(_read_request(reader, options['max_body_size']),
+                                                 options['request_timeout'])
+            except asyncio.TimeoutError:
+                _write_response(writer, 408, 'The request was not received in time!\n', keep_alive=False)
+                break
+            except _HTTPError as e:  # The rest of the stream can not be interpreted
+                _write_response(writer, e.status, '{0}\n'.format(e), keep_alive=False)
+                break
+            finally:
+                idle.discard(task)
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get('connection', '').lower() != 'close' and not options['stopping'].is_set()
+            try:
+                status, response, content_type = await _handle_request(batcher, tagger, method, path, body,
+                                                                       options['request_timeout'],
+                                                                       options['conll_comments'])
+            except _HTTPError as e:
+                status, response, content_type = e.status, '{0}\n'.format(e), 'text/plain; charset=utf-8'
+            _write_response(writer, status, response, content_type, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+        pass  # The client has gone or the server is shutting down
+    finally:
+        writer.close()
+
+
+def serve_http(tagger, address, max_batch_size=64, max_wait=0.005, max_pending=10000, request_timeout=30.0,
+               max_body_size=64 * 1024 * 1024, conll_comments=False):
+    """
+    Serve the loaded tagger over HTTP on address ([HOST:]PORT) until SIGTERM or SIGINT, which shuts the server down
+     gracefully: no new connection is accepted and the requests being tagged are finished
+    """
+    host, _, port = address.rpartition(':')
+
+    async def main():
+        options = {'request_timeout': request_timeout, 'max_body_size': max_body_size,
+                   'conll_comments': conll_comments, 'stopping': asyncio.Event()}
+        batcher = MicroBatcher(tagger, max_batch_size, max_wait, max_pending)
+        batcher.start()
+        connections, idle = set(), set()
+
+        async def handle(reader, writer):
+            task = asyncio.current_task()
+            connections.add(task)
+            try:
+                await _handle_connection(reader, writer, batcher, tagger, options, idle)
+            finally:
+                connections.discard(task)
+
+        server = await asyncio.start_server(handle, host or 'localhost', int(port), backlog=1024)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, options['stopping'].set)
+        print('serving on http://{0}:{1}/tag (batches of at most {2} sentences, waiting at most {3} ms)...'.
+              format(host or 'localhost', port, max_batch_size, max_wait * 1000), file=sys.stderr, flush=True)
+        await options['stopping'].wait()
+
+        print('shutting down...', end='', file=sys.stderr, flush=True)
+        server.close()
+        while len(connections) > 0:  # The busy connections are closed after their response
+            for task in idle & connections:
+                task.cancel()
+            await asyncio.sleep(0.05)
+        await server.wait_closed()
+        await batcher.stop()
+        print('done', file=sys.stderr, flush=True)
+
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+loadgen.py is a module of HunTag and is used to measure the latency and the throughput of the HTTP tagger server
+ (huntag serve --http) at different numbers of concurrent clients using only the standard library:
+
+    python3 -m huntag.loadgen --url http://localhost:8080/tag -i INPUT -c 1,4,16 -d 10 > latency.tsv
+
+The sentences of the input are sent in requests of --sentences sentences (with the header of the input) by each
+ client on a keep-alive connection in a closed loop (the next request is sent when the response arrived)
+"""
+
+import sys
+import asyncio
+from math import ceil
+from time import perf_counter
+from urllib.parse import urlsplit
+from argparse import ArgumentParser, FileType
+
+
+def make_documents(input_stream, sentences_per_document):
+    """
+    :return: the TSV documents (UTF-8 encoded) of at most sentences_per_document sentences each
+    """
+    header = next(input_stream, '')
+    documents, sentences, sentence = [], [], []
+    for line in input_stream:
+        sentence.append(line)
+        if len(line.strip()) == 0:
+            sentences.append(''.join(sentence))
+            sentence = []
+            if len(sentences) == sentences_per_document:
+                documents.append(sentences)
+                sentences = []
+    if len(sentence) > 0:
+        sentences.append('{0}\n'.format(''.join(sentence)))
+    if len(sentences) > 0:
+        documents.append(sentences)
+    return [(header + ''.join(sentences)).encode('UTF-8') for sentences in documents], \
+        [len(sentences) for sentences in documents]
+
+
+async def _client(host, port, path, documents, start_index, end_time, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    i = start_index
+    try:
+        while perf_counter() < end_time:
+            body = documents[i % len(documents)]
+            start = perf_counter()
+            writer.write('POST {0} HTTP/1.1\r\nHost: {1}\r\nContent-Type: text/tab-separated-values\r\n'
+                         'Content-Length: {2}\r\n\r\n'.format(path, host, len(body)).encode('latin-1') + body)
+            status = int((await reader.readline()).split(b' ', 2)[1])
+            length, keep_alive = 0, True
+            while True:
+                line = await reader.readline()
+                if line in {b'\r\n', b''}:
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+                elif name.strip().lower() == 'connection':
+                    keep_alive = value.strip().lower() != 'close'
+            await reader.readexactly(length)
+            if status == 200:
+                latencies.append((perf_counter() - start, i % len(documents)))
+            else:
+                errors[status] = errors.get(status, 0) + 1
+            if not keep_alive:
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+            i += 1
+    finally:
+        writer.close()
+
+
+def percentile(values, p):
+    """
+    :return: the p-th percentile of the sorted values (nearest rank)
+    """
+    if len(values) == 0:
+        return float('nan')
+    return values[max(0, ceil(p / 100 * len(values)) - 1)]
+
+
+async def run_level(url, documents, concurrency, duration):
+    """
+    Run concurrency clients for duration seconds
+    :return: the latencies (seconds, document index) of the successful requests, the number of failed requests by
+     status and the elapsed time
+    """
+    parts = urlsplit(url)
+    latencies, errors = [], {}
+    start = perf_counter()
+    await asyncio.gather(*(_client(parts.hostname, parts.port or 80, parts.path or '/tag', documents,
+                                   c * len(documents) // concurrency, start + duration, latencies, errors)
+                           for c in range(concurrency)))
+    return latencies, errors, perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description='Load generator for the HunTag3 HTTP tagger server (huntag serve --http)')
+    parser.add_argument('-u', '--url', dest='url', default='http://localhost:8080/tag',
+                        help='the tagging endpoint of the server (default: http://localhost:8080/tag)', metavar='URL')
+    parser.add_argument('-i', '--input', dest='input_stream', type=FileType(encoding='UTF-8'), default=sys.stdin,
+                        help='the TSV input to send (use input file instead of STDIN)', metavar='FILE')
+    parser.add_argument('-o', '--output', dest='output_stream', type=FileType('w', encoding='UTF-8'),
+                        default=sys.stdout, help='use output file instead of STDOUT', metavar='FILE')
+    parser.add_argument('-s', '--sentences', dest='sentences', type=int, default=1,
+                        help='the number of sentences in each request (default: 1)', metavar='N')
+    parser.add_argument('-c', '--concurrency', dest='concurrency', default='1,4,16',
+                        help='comma separated numbers of concurrent clients (default: 1,4,16)', metavar='N,N,...')
+    parser.add_argument('-d', '--duration', dest='duration', type=float, default=10.0,
+                        help='the duration of each level in seconds (default: 10)', metavar='S')
+    opts = parser.parse_args()
+
+    documents, sentence_counts = make_documents(opts.input_stream, opts.sentences)
+    if len(documents) == 0:
+        print('Error: The input has no sentences!', file=sys.stderr, flush=True)
+        sys.exit(1)
+    print('Concurrency', 'Requests', 'Errors', 'Requests/s', 'Sentences/s', 'p50 (ms)', 'p99 (ms)', sep='\t',
+          file=opts.output_stream)
+    for concurrency in (int(c) for c in opts.concurrency.split(',')):
+        try:
+            latencies, errors, elapsed = asyncio.run(run_level(opts.url, documents, concurrency, opts.duration))
+        except OSError as e:
+            print('Error: Can not connect to {0}: {1}'.format(opts.url, e), file=sys.stderr, flush=True)
+            sys.exit(1)
+        sentences = sum(sentence_counts[doc] for _, doc in latencies)
+        latencies = sorted(latency for latency, _ in latencies)
+        print(concurrency, len(latencies), sum(errors.values()), '{0:.1f}'.format(len(latencies) / elapsed),
+              '{0:.1f}'.format(sentences / elapsed), '{0:.2f}'.format(percentile(latencies, 50) * 1000),
+              '{0:.2f}'.format(percentile(latencies, 99) * 1000), sep='\t', file=opts.output_stream, flush=True)
+        if len(errors) > 0:
+            print('Concurrency {0}: failed requests by status: {1}'.format(concurrency, errors), file=sys.stderr,
+                  flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+quantized.py is a module of HunTag and is used to store the observation model with quantized weights
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+quantized_dtypes = {'float64': np.float64, 'float16': np.float16, 'int8': np.int8}
+
+
+def uses_softmax(model):
+    """
+    Whether predict_proba() of the linear model is softmax (multinomial) instead of normalised one-vs-rest sigmoids
+     (only LogisticRegression has multi_class and solver, so scikit-learn need not be imported)
+    """
+    multi_class = getattr(model, 'multi_class', None)
+    return multi_class is not None and hasattr(model, 'solver') and not (
+        multi_class in {'ovr', 'warn'} or
+        (multi_class == 'auto' and (len(model.classes_) <= 2 or model.solver in {'liblinear', 'newton-cholesky'})))
+
+
+def softmax(scores):
+    exp_scores = np.exp(scores - scores.max(axis=1, keepdims=True))  # As scipy.special.softmax()
+    return exp_scores / exp_scores.sum(axis=1, keepdims=True)
+
+
+def expit(scores):
+    with np.errstate(over='ignore'):  # exp() overflows to inf for very negative scores: the result is 0
+        return 1 / (1 + np.exp(-scores))
+
+
+def scores_to_proba(scores, use_softmax):
+    """
+    The probabilities of the labels from the decision scores as predict_proba() of LogisticRegression: softmax
+     (multinomial) or normalised one-vs-rest sigmoids
+    """
+    if use_softmax:
+        if scores.ndim == 1:
+            scores = np.column_stack((-scores, scores))
+        return softmax(scores)
+    prob = expit(scores)
+    if prob.ndim == 1:
+        return np.column_stack((1 - prob, prob))
+    return prob / prob.sum(axis=1, keepdims=True)
+
+
+class QuantizedLinearModel:
+    """
+    Linear observation model with float16 or int8 coefficients (int8 with one scale for each label) which can be
+     used instead of the scikit-learn model (predict_proba(), classes_, coef_). The scores are computed on the
+     quantized weights: the weights of the features of each token are summed, then scaled
+    """
+    def __init__(self, model, dtype='int8'):
+        coefs = model.coef_
+        if issparse(coefs):
+            coefs = coefs.toarray()
+        coefs = np.asarray(coefs, dtype=np.float64)
+        if dtype == 'int8':
+            scales = np.abs(coefs).max(axis=1) / np.iinfo(np.int8).max
+            scales[scales == 0.0] = 1.0
+            weights = np.round(coefs / scales[:, np.newaxis])
+        else:
+            scales = np.ones(coefs.shape[0], dtype=np.float64)
+            weights = coefs
+        # Features x labels: the weights of a feature are contiguous
+        self._weights = np.ascontiguousarray(weights.T.astype(quantized_dtypes[dtype]))
+        self._scales = scales
+        self.dtype = dtype
+        self.intercept_ = np.asarray(model.intercept_, dtype=np.float64)
+        self.classes_ = model.classes_
+        self.n_features_in_ = coefs.shape[1]
+        self._softmax = uses_softmax(model)
+
+    @classmethod
+    def from_arrays(cls, weights, scales, intercept, classes, dtype, use_softmax):
+        """
+        Build the model on existing (e.g. memory-mapped) arrays without copying them (see arrays())
+        """
+        model = cls.__new__(cls)
+        model._weights, model._scales, model.intercept_, model.classes_ = weights, scales, intercept, classes
+        model.dtype = dtype
+        model.n_features_in_ = weights.shape[0]
+        model._softmax = use_softmax
+        return model
+
+    def arrays(self):
+        """
+        :return: the weights (features x labels), the scales, the intercepts, the classes, the dtype and the softmax
+         flag for from_arrays()
+        """
+        return self._weights, self._scales, self.intercept_, self.classes_, self.dtype, self._softmax
+
+    @property
+    def coef_(self):
+        return self._weights.T.astype(np.float64) * self._scales[:, np.newaxis]
+
+    def decision_function(self, x):
+        x = csr_matrix(x)
+        gathered = self._weights[x.indices].astype(np.float64)  # One row for each nonzero element
+        if not np.all(x.data == 1):
+            gathered *= x.data[:, np.newaxis]
+        scores = np.zeros((x.shape[0], self._weights.shape[1]), dtype=np.float64)
+        nonempty = np.flatnonzero(np.diff(x.indptr))  # Rows without features only have the intercept
+        if len(nonempty) > 0:
+            scores[nonempty] = np.add.reduceat(gathered, x.indptr[nonempty], axis=0)
+        scores = scores * self._scales + self.intercept_
+        if scores.shape[1] == 1:
+            return scores.ravel()
+        return scores
+
+    def predict_proba(self, x):
+        return scores_to_proba(self.decision_function(x), self._softmax)
+
+    def nbytes(self):
+        return self._weights.nbytes + self._scales.nbytes + self.intercept_.nbytes
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+registry.py is a module of HunTag and is used to share the loaded (read-only) model components between the Tagger
+ and Feature instances of a process: the components are keyed by the kind and the resolved file names, modification
+ times and sizes of their files, so each model set or lexicon is loaded once while it is unchanged on disk
+"""
+
+from os import stat
+from os.path import realpath
+from threading import Lock
+
+
+class ModelRegistry:
+    """
+    Loaded components with reference counts. acquire() loads the component or hands out the loaded one,
+     release() drops a reference, evict() removes the components which are not used anymore (they are kept until then,
+     so a new Tagger for the same model does not load it again)
+    """
+    def __init__(self):
+        self._entries = {}  # key -> [component, reference count]
+        self._lock = Lock()
+
+    @staticmethod
+    def make_key(kind, file_names):
+        files = []
+        for file_name in file_names:
+            file_name = realpath(file_name)
+            file_stat = stat(file_name)
+            files.append((file_name, file_stat.st_mtime_ns, file_stat.st_size))
+        return kind, tuple(files)
+
+    def acquire(self, kind, file_names, loader):
+        """
+        Get the component loaded from file_names (loader(*file_names) is called if it is not loaded yet)
+        :return: the key (for release()) and the shared component, which must not be modified
+        """
+        key = self.make_key(kind, file_names)
+        with self._lock:  # The others wait instead of loading the same files again
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [loader(*file_names), 0]
+                self._entries[key] = entry
+            entry[1] += 1
+            return key, entry[0]
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > 0:
+                entry[1] -= 1
+
+    def evict(self, kind=None):
+        """
+        Remove the components (of the kind if set) which are not used (they are freed when nothing else refers to them)
+        :return: the number of the removed components
+        """
+        with self._lock:
+            unused = [key for key, (_, ref_count) in self._entries.items()
+                      if ref_count == 0 and (kind is None or key[0] == kind)]
+            for key in unused:
+                del self._entries[key]
+        return len(unused)
+
+    def entries(self):
+        """
+        :return: the kind, the file names and the reference count of each loaded component
+        """
+        with self._lock:
+            return [(kind, [file_name for file_name, _, _ in files], ref_count)
+                    for (kind, files), (_, ref_count) in self._entries.items()]
+
+
+registry = ModelRegistry()  # Process-wide
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+scorer.py is a module of HunTag and is used to compute the emission scores of the linear observation model from
+ cached per-token blocks instead of the feature strings of each token of each sentence
+"""
+
+from collections import namedtuple, OrderedDict
+from threading import Lock
+
+import numpy as np
+from scipy.sparse import issparse
+
+from .quantized import QuantizedLinearModel, uses_softmax, scores_to_proba
+
+WindowPlan = namedtuple('WindowPlan', ['window_features', 'key_indices', 'radius', 'sentence_features'])
+
+
+class WindowScorer:
+    """
+    The token and lex features of a token depend only on the field values of its neighbours within the radius and
+     their offset, so the contribution of a token to the scores of its neighbours is one block (offsets x labels:
+     the summed weights of the features it yields at each offset) which is cached by the field values of the token.
+     The scores of a sentence are the sums of the shifted blocks of its tokens (one cache hit for a frequent token
+     instead of a feature string lookup for each feature and offset), the sentence features are added separately.
+     The summation order differs from the sparse matrix product, so the scores are equal up to floating point
+     rounding (exactly equal for int8 models). The cache keeps the max_cached least recently used blocks and it is
+     shared by the threads (see tag_threaded()): the cache and the hit counts are guarded by a lock
+    """
+    def __init__(self, model, feat_counter, max_cached=100000):
+        if isinstance(model, QuantizedLinearModel):
+            self._weights, self._scales, self._intercept, _, _, self._softmax = model.arrays()
+        elif hasattr(model, 'coef_') and hasattr(model, 'intercept_'):
+            coefs = model.coef_
+            if issparse(coefs):
+                coefs = coefs.toarray()
+            self._weights = np.ascontiguousarray(np.asarray(coefs, dtype=np.float64).T)  # Features x labels
+            self._scales = None
+            self._intercept = np.asarray(model.intercept_, dtype=np.float64)
+            self._softmax = uses_softmax(model)
+        else:
+            raise ValueError('The score cache requires a linear observation model (coef_ and intercept_)!')
+        self.classes_ = model.classes_
+        self._get_no_tag = feat_counter.get_no_tag
+        self._max_cached = max_cached
+        self._blocks = OrderedDict()  # LRU: the least recently used block first
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def plan(bound_features):
+        """
+        :return: WindowPlan of the features bound to the columns of an input (see Tagger.prepare_fields())
+        """
+        window_features = [feature for feature in bound_features.values() if feature.kind in {'token', 'lex'}]
+        return WindowPlan(window_features, [feature.field_indices[0] for feature in window_features],
+                          max((feature.radius for feature in window_features), default=0),
+                          [feature for feature in bound_features.values() if feature.kind == 'sentence'])
+
+    def _sum_weights(self, feat_numbers):
+        return self._weights[sorted(feat_numbers)].astype(np.float64).sum(axis=0)
+
+    def _block(self, values, plan):
+        """
+        The summed weights of the features of a token with the values at each offset (-radius ... radius) from the
+         token whose scores they contribute to (as the feature strings of Feature._multiply_features())
+        """
+        radius = plan.radius
+        get_no_tag = self._get_no_tag
+        feat_numbers = [set() for _ in range(2 * radius + 1)]
+        for feature, value in zip(plan.window_features, values):
+            if feature.kind == 'token':
+                feats = feature.function(value, feature.options)
+            else:
+                feats = feature.lexicon.lex_eval_sentence([value])[0]
+            feats = [feat for feat in feats if feat != 0]
+            for offset in range(-feature.radius, feature.radius + 1):
+                for feat in feats:
+                    feat_no = get_no_tag('{0}[{1}]={2}'.format(feature.name, offset, feat))
+                    if feat_no is not None:
+                        feat_numbers[offset + radius].add(feat_no)
+        block = np.zeros((2 * radius + 1, self._weights.shape[1]), dtype=np.float64)
+        for row, row_feat_numbers in enumerate(feat_numbers):
+            if len(row_feat_numbers) > 0:
+                block[row] = self._sum_weights(row_feat_numbers)
+        return block
+
+    def decision_function(self, sen, plan):
+        """
+        :return: the scores of the labels for each token of the sentence (tokens x labels)
+        """
+        blocks = []
+        for tok in sen:
+            values = tuple(tok[i] for i in plan.key_indices)
+            with self._lock:
+                block = self._blocks.get(values)
+                if block is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._blocks.move_to_end(values)
+            if block is None:  # Computed outside the lock (another thread may compute the same block meanwhile)
+                block = self._block(values, plan)
+                with self._lock:
+                    self._blocks[values] = block
+                    if len(self._blocks) > self._max_cached:
+                        self._blocks.popitem(last=False)
+            blocks.append(block)
+
+        sen_len, radius = len(sen), plan.radius
+        scores = np.zeros((sen_len, self._weights.shape[1]), dtype=np.float64)
+        if sen_len > 0:
+            blocks = np.stack(blocks)  # Tokens x offsets x labels
+            for offset in range(-radius, radius + 1):  # Token pos contributes to the token pos - offset
+                if abs(offset) < sen_len:
+                    if offset >= 0:
+                        scores[:sen_len - offset] += blocks[offset:, offset + radius]
+                    else:
+                        scores[-offset:] += blocks[:sen_len + offset, offset + radius]
+
+        for feature in plan.sentence_features:
+            get_no_tag = self._get_no_tag
+            for c, feats in enumerate(feature.eval_sentence(sen)):
+                feat_numbers = {get_no_tag(feat) for feat in feats} - {None}
+                if len(feat_numbers) > 0:
+                    scores[c] += self._sum_weights(feat_numbers)
+
+        if self._scales is not None:
+            scores *= self._scales
+        scores += self._intercept
+        if scores.shape[1] == 1:
+            return scores.ravel()
+        return scores
+
+    def predict_proba(self, sen, plan):
+        return scores_to_proba(self.decision_function(sen, plan), self._softmax)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+server.py is a module of HunTag and is used to serve a loaded Tagger on a Unix socket (see client.py)
+
+Protocol: the client sends a TSV document (header, sentences) and shuts down the writing side of the connection,
+the server streams back the tagged TSV and closes the connection. On error a line starting with ERROR_MARK followed by
+the message is sent instead of the rest of the output
+"""
+
+import os
+import sys
+import stat
+import socket
+import signal
+from itertools import chain
+
+from xtsv import process
+
+ERROR_MARK = '\0ERROR\t'
+_SERVER_SIGNALS = {signal.SIGTERM, signal.SIGINT, signal.SIGCHLD}  # Waited for synchronously by the parent
+
+
+def _handle_connection(conn, tagger, conll_comments):
+    conn.settimeout(None)
+    try:
+        with conn, conn.makefile('r', encoding='UTF-8') as in_stream, \
+                conn.makefile('w', encoding='UTF-8') as out_stream:
+            first_line = next(in_stream, None)
+            if first_line is None:  # Nothing to tag (e.g. a connection probe)
+                return
+            try:
+                out_stream.writelines(process(chain([first_line], in_stream), tagger, conll_comments))
+            except OSError:
+                raise
+            except Exception as e:  # Report the error to the client and keep serving the others
+                print('Error: {0}'.format(e), file=sys.stderr, flush=True)
+                for _ in in_stream:  # Closing with unread input would reset the connection before the client reads
+                    pass
+                out_stream.write('{0}{1}\n'.format(ERROR_MARK, str(e).replace('\n', ' ')))
+    except OSError:  # The client has gone (e.g. broken pipe)
+        pass
+
+
+def _worker_loop(listener, tagger, conll_comments):
+    """
+    Serve clients one after the other until SIGTERM, the client being served is finished before exiting
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C reaches the whole process group: the parent handles it
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _SERVER_SIGNALS)  # Blocked in the parent (inherited)
+    listener.settimeout(0.5)  # Check for shutdown regularly while idle
+    while len(stopping) == 0:
+        try:
+            conn, _ = listener.accept()
+        except (socket.timeout, InterruptedError):
+            continue
+        _handle_connection(conn, tagger, conll_comments)
+
+
+def _start_worker(listener, tagger, conll_comments):
+    pid = os.fork()
+    if pid == 0:  # The loaded model is shared with the parent (copy-on-write or memory-mapped bundle)
+        try:
+            _worker_loop(listener, tagger, conll_comments)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def _bind(socket_path):
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            print('Error: {0} exists and it is not a socket!'.format(socket_path), file=sys.stderr, flush=True)
+            sys.exit(1)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+            except ConnectionRefusedError:  # Left behind by a server which is not running
+                os.unlink(socket_path)
+            else:
+                print('Error: A server is already listening on {0}!'.format(socket_path), file=sys.stderr,
+                      flush=True)
+                sys.exit(1)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(128)
+    return listener
+
+
+def serve(tagger, socket_path, workers=1, conll_comments=False):
+    """
+    Serve the loaded tagger on a Unix socket with a pool of pre-forked worker processes (each serves one client
+     at a time), a worker which exits unexpectedly is replaced. SIGTERM or SIGINT shuts the server down gracefully:
+     no new client is accepted, the clients being served are finished, then the socket file is removed
+    """
+    if workers < 0:
+        workers = os.cpu_count()
+    listener = _bind(socket_path)
+
+    signal.pthread_sigmask(signal.SIG_BLOCK, _SERVER_SIGNALS)
+    pids = {_start_worker(listener, tagger, conll_comments) for _ in range(workers)}
+    print('serving on {0} with {1} worker processes...'.format(socket_path, workers), file=sys.stderr, flush=True)
+    try:
+        while signal.sigwaitinfo(_SERVER_SIGNALS).si_signo == signal.SIGCHLD:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            while pid != 0:  # Reap every exited worker and replace it
+                pids.discard(pid)
+                print('WARNING: Worker process {0} exited, starting a new one'.format(pid), file=sys.stderr,
+                      flush=True)
+                pids.add(_start_worker(listener, tagger, conll_comments))
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+    finally:
+        print('shutting down...', end='', file=sys.stderr, flush=True)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        listener.close()
+        os.unlink(socket_path)
+        print('done', file=sys.stderr, flush=True)
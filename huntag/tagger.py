@@ -2,39 +2,255 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
 import sys
-import joblib
-from scipy.sparse import csr_matrix
+import json
+import hashlib
+from array import array
+from copy import copy
+from functools import partial
+from threading import Lock
+from collections import namedtuple
 
-from .tools import BookKeeper, featurize_sentence, use_featurized_sentence, bind_features_to_indices
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from xtsv import process
+
+from .tools import BookKeeper, featurize_sentence, use_featurized_sentence, bind_features_to_indices, \
+    save_featurized_dataset, load_featurized_dataset
 from .transmodel import TransModel
+from .quantized import QuantizedLinearModel
+from .scorer import WindowScorer
+from .bundle import save_bundle, load_bundle, verify_bundle
+from .registry import registry
 from .argparser import valid_file, load_options_and_features
 
 
+# The state of tagging an input (see prepare_fields(), window_plan: see WindowScorer)
+BoundFields = namedtuple('BoundFields', ['features', 'tag_index', 'window_plan'], defaults=(None,))
+
+
+def best_and_worst_weights(weights, n):
+    """
+    Select the n best and n worst features by partial selection (argpartition) instead of sorting every weight.
+     The features are ordered by weight then by feature number (descending) as in a full descending sort
+    :return: the feature numbers of the first n and the last n elements of the full descending order
+    """
+    feat_nos = np.arange(len(weights))
+    if n <= 0 or n >= len(weights):  # Everything is selected ([-0:] means everything as well)
+        order = np.lexsort((-feat_nos, -weights))
+        return order[:n], order[-n:]
+    best = np.flatnonzero(weights >= weights[np.argpartition(-weights, n - 1)[n - 1]])  # With ties
+    best = best[np.lexsort((-best, -weights[best]))][:n]
+    worst = np.flatnonzero(weights <= weights[np.argpartition(weights, n - 1)[n - 1]])  # With ties
+    worst = worst[np.lexsort((worst, weights[worst]))][:n][::-1]
+    return best, worst
+
+
+def predict_proba_unique(model, matrix):
+    """
+    Score only the unique rows of the matrix (e.g. punctuation in the same context yields the same features) and
+     scatter the probabilities back to each row. The rows are keyed by their column indices (and values) in their
+     order, so a copied row is scored by the same computation: the result equals model.predict_proba(matrix)
+    :return: the probabilities of each row and the number of unique rows
+    """
+    matrix = csr_matrix(matrix)
+    indices, data, indptr = matrix.indices, matrix.data, matrix.indptr.tolist()
+    binary = bool(np.all(data == 1))
+    first_rows, unique_nos = [], {}
+    inverse = np.empty(matrix.shape[0], dtype=np.int64)
+    for row, (beg, end) in enumerate(zip(indptr, indptr[1:])):
+        key = indices[beg:end].tobytes()
+        if not binary:
+            key = (key, data[beg:end].tobytes())
+        unique_no = unique_nos.setdefault(key, len(first_rows))
+        if unique_no == len(first_rows):
+            first_rows.append(row)
+        inverse[row] = unique_no
+    if len(first_rows) == matrix.shape[0]:  # Nothing to gain
+        return model.predict_proba(matrix), len(first_rows)
+    return model.predict_proba(matrix[first_rows])[inverse], len(first_rows)
+
+
+def decode_sentences(trans_model, label_names, prob_dists, sent_end):
+    """
+    Decode the scored rows of the sentences (sent_end: index of the last row of each sentence)
+    :return: iterator over the list of the best labels for each sentence
+    """
+    beg = 0
+    for end in sent_end:
+        end = int(end) + 1
+        yield trans_model.tag_sent([dict(zip(label_names, prob_dist)) for prob_dist in prob_dists[beg:end]])
+        beg = end
+
+
+def tag_featurized_sentences(model, trans_model, labelno_to_name, matrix, sent_end):
+    """
+    Tag the featurized sentences of a matrix (sent_end: index of the last row of each sentence)
+    :return: iterator over the list of the best labels for each sentence
+    """
+    label_names = [labelno_to_name[label] for label in model.classes_]  # The columns of predict_proba()
+    prob_dists, _ = predict_proba_unique(model, matrix)  # All (unique) rows at once
+    yield from decode_sentences(trans_model, label_names, prob_dists, sent_end)
+
+
+def _load_observation_model(model_filename, featcounter_filename, labelcounter_filename):
+    import joblib  # Deferred: unpickling imports scikit-learn, which the bundle does not need
+
+    return joblib.load(model_filename), BookKeeper(featcounter_filename), BookKeeper(labelcounter_filename)
+
+
+_process_tagger = None  # The Tagger of a tag_parallel() worker process
+
+
+def _init_tagger_process(options, target_fields):
+    global _process_tagger
+    # Attach to the bundle loaded (and verified) by the parent: the mapped pages are shared, only the Python objects
+    #  are private
+    _process_tagger = Tagger(dict(options, verify_bundle=False), target_fields=target_fields)
+
+
+def _tag_chunk(lines, conll_comments):
+    output = process(iter(lines), _process_tagger, conll_comments)
+    next(output)  # The header is written by the parent
+    return list(output)
+
+
+def tag_parallel(input_stream, output_stream, options, target_fields, jobs, conll_comments=False, chunk_size=100):
+    """
+    Tag the input in worker processes which memory-map the same model bundle (see --bundle), so each worker is ready
+     almost instantly and uses little memory of its own. The sentences are sent in chunks of chunk_size
+     (with the header) and the output is written in the input order
+    """
+    header = next(input_stream, None)
+    if header is None:
+        return
+    fields = header.strip().split('\t')
+    output_stream.write('{0}\n'.format('\t'.join(fields + target_fields)))
+
+    def chunks():
+        chunk, sent_count = [header], 0
+        for line in input_stream:
+            chunk.append(line)
+            if len(line.strip()) == 0:
+                sent_count += 1
+                if sent_count == chunk_size:
+                    yield chunk
+                    chunk, sent_count = [header], 0
+        if len(chunk) > 1:
+            yield chunk
+
+    from multiprocessing import Pool, cpu_count  # Deferred import: only needed by this code path (CLI startup time)
+
+    worker_options = {k: v for k, v in options.items() if k not in {'input_stream', 'output_stream'}}
+    if jobs < 0:
+        jobs = cpu_count()
+    print('starting {0} tagger processes...'.format(jobs), end='', file=sys.stderr, flush=True)
+    with Pool(jobs, initializer=_init_tagger_process, initargs=(worker_options, target_fields)) as pool:
+        print('done', file=sys.stderr, flush=True)
+        for lines in pool.imap(partial(_tag_chunk, conll_comments=conll_comments), chunks()):
+            output_stream.writelines(lines)
+
+
+def tag_threaded(input_stream, output_stream, tagger, jobs, conll_comments=False, chunk_size=100):
+    """
+    Tag the input in a pool of jobs threads sharing the Tagger (one model in memory). The chunks of chunk_size
+     sentences are scored and decoded by array operations which release the GIL (scipy, numpy), so they run in
+     parallel with the featurization of the other chunks. The output is written in the input order
+    """
+    from collections import deque  # Deferred imports: only needed by this code path (CLI startup time)
+    from concurrent.futures import ThreadPoolExecutor
+    from os import cpu_count
+    from xtsv.tsvhandler import process_header, sentence_iterator
+
+    header = next(input_stream, None)
+    if header is None:
+        return
+    track_stream = {'file_name': getattr(input_stream, 'name', 'no filename for stream'), 'curr_line_number': 1}
+    header, field_names = process_header(header.strip().split('\t'), tagger.source_fields, tagger.target_fields,
+                                         track_stream)
+    output_stream.write(header)
+    bound_fields = tagger.prepare_fields(field_names)
+
+    def tag_chunk(chunk):
+        sentences = tagger.tag_sentences([sen for sen, _ in chunk], bound_fields)
+        lines = []
+        for (_, comment), sen in zip(chunk, sentences):
+            if len(comment) > 0:
+                lines.append(comment)
+            lines.extend('{0}\n'.format('\t'.join(tok)) for tok in sen)
+            lines.append('\n')
+        return lines
+
+    if jobs < 0:
+        jobs = cpu_count()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = deque()  # At most 2 * jobs chunks are read ahead
+        chunk = []
+        for sen_and_comment in sentence_iterator(input_stream, conll_comments, track_stream):
+            chunk.append(sen_and_comment)
+            if len(chunk) == chunk_size:
+                running.append(executor.submit(tag_chunk, chunk))
+                chunk = []
+                if len(running) >= 2 * jobs:
+                    output_stream.writelines(running.popleft().result())
+        if len(chunk) > 0:
+            running.append(executor.submit(tag_chunk, chunk))
+        while len(running) > 0:
+            output_stream.writelines(running.popleft().result())
+    tagger.report_scoring()
+
+
 class Tagger:
     pass_header = True
 
     def __init__(self, opts, source_fields=None, target_fields=None):
-        if 'cfg_file' in opts:
+        bundle = None
+        self._registry_keys = []  # The shared model components used (see registry.py and close())
+        self._model_files = []  # See fingerprint()
+        if opts.get('use_bundle', False):  # Everything (also the features) comes from the memory-mapped bundle
+            print('loading model bundle...', end='', file=sys.stderr, flush=True)
+            if opts.get('verify_bundle', False):  # Reads every page of the file
+                verify_bundle(valid_file(opts['bundle_filename']))
+            key, bundle = registry.acquire('bundle', [valid_file(opts['bundle_filename'])], load_bundle)
+            self._registry_keys.append(key)
+            self._model_files.append(opts['bundle_filename'])
+            opts = dict(opts, features=bundle.features)  # Shared: prepare_fields() binds copies of the features
+            print('done', file=sys.stderr, flush=True)
+        elif opts.get('cfg_file') is not None:
             opts['cfg_file'] = valid_file(opts['cfg_file'])  # Validate config file!
+        self._owns_features = 'features' not in opts  # The lexicons of the loaded features are released by close()
         self.features, self.source_fields, self.target_fields, options = \
             load_options_and_features(opts, source_fields, target_fields)
 
-        self._tag_field = None
-
         self._data_sizes = options['data_sizes']
 
-        if options['task'] not in {'print-weights', 'tag-featurize'}:
-            print('loading transition model...', end='', file=sys.stderr, flush=True)
-            self._trans_probs = TransModel.load_from_file(valid_file(options['transmodel_filename']))
-            print('done', file=sys.stderr, flush=True)
+        if bundle is not None:
+            self._trans_probs = bundle.trans_model
+            self._model = bundle.model
+            self._feat_counter = bundle.feat_counter
+            self._label_counter = bundle.label_counter
         else:
-            self._trans_probs = None
+            if options['task'] not in {'print-weights', 'tag-featurize'}:
+                print('loading transition model...', end='', file=sys.stderr, flush=True)
+                key, self._trans_probs = registry.acquire('transmodel', [valid_file(options['transmodel_filename'])],
+                                                          TransModel.load_from_file)
+                self._registry_keys.append(key)
+                self._model_files.append(options['transmodel_filename'])
+                print('done', file=sys.stderr, flush=True)
+            else:
+                self._trans_probs = None
 
-        print('loading observation model...', end='', file=sys.stderr, flush=True)
-        self._model = joblib.load(valid_file(options['model_filename']))
-        self._feat_counter = BookKeeper(valid_file(options['featcounter_filename']))
-        self._label_counter = BookKeeper(valid_file(options['labelcounter_filename']))
-        print('done', file=sys.stderr, flush=True)
+            print('loading observation model...', end='', file=sys.stderr, flush=True)
+            key, (self._model, self._feat_counter, self._label_counter) = \
+                registry.acquire('observation', [valid_file(options[file_name])
+                                                 for file_name in ('model_filename', 'featcounter_filename',
+                                                                   'labelcounter_filename')],
+                                 _load_observation_model)
+            self._registry_keys.append(key)
+            self._model_files.extend(options[file_name] for file_name in ('model_filename', 'featcounter_filename',
+                                                                          'labelcounter_filename'))
+            self._model_files.extend(feature.action_name for feature in (self.features or {}).values()
+                                     if feature.kind == 'lex')
+            print('done', file=sys.stderr, flush=True)
 
         # Set functions according to task...
         if options.get('inp_featurized', False):
@@ -43,13 +259,79 @@ class Tagger:
             self._tag_fun = self.tag_by_feat_number
         else:
             self._featurize_sentence_fun = featurize_sentence
-            if options.get('task') == 'tag-featurize':  # print features
-                self._format_output = self._feat_counter.no_to_name
+            if options.get('task') == 'tag-featurize' and options.get('save_dataset_dir') is not None:
+                # Collect features for the binary dataset
+                self._format_output = None
+                self._tag_fun = self._collect_features
+                self._dataset_cols = array(self._data_sizes['cols'])
+                self._dataset_indptr = array(self._data_sizes['rows'], [0])
+                self._dataset_sent_end = array(self._data_sizes['sent_end'])
+            elif options.get('task') == 'tag-featurize':  # print features
+                featno_to_name = self._feat_counter.no_to_name  # Escaped once for every feature
+                self._format_output = [featno_to_name[no].replace(':', 'colon') for no in range(len(featno_to_name))]
                 self._tag_fun = self._print_features
             else:  # tag sentences
                 self._format_output = self._add_tagging_normal
                 self._tag_fun = self.tag_by_feat_number
 
+        self._scorer = None
+        if options.get('score_cache_size') is not None and self._format_output == self._add_tagging_normal:
+            try:  # Score the tokens by the cached blocks of their field values instead of their features
+                self._scorer = WindowScorer(self._model, self._feat_counter, options['score_cache_size'])
+            except ValueError as e:
+                print('Error: {0}'.format(e), file=sys.stderr, flush=True)
+                sys.exit(1)
+
+        # The rows scored (in batches of sentences or one sentence at a time) and how many of them were unique
+        #  (see predict_proba_unique())
+        self.scoring_stats = {'batches': 0, 'rows': 0, 'unique_rows': 0, 'last_batch_unique_row_ratio': None}
+        self._scoring_stats_lock = Lock()  # Updated by the threads (see tag_threaded())
+
+    def _count_scored_rows(self, rows, unique_rows):
+        with self._scoring_stats_lock:
+            self.scoring_stats['batches'] += 1
+            self.scoring_stats['rows'] += rows
+            self.scoring_stats['unique_rows'] += unique_rows
+            self.scoring_stats['last_batch_unique_row_ratio'] = unique_rows / max(rows, 1)
+
+    def report_scoring(self):
+        """
+        Print the number of the scored rows and the ratio of the unique ones (the share of predict_proba() work done)
+        """
+        with self._scoring_stats_lock:
+            stats = dict(self.scoring_stats)
+        if stats['batches'] > 0:
+            print('scoring: {0} batches, {1} rows, {2} unique ({3:.1%})'.
+                  format(stats['batches'], stats['rows'], stats['unique_rows'],
+                         stats['unique_rows'] / max(stats['rows'], 1)), file=sys.stderr, flush=True)
+
+    def fingerprint(self):
+        """
+        Checksum of the model files (with the lexicons) and the settings of the features, which changes with any of
+         them (e.g. to tell which model tagged a cached sentence)
+        :return: the SHA-256 hex digest
+        """
+        checksum = hashlib.sha256()
+        plan = [[name, feature.kind, feature.action_name, feature.fields, feature.radius, feature.cutoff,
+                 feature.options] for name, feature in sorted((self.features or {}).items())]
+        checksum.update(json.dumps(plan, default=str).encode('UTF-8'))
+        for file_name in self._model_files:
+            with open(file_name, 'rb') as fh:
+                for block in iter(partial(fh.read, 1 << 20), b''):
+                    checksum.update(block)
+        return checksum.hexdigest()
+
+    def close(self):
+        """
+        Release the shared model components (see registry.py), the Tagger can not be used afterwards
+        """
+        for key in self._registry_keys:
+            registry.release(key)
+        self._registry_keys = []
+        if self._owns_features and self.features is not None:
+            for feature in self.features.values():
+                feature.release()
+
     def _get_tag_probs_by_pos(self, feat_numbers):
         rows, cols, data = [], [], []
         for rownum, featNumberSet in enumerate(feat_numbers):
@@ -59,8 +341,10 @@ class Tagger:
                 data.append(1)
         contexts = csr_matrix((data, (rows, cols)), shape=(len(feat_numbers), self._feat_counter.num_of_names()),
                               dtype=self._data_sizes['data_np'])
-        tagprobs_by_pos = [{self._label_counter.no_to_name[i]: prob for i, prob in enumerate(prob_dist)}
-                           for prob_dist in self._model.predict_proba(contexts)]
+        label_names = [self._label_counter.no_to_name[i] for i in self._model.classes_]  # The columns
+        prob_dists, unique_rows = predict_proba_unique(self._model, contexts)
+        self._count_scored_rows(len(feat_numbers), unique_rows)
+        tagprobs_by_pos = [dict(zip(label_names, prob_dist)) for prob_dist in prob_dists]
         return tagprobs_by_pos
 
     @staticmethod
@@ -78,35 +362,202 @@ class Tagger:
         return add_tagging(sen, best_tagging, tag_index)  # Add tagging to sentence
 
     @staticmethod
-    def _print_features(_, feat_numbers, featno_to_name, __):
-        return [[featno_to_name[featNum].replace(':', 'colon') for featNum in featNumberSet]
-                for featNumberSet in feat_numbers]
+    def _print_features(_, feat_numbers, escaped_feat_names, __):
+        return [[escaped_feat_names[featNum] for featNum in featNumberSet] for featNumberSet in feat_numbers]
+
+    def _collect_features(self, _, feat_numbers, __, ___):
+        for feat_number_set in feat_numbers:
+            self._dataset_cols.extend(sorted(feat_number_set))
+            self._dataset_indptr.append(len(self._dataset_cols))
+        self._dataset_sent_end.append(len(self._dataset_indptr) - 2)  # Index of the last row
+        return [[]]  # Dummy
+
+    def save_dataset(self, dataset_dir):
+        """
+        Write the collected features (task: tag-featurize) as binary dataset numbered according to the model
+        """
+        print('saving featurized dataset...', end='', file=sys.stderr, flush=True)
+        cols = np.array(self._dataset_cols, dtype=np.int64)
+        matrix = csr_matrix((np.ones(len(cols), dtype=self._data_sizes['data_np']), cols,
+                             np.array(self._dataset_indptr, dtype=np.int64)),
+                            shape=(len(self._dataset_indptr) - 1, self._feat_counter.num_of_names()))
+        sent_end = np.array(self._dataset_sent_end, dtype=self._data_sizes['sent_end_np'])
+        save_featurized_dataset(dataset_dir, matrix, sent_end, self._feat_counter, self._label_counter)
+        print('done', file=sys.stderr, flush=True)
+
+    def tag_dataset(self, dataset_dir, output_stream):
+        """
+        Tag the sentences of a binary dataset (see --save-dataset) and write one label per line
+         with empty lines between the sentences (as with --input-featurized)
+        """
+        matrix, sent_end, _, _ = load_featurized_dataset(dataset_dir)
+        if matrix.shape[1] != self._feat_counter.num_of_names():
+            print('ERROR: The dataset ({0}) has {1} features, but the model has {2}!'.
+                  format(dataset_dir, matrix.shape[1], self._feat_counter.num_of_names()), file=sys.stderr,
+                  flush=True)
+            sys.exit(1)
+        label_names = [self._label_counter.no_to_name[i] for i in self._model.classes_]  # The columns
+        prob_dists, unique_rows = predict_proba_unique(self._model, matrix)
+        self._count_scored_rows(matrix.shape[0], unique_rows)
+        for best_tagging in decode_sentences(self._trans_probs, label_names, prob_dists, sent_end):
+            output_stream.writelines('{0}\n'.format(label) for label in best_tagging)
+            output_stream.write('\n')
+        self.report_scoring()
+
+    def save_compact(self, threshold, compact_options, quantize=None):
+        """
+        Drop the features whose maximal absolute weight (across labels) is below threshold (if set), renumber the
+         rest (in the original order) consistently in the vocabulary and in the coefficients, quantize the
+         coefficients (if set: float16 or int8) and save the compact model set to the file names of compact_options
+         (the labels and the transition model are the same)
+        :return: the number of the original and the kept features
+        """
+        coefs = self._model.coef_
+        if threshold is None:
+            kept = np.arange(coefs.shape[1])
+        else:
+            max_weights = abs(coefs).max(axis=0)
+            if issparse(max_weights):
+                max_weights = max_weights.toarray()
+            kept = np.flatnonzero(np.asarray(max_weights).ravel() >= threshold)
+
+        featno_to_name = self._feat_counter.no_to_name
+        feat_counter = BookKeeper()  # Numbered from 0 in the original order
+        for feat_no in kept.tolist():
+            feat_counter.get_no_train(featno_to_name[feat_no])
+        model = copy(self._model)
+        model.coef_ = coefs[:, kept]
+        model.n_features_in_ = len(kept)
+        if quantize is not None:
+            model = QuantizedLinearModel(model, quantize)
+
+        import joblib
+
+        print('saving compact model...', end='', file=sys.stderr, flush=True)
+        joblib.dump(model, compact_options['model_filename'], compress=3)
+        feat_counter.save(compact_options['featcounter_filename'])
+        self._label_counter.save(compact_options['labelcounter_filename'])
+        self._trans_probs.save_to_file(compact_options['transmodel_filename'])
+        print('done', file=sys.stderr, flush=True)
+        return coefs.shape[1], len(kept)
 
     def prepare_fields(self, field_names):
+        """
+        Bind the features to the columns of an input, the Tagger itself is not modified (it is reentrant: inputs
+         with different columns can be tagged at the same time with their own BoundFields)
+        :return: BoundFields (the bound features and the index of the tag column) for process_sentence()
+        """
         target_fields_len = len(self.target_fields)
         if target_fields_len != 1:
             print('ERROR: Wrong number of target fields are specified ({0})! '
                   'TAGGING REQUIRES ONLY ONE TAG FIELD!'.
                   format(target_fields_len), file=sys.stderr, flush=True)
             sys.exit(1)
-        self._tag_field = field_names[self.target_fields[0]]
-        return bind_features_to_indices(self.features, self._tag_field, field_names)
+        tag_index = field_names[self.target_fields[0]]
+        bound_features = bind_features_to_indices(self.features, tag_index, field_names)
+        if self._scorer is not None:
+            return BoundFields(bound_features, tag_index, WindowScorer.plan(bound_features))
+        return BoundFields(bound_features, tag_index)
 
-    def process_sentence(self, sen, features_bound_to_column_ids):
+    def featurize(self, sen, features_bound_to_column_ids):
+        """
+        :return: the feature numbers of each token of the sentence (the features unknown to the model are dropped)
+        """
         sen_feats = self._featurize_sentence_fun(sen, features_bound_to_column_ids)
         get_no_tag = self._feat_counter.get_no_tag
         # Get Sentence Features translated to numbers and contexts in two steps
-        feat_numbers = [{get_no_tag(feat) for feat in feats if get_no_tag(feat) is not None} for feats in sen_feats]
-        return self._tag_fun(sen, feat_numbers, self._format_output, self._tag_field)
+        return [{get_no_tag(feat) for feat in feats if get_no_tag(feat) is not None} for feats in sen_feats]
+
+    def tag_batch(self, feat_numbers_of_sentences):
+        """
+        Score the tokens of many sentences at once (one predict_proba() call for the unique rows, see
+         predict_proba_unique()), then decode each sentence
+        :return: the list of the best labels for each sentence
+        """
+        cols, indptr, sent_end = array('q'), array('q', [0]), array('q')
+        for feat_numbers in feat_numbers_of_sentences:
+            for feat_number_set in feat_numbers:
+                cols.extend(feat_number_set)
+                indptr.append(len(cols))
+            sent_end.append(len(indptr) - 2)  # Index of the last row
+        cols = np.frombuffer(cols, dtype=np.int64)
+        matrix = csr_matrix((np.ones(len(cols), dtype=self._data_sizes['data_np']), cols,
+                             np.frombuffer(indptr, dtype=np.int64)),
+                            shape=(len(indptr) - 1, self._feat_counter.num_of_names()))
+        label_names = [self._label_counter.no_to_name[i] for i in self._model.classes_]  # The columns
+        prob_dists, unique_rows = predict_proba_unique(self._model, matrix)
+        self._count_scored_rows(matrix.shape[0], unique_rows)
+        return list(decode_sentences(self._trans_probs, label_names, prob_dists, sent_end))
+
+    def add_tagging(self, sen, best_tagging, tag_index):
+        """
+        Insert the labels into the tokens of the sentence at tag_index (see tag_batch())
+        """
+        return self._add_tagging_normal(sen, best_tagging, tag_index)
+
+    def process_sentence(self, sen, bound_fields):
+        if bound_fields.window_plan is not None:  # See WindowScorer
+            label_names = [self._label_counter.no_to_name[i] for i in self._model.classes_]  # The columns
+            best_tagging = self._trans_probs.tag_sent([dict(zip(label_names, prob_dist)) for prob_dist in
+                                                       self._scorer.predict_proba(sen, bound_fields.window_plan)])
+            return self._format_output(sen, best_tagging, bound_fields.tag_index)
+        feat_numbers = self.featurize(sen, bound_fields.features)
+        return self._tag_fun(sen, feat_numbers, self._format_output, bound_fields.tag_index)
+
+    def tag_sentences(self, sentences, bound_fields):
+        """
+        Tag a batch of sentences: featurize them, then score all tokens at once and decode each sentence (see
+         tag_batch()). Reentrant, so threads can tag with the same Tagger
+        :return: the tagged sentences (as process_sentence())
+        """
+        if bound_fields.window_plan is not None:  # The sentences are scored one by one from the cached blocks
+            return [self.process_sentence(sen, bound_fields) for sen in sentences]
+        best_taggings = self.tag_batch([self.featurize(sen, bound_fields.features) for sen in sentences])
+        return [self._format_output(sen, best_tagging, bound_fields.tag_index)
+                for sen, best_tagging in zip(sentences, best_taggings)]
+
+    def save_bundle(self, bundle_filename):
+        """
+        Pack the loaded model set (with the features of the config and their lexicons) into one bundle file
+        :return: the size of the bundle in bytes
+        """
+        print('saving model bundle...', end='', file=sys.stderr, flush=True)
+        size = save_bundle(bundle_filename, self._model, self._feat_counter, self._label_counter, self._trans_probs,
+                           self.features)
+        print('done', file=sys.stderr, flush=True)
+        return size
 
-    def print_weights(self, output_stream, n=100):
+    def print_weights(self, output_stream, n=100, output_format='columns'):
+        """
+        Print the n best and the n worst (negative correlation) features of each label. The coefficients can be
+         sparse (e.g. pruned or sparsified models), only one row is densified at a time.
+         output_format: 'columns' (two lines per label: best and worst) or 'tsv' (one line per label and feature)
+        """
         coefs = self._model.coef_
         labelno_to_name = self._label_counter.no_to_name
         featno_to_name = self._feat_counter.no_to_name
-        sorted_feats = sorted(featno_to_name.items())
-        for i, label in sorted(labelno_to_name.items()):
-            columns = ['{0}:{1}'.format(w, feat) for w, (no, feat) in sorted(zip(coefs[i, :], sorted_feats),
-                                                                             reverse=True)]
-            print('{0}\t{1}'.format(label, '\t'.join(columns[:n])), file=output_stream)  # Best
-            # Worst -> Negative correlation
-            print('{0}\t{1}'.format(label, '\t'.join(sorted(columns[-n:], reverse=True))), file=output_stream)
+        feat_num = len(featno_to_name)
+        classes = self._model.classes_
+        if coefs.shape[0] == 1 and len(classes) == 2:  # Binary model: the weights belong to the second class
+            classes = classes[1:]
+        if output_format == 'tsv':
+            print('Label', 'Kind', 'Rank', 'Feature', 'Weight', sep='\t', file=output_stream)
+        for i, label_no in enumerate(classes):
+            weights = coefs[i, :]
+            if issparse(weights):
+                weights = weights.toarray()
+            weights = np.asarray(weights, dtype=np.float64).ravel()[:feat_num]
+            best, worst = best_and_worst_weights(weights, n)
+            label = labelno_to_name[label_no]
+            if output_format == 'tsv':
+                for kind, feat_nos in (('best', best), ('worst', worst[::-1])):  # The most negative is the first
+                    for rank, (no, w) in enumerate(zip(feat_nos.tolist(), weights[feat_nos].tolist()), start=1):
+                        print(label, kind, rank, featno_to_name[no], w, sep='\t', file=output_stream)
+            else:
+                columns = ['{0}:{1}'.format(w, featno_to_name[no])
+                           for no, w in zip(best.tolist(), weights[best].tolist())]
+                print('{0}\t{1}'.format(label, '\t'.join(columns)), file=output_stream)  # Best
+                # Worst -> Negative correlation
+                columns = ['{0}:{1}'.format(w, featno_to_name[no])
+                           for no, w in zip(worst.tolist(), weights[worst].tolist())]
+                print('{0}\t{1}'.format(label, '\t'.join(sorted(columns, reverse=True))), file=output_stream)
@@ -4,19 +4,35 @@
 # Miscellaneous tools for HunTag
 
 import gzip
+from copy import copy
+from os import makedirs
+from os.path import join
 from operator import itemgetter
 from collections import Counter, defaultdict
 from itertools import count
 
+import numpy as np
+from scipy.sparse import csr_matrix
+
 
 # Data sizes across the program (training and tagging). Check manuals for other sizes
 
 
 def bind_features_to_indices(features, tag_field, field_names):
+    """
+    Bind copies of the features (sharing their lexicons) to the columns of the input, so the same features can be
+     used for inputs with different columns at the same time
+    :return: the bound features or None without features (featurized input)
+    """
+    if features is None:
+        return None
     name_dict = {k: v for k, v in field_names.items() if k != tag_field and v != tag_field}
+    bound_features = {}
     for name, feature in features.items():
-        feature.field_indices = [name_dict[f] for f in feature.fields]
-    return features
+        bound_feature = copy(feature)
+        bound_feature.field_indices = [name_dict[f] for f in feature.fields]
+        bound_features[name] = bound_feature
+    return bound_features
 
 
 def featurize_sentence(sen, features, feat_filter=lambda token_feats: token_feats, label_field=None):
@@ -42,6 +58,94 @@ def use_featurized_sentence(sen, _, feat_filter=lambda token_feats: token_feats,
     return sentence_feats
 
 
+def split_sentences(sent_end, sentence_ids):
+    """
+    Select sentences by their index from a matrix with the sentence ends (index of the last row of each sentence)
+    :return: the row indices of the selected sentences (in the given order) and their sentence ends in the selection
+    """
+    sent_end = np.asarray(sent_end, dtype=np.int64)
+    sent_beg = np.concatenate(([0], sent_end[:-1] + 1))
+    lengths = sent_end[sentence_ids] - sent_beg[sentence_ids] + 1
+    row_ids = np.concatenate([np.arange(beg, end + 1) for beg, end in zip(sent_beg[sentence_ids],
+                                                                          sent_end[sentence_ids])] or [[]])
+    return row_ids.astype(np.int64), np.cumsum(lengths) - 1
+
+
+def get_chunks(labels, outside='O'):
+    """
+    Chunks in BIO or BIE1 labeled sequence (I-X or E-X after an other type or outside also starts a chunk as in
+     conlleval)
+    :return: set of (begin, end, type) with exclusive end
+    """
+    chunks = set()
+    beg = None
+    chunk_type = None
+    for i, label in enumerate(labels):
+        prefix, _, curr_type = label.partition('-')
+        if label == outside:
+            prefix, curr_type = outside, None
+        if beg is not None and (prefix in {outside, 'B', '1'} or curr_type != chunk_type):  # Implicit end
+            chunks.add((beg, i, chunk_type))
+            beg = None
+        if prefix in {'B', '1'} or (prefix in {'I', 'E'} and beg is None):  # Begin
+            beg, chunk_type = i, curr_type
+        if prefix in {'E', '1'}:  # Explicit end
+            chunks.add((beg, i + 1, chunk_type))
+            beg = None
+    if beg is not None:
+        chunks.add((beg, len(labels), chunk_type))
+    return chunks
+
+
+def precision_recall_f1(correct, predicted, gold):
+    precision = correct / predicted if predicted > 0 else 0.0
+    recall = correct / gold if gold > 0 else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return precision, recall, f1
+
+
+# Binary featurized dataset: one .npy file per array (memory-mappable) and the vocabularies in BookKeeper format
+dataset_files = {'data': 'data.npy', 'indices': 'indices.npy', 'indptr': 'indptr.npy', 'shape': 'shape.npy',
+                 'labels': 'labels.npy', 'sent_end': 'sent_end.npy', 'feat_counts': 'feat_counts.npy',
+                 'featcounter': 'featureNumbers.gz', 'labelcounter': 'labelNumbers.gz'}
+
+
+def save_featurized_dataset(dataset_dir, matrix, sent_end, feat_counter, label_counter, labels=None,
+                            feat_counts=None):
+    """
+    Write the featurized dataset (CSR matrix, sentence ends, vocabularies and optionally the labels
+     and the feature counts before cutoff) into dataset_dir
+    """
+    makedirs(dataset_dir, exist_ok=True)
+    matrix = matrix.tocsr()
+    arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+              'shape': np.array(matrix.shape, dtype=np.uint64), 'sent_end': np.asarray(sent_end)}
+    if labels is not None:
+        arrays['labels'] = np.asarray(labels)
+    if feat_counts is not None:
+        arrays['feat_counts'] = np.asarray(feat_counts)
+    for name, arr in arrays.items():
+        np.save(join(dataset_dir, dataset_files[name]), arr)
+    feat_counter.save(join(dataset_dir, dataset_files['featcounter']))
+    label_counter.save(join(dataset_dir, dataset_files['labelcounter']))
+
+
+def load_featurized_dataset(dataset_dir, mmap_mode='r'):
+    """
+    Read back the arrays written by save_featurized_dataset() (memory-mapped by default)
+    :return: matrix, sent_end, labels (or None), feat_counts (or None)
+    """
+    def load_array(name):
+        try:
+            return np.load(join(dataset_dir, dataset_files[name]), mmap_mode=mmap_mode)
+        except FileNotFoundError:
+            return None
+
+    shape = tuple(int(dim) for dim in load_array('shape'))
+    matrix = csr_matrix((load_array('data'), load_array('indices'), load_array('indptr')), shape=shape, copy=False)
+    return matrix, load_array('sent_end'), load_array('labels'), load_array('feat_counts')
+
+
 # Keeps Feature/Label-Number translation maps, for faster computations
 class BookKeeper:
     def __init__(self, loadfromfile=None):
@@ -50,17 +154,32 @@ class BookKeeper:
         self._name_to_no = defaultdict(count().__next__)
         self.no_to_name = {}  # This is built only upon reading back from file
         if loadfromfile is not None:
-            self._name_to_no.default_factory = count(start=self.load(loadfromfile)).__next__
+            self.load(loadfromfile)
+            self._name_to_no.default_factory = count(start=len(self._name_to_no)).__next__  # After the loaded ones
 
     def num_of_names(self):
         return len(self._name_to_no)
 
+    def counts(self):
+        """
+        The number of occurences for each name indexed by the name numbers
+        """
+        counts = np.zeros(self.num_of_names(), dtype=np.uint64)
+        for name, no in self._name_to_no.items():
+            counts[no] = self._counter[name]
+        return counts
+
+    def set_counts(self, counts):
+        self._counter = Counter({name: int(counts[no]) for name, no in self._name_to_no.items()})
+
     def makeno_to_name(self):
         self.no_to_name = {v: k for k, v in self._name_to_no.items()}
         assert len(self.no_to_name) == len(self._name_to_no)
 
-    def cutoff(self, cutoff):
-        to_delete = {self._name_to_no.pop(name) for name, counts in self._counter.items() if counts < cutoff}
+    def cutoff(self, cutoff, keep_below=0):
+        # Names numbered below keep_below are kept regardless of their counts (e.g. loaded ones), so they keep their no
+        to_delete = {self._name_to_no.pop(name) for name, counts in self._counter.items()
+                     if counts < cutoff and self._name_to_no[name] >= keep_below}
         del self._counter
         new_name_no = {name: i for i, (name, _) in enumerate(sorted(self._name_to_no.items(), key=itemgetter(1)))}
         del self._name_to_no
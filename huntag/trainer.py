@@ -6,36 +6,290 @@ trainer.py is a module of HunTag and is used to train maxent models
 """
 
 import sys
-from collections import Counter, defaultdict
+from os.path import join
+from random import Random
+from time import perf_counter
+from collections import Counter
 from array import array
 
 import joblib
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, vstack
 import numpy as np
 from sklearn.linear_model import LogisticRegression
-# from sklearn.linear_model import SGDClassifier
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import ParameterGrid
 # from sklearn.svm import SVC
 # from sklearn.multiclass import OneVsRestClassifier
 
-from .tools import BookKeeper, featurize_sentence, use_featurized_sentence, bind_features_to_indices
+from .tools import BookKeeper, featurize_sentence, use_featurized_sentence, bind_features_to_indices, \
+    save_featurized_dataset, load_featurized_dataset, dataset_files, split_sentences, get_chunks, \
+    precision_recall_f1
+from .tagger import tag_featurized_sentences
+from .transmodel import TransModel
 from .argparser import valid_file, load_options_and_features
 
 
+def deduplicate_rows(matrix, labels, sample_weight=None):
+    """
+    Find the identical training events (same features with the same label)
+    :return: the index of the first occurence of each distinct event and the number (or the summed sample_weight)
+     of its occurences
+    """
+    matrix = matrix.tocsr()
+    if not matrix.has_sorted_indices:
+        matrix = matrix.sorted_indices()
+    if sample_weight is None:
+        sample_weight = np.ones(matrix.shape[0], dtype=np.float64)
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+    first_row = {}
+    counts = Counter()
+    for row, (beg, end) in enumerate(zip(indptr[:-1], indptr[1:])):
+        key = (labels[row], indices[beg:end].tobytes(), data[beg:end].tobytes())
+        first_row.setdefault(key, row)
+        counts[key] += sample_weight[row]
+    return np.fromiter(first_row.values(), dtype=np.int64, count=len(first_row)), \
+        np.fromiter((counts[key] for key in first_row.keys()), dtype=np.float64, count=len(first_row))
+
+
+def subsample_majority(labels, majority_label, fraction, random_state):
+    """
+    Keep a stratified fraction of the rows with the majority label: their rows are split into consecutive strata
+     (in corpus order) and one random row of each stratum is kept with the size of the stratum as weight, so the
+     summed weight (the class prior) does not change. The rows of the other labels are kept with weight 1
+    :return: the indices of the kept rows (in original order) and their weights
+    """
+    majority_rows = np.flatnonzero(labels == majority_label)
+    keep_num = min(len(majority_rows), max(1, int(round(len(majority_rows) * fraction))))
+    if keep_num == 0:
+        rows = np.arange(len(labels), dtype=np.int64)
+        return rows, np.ones(len(rows), dtype=np.float64)
+    stratum_begs = np.arange(keep_num, dtype=np.int64) * len(majority_rows) // keep_num
+    stratum_sizes = np.diff(np.append(stratum_begs, len(majority_rows)))
+    kept = majority_rows[stratum_begs + random_state.randint(0, stratum_sizes)]
+    weights = np.ones(len(labels), dtype=np.float64)
+    weights[kept] = stratum_sizes
+    rows = np.sort(np.concatenate((np.flatnonzero(labels != majority_label), kept))).astype(np.int64)
+    return rows, weights[rows]
+
+
+def smallest_stable(keys, n):
+    """
+    Partial sort: the indices of the n smallest keys in ascending order (equal keys by their index) as the first n
+     elements of a stable full sort (negative n slices the full sort from the end)
+    """
+    if n < 0 or n >= len(keys):
+        return np.argsort(keys, kind='stable')[:n]
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    kth = np.partition(keys, n - 1)[n - 1]
+    candidates = np.flatnonzero(keys <= kth)  # Every tie of the kth key
+    return candidates[np.argsort(keys[candidates], kind='stable')][:n]
+
+
+def fit_binary(solver, parameters, matrix, labels, positive_label, sample_weight=None):
+    """
+    Fit a binary model for one label against the rest (run in a separate process)
+    :return: the coefficients, the intercept and the number of iterations of the binary model
+    """
+    model = solver(**parameters)
+    model.fit(matrix, labels == positive_label, sample_weight=sample_weight)
+    return model.coef_[0], model.intercept_[0], np.max(model.n_iter_)
+
+
+def fit_one_vs_rest(solver, parameters, matrix, labels, sample_weight=None, jobs=1):
+    """
+    Fit independent binary models for each label in parallel and assemble them into one one-vs-rest model, which
+     normalises the probabilities of the labels like LogisticRegression(multi_class='ovr') does.
+     The (large) arrays of the matrix are memory-mapped and shared by the worker processes (joblib)
+    :return: the assembled model
+    """
+    classes = np.unique(labels)
+    model = solver(**dict(parameters, multi_class='ovr'))
+    if len(classes) <= 2:  # Binary problem: one model is the one-vs-rest model
+        model.fit(matrix, labels, sample_weight=sample_weight)
+        return model
+    results = joblib.Parallel(n_jobs=jobs)(
+        joblib.delayed(fit_binary)(solver, parameters, matrix, labels, label, sample_weight) for label in classes)
+    coefs, intercepts, n_iters = zip(*results)
+    model.classes_ = classes
+    model.coef_ = np.vstack(coefs)
+    model.intercept_ = np.array(intercepts, dtype=np.float64)
+    model.n_iter_ = np.array([max(n_iters)], dtype=np.int32)
+    model.n_features_in_ = matrix.shape[1]
+    return model
+
+
+def pad_coefficients(model, label_num, feat_num):
+    """
+    Get the coefficients and the intercepts of a linear model for each label number (rows) padded with zeros
+     for the labels and features (columns) unknown to the model. Binary models are split into two symmetric rows
+    :return: coefficient matrix (label_num x feat_num) and intercept vector
+    """
+    old_coef, old_intercept = model.coef_, model.intercept_
+    if old_coef.shape[0] == 1 and len(model.classes_) == 2:
+        old_coef = np.vstack((-old_coef / 2, old_coef / 2))
+        old_intercept = np.array([-old_intercept[0] / 2, old_intercept[0] / 2])
+    coef = np.zeros((label_num, feat_num), dtype=np.float64)
+    intercept = np.zeros(label_num, dtype=np.float64)
+    coef[model.classes_, :old_coef.shape[1]] = old_coef
+    intercept[model.classes_] = old_intercept
+    return coef, intercept
+
+
+def fit_from_prior(parameters, matrix, labels, prior_coef, prior_intercept, sample_weight=None):
+    """
+    Continue the training of a multinomial logistic regression model on new data: minimise C times the log-loss of
+     the new events plus the squared distance of the coefficients from the ones of the earlier model (instead of
+     their squared norm as LogisticRegression does), so the model keeps what it has learned (e.g. the labels missing
+     from the new data) and moves only as far as the new data requires. The cost is proportional to the new data
+    :return: the coefficients (labels x features), the intercepts and the number of iterations
+    """
+    from scipy.optimize import minimize
+    from scipy.special import logsumexp
+
+    c = parameters.get('C', 1.0)
+    label_num, feat_num = prior_coef.shape
+    matrix = csr_matrix(matrix, dtype=np.float64)
+    weights = np.ones(matrix.shape[0]) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    targets = np.zeros((matrix.shape[0], label_num))  # Weighted one-hot labels
+    targets[np.arange(matrix.shape[0]), labels] = weights
+
+    def loss_and_gradient(params):
+        coef, intercept = params[label_num:].reshape(label_num, feat_num), params[:label_num]
+        scores = matrix @ coef.T + intercept
+        log_norms = logsumexp(scores, axis=1)
+        shift = coef - prior_coef
+        loss = c * (weights @ log_norms - np.sum(targets * scores)) + 0.5 * np.sum(shift * shift)
+        residuals = np.exp(scores - log_norms[:, np.newaxis]) * weights[:, np.newaxis] - targets
+        coef_gradient = c * (matrix.T @ residuals).T + shift
+        return loss, np.concatenate((c * residuals.sum(axis=0), coef_gradient.ravel()))
+
+    result = minimize(loss_and_gradient, np.concatenate((prior_intercept, prior_coef.ravel())), jac=True,
+                      method='L-BFGS-B', options={'maxiter': parameters.get('max_iter', 100),
+                                                  'gtol': parameters.get('tol', 1e-4)})
+    return result.x[label_num:].reshape(label_num, feat_num), result.x[:label_num], result.nit
+
+
+def train_trans_model(labels, sent_end, labelno_to_name, order=3, lmw=1.0):
+    """
+    Train a transition model on the label sequences of the featurized sentences
+    """
+    trans_model = TransModel(lmw=lmw, order=order)
+    beg = 0
+    for end in sent_end:
+        end = int(end) + 1
+        trans_model._obs_sequence(labelno_to_name[label] for label in labels[beg:end])
+        beg = end
+    trans_model.compile()
+    return trans_model
+
+
+def fit_and_score(solver, parameters, train_matrix, train_labels, test_matrix, test_labels, test_sent_end,
+                  trans_model, labelno_to_name, sample_weight=None, count_features=False):
+    """
+    Fit a model on the train split and tag the held-out sentences with it (run in a separate process)
+    :return: the fit time in seconds and the token accuracy on the held-out sentences
+     (and the number of features with nonzero weight if count_features is set)
+    """
+    model = solver(**parameters)
+    start = perf_counter()
+    model.fit(train_matrix, train_labels, sample_weight=sample_weight)
+    fit_time = perf_counter() - start
+    predicted = [label for best_tagging in tag_featurized_sentences(model, trans_model, labelno_to_name, test_matrix,
+                                                                    test_sent_end)
+                 for label in best_tagging]
+    correct = sum(labelno_to_name[gold] == label for gold, label in zip(test_labels, predicted))
+    if count_features:
+        return fit_time, correct / len(predicted), len(surviving_features(model))
+    return fit_time, correct / len(predicted)
+
+
+def surviving_features(model):
+    """
+    :return: the (sorted) numbers of the features which have nonzero weight for any label
+    """
+    return np.flatnonzero(np.any(model.coef_ != 0, axis=0))
+
+
+def evaluate_fold(solver, parameters, matrix, labels, sent_end, test_sentence_ids, labelno_to_name, order, lmw):
+    """
+    Train the observation and the transition model on every sentence except the test sentences then tag those
+     (run in a separate process for each fold)
+    :return: Counter of the times and the token and chunk level counts
+    """
+    train_sentence_ids = np.setdiff1d(np.arange(len(sent_end)), test_sentence_ids)
+    train_rows, train_sent_end = split_sentences(sent_end, train_sentence_ids)
+    test_rows, test_sent_end = split_sentences(sent_end, test_sentence_ids)
+    train_labels = labels[train_rows]
+
+    model = solver(**parameters)
+    start = perf_counter()
+    model.fit(matrix[train_rows], train_labels)
+    fit_time = perf_counter() - start
+    trans_model = train_trans_model(train_labels, train_sent_end, labelno_to_name, order, lmw)
+
+    start = perf_counter()
+    predicted = list(tag_featurized_sentences(model, trans_model, labelno_to_name, matrix[test_rows], test_sent_end))
+    tag_time = perf_counter() - start
+
+    counts = Counter({'fit_time': fit_time, 'tag_time': tag_time})
+    test_labels = labels[test_rows]
+    beg = 0
+    for end, predicted_labels in zip(test_sent_end, predicted):
+        end = int(end) + 1
+        gold_labels = [labelno_to_name[label] for label in test_labels[beg:end]]
+        beg = end
+        for gold, label in zip(gold_labels, predicted_labels):
+            counts['tokens'] += 1
+            counts['token_correct'] += int(gold == label)
+            counts['token_gold'] += int(gold != 'O')
+            counts['token_predicted'] += int(label != 'O')
+            counts['token_tp'] += int(gold == label != 'O')
+        gold_chunks = get_chunks(gold_labels)
+        predicted_chunks = get_chunks(predicted_labels)
+        counts['chunk_gold'] += len(gold_chunks)
+        counts['chunk_predicted'] += len(predicted_chunks)
+        counts['chunk_tp'] += len(gold_chunks & predicted_chunks)
+    return counts
+
+
 class Trainer:
     def __init__(self, opts, source_fields=None, target_fields=None):
-        if 'cfg_file' in opts:
+        if opts.get('cfg_file') is not None:
             opts['cfg_file'] = valid_file(opts['cfg_file'])  # Validate config file!
         self.features, self.source_fields, self.target_fields, options = \
             load_options_and_features(opts, source_fields, target_fields)
 
         self._tag_field_name = options['gold_tag_field']  # One of the source fields
 
-        if options['train_params'] is None:
-            # Set clasifier algorithm here
-            parameters = {'solver': 'lbfgs', 'multi_class': 'auto', 'max_iter': 5000}
+        # Mini-batch (out-of-core) training: the events are streamed into partial_fit() instead of being stored
+        self._mini_batch_size = options.get('mini_batch_size')
+        self._shuffle_buffer_size = options.get('shuffle_buffer', 10000)
+        self._shuffle_buffer = []
+        self._random = Random(options.get('random_seed', 0))
+        self._classes = None
+
+        if self._mini_batch_size is None:
+            if options['train_params'] is None:
+                # Set clasifier algorithm here
+                parameters = {'solver': 'lbfgs', 'multi_class': 'auto', 'max_iter': 5000}
+            else:
+                parameters = options['train_params']
+            solver = LogisticRegression
         else:
-            parameters = options['train_params']
-        solver = LogisticRegression
+            if options['train_params'] is None:
+                # The loss must support predict_proba() for the Viterbi stage
+                #  (the logistic loss is called 'log_loss' from scikit-learn 1.1 on and 'log' before, removed in 1.3)
+                log_loss = 'log_loss' if 'log_loss' in SGDClassifier.loss_functions else 'log'
+                parameters = {'loss': log_loss, 'alpha': 0.0001}
+            else:
+                parameters = options['train_params']
+            solver = SGDClassifier
+
+        # Sparse model: L1 or elastic-net penalty (needs saga), C is searched for the target sparsity (see sparsify())
+        self._sparsity = options.get('sparsity')
+        if self._sparsity is not None:
+            parameters = dict(parameters, solver='saga', penalty='elasticnet', l1_ratio=options.get('l1_ratio', 1.0))
 
         # Possible alternative solvers:
         # parameters = {'loss':'modified_huber',  'n_jobs': -1}
@@ -49,19 +303,56 @@ class Trainer:
         # parameters = {'kernel': 'linear', 'probability': True}
         # solver = OneVsRestClassifier(SVC(**parameters))  # XXX won't work because ** in parameters...
 
+        # Warm start: initialise the solver from the coefficients of an earlier model extended to the new data
+        self._continue_from = options.get('continue_from')
+        self._init_model = None
+        if self._continue_from is not None:
+            print('loading model to continue from...', end='', file=sys.stderr, flush=True)
+            self._init_model = joblib.load('{0}.model'.format(self._continue_from))
+            print('done', file=sys.stderr, flush=True)
+
         self._cutoff = options['cutoff']
         self._parameters = parameters
+        self._solver = solver
         self._model = solver(**parameters)
 
+        self._one_vs_rest = options.get('one_vs_rest', False)
+        self._jobs = options.get('jobs', 1)
+        self._deduplicate = options.get('deduplicate', False)
+        self._subsample = options.get('subsample')
+        self._subsample_label = options.get('subsample_label')
+
+        # For evaluation on held-out sentences
+        self._random_seed = options.get('random_seed', 0)
+        self._transmodel_order = options.get('transmodel_order', 3)
+        self._lmw = options.get('lmw', 1.0)
+
         self._model_file_name = options['model_filename']
         self._feat_counter_file_name = options['featcounter_filename']
         self._label_counter_file_name = options['labelcounter_filename']
 
+        # train-all: the transition model is trained on the gold labels in the same pass as the features
+        self._trans_model = None
+        self._trans_model_file_name = options['transmodel_filename']
+        if options.get('task') == 'train-all':
+            if self._continue_from is None:
+                self._trans_model = TransModel(source_fields={self._tag_field_name}, lmw=self._lmw,
+                                               order=self._transmodel_order)
+            else:
+                self._trans_model = TransModel.load_from_file('{0}.transmodel'.format(self._continue_from))
+                self._trans_model.source_fields = {self._tag_field_name}
+        self._first_pass = True  # The transition model counts only the first pass (mini-batch reads the input again)
+
         if options['inp_featurized']:
             self._featurize_sentence_fun = use_featurized_sentence
         else:
             self._featurize_sentence_fun = featurize_sentence
 
+        if self._mini_batch_size is None:
+            self._add_sentence_fun = self._add_sentence
+        else:  # The first pass only counts features and labels to fix the feature space (see fix_feature_space())
+            self._add_sentence_fun = self._count_sentence
+
         self._tok_count = -1  # Index starts from 0
 
         self._data_sizes = options['data_sizes']
@@ -72,8 +363,13 @@ class Trainer:
         self._sent_end = array(self._data_sizes['sent_end'])  # Keep track of sentence boundaries
         self._matrix = None
 
-        self._feat_counter = BookKeeper()
-        self._label_counter = BookKeeper()
+        if self._continue_from is None:
+            self._feat_counter = BookKeeper()
+            self._label_counter = BookKeeper()
+        else:  # New features and labels are numbered after the loaded ones
+            self._feat_counter = BookKeeper('{0}.featureNumbers.gz'.format(self._continue_from))
+            self._label_counter = BookKeeper('{0}.labelNumbers.gz'.format(self._continue_from))
+        self._loaded_feat_num = self._feat_counter.num_of_names()  # These are kept by cutoff
 
         self._feat_filter = lambda token_feats: token_feats
         feat_filename = options.get('used_feats')
@@ -90,6 +386,11 @@ class Trainer:
         self._feat_counter.save(self._feat_counter_file_name)
         self._label_counter.save(self._label_counter_file_name)
         print('done', file=sys.stderr, flush=True)
+        if self._trans_model is not None:
+            print('saving transition model...', end='', file=sys.stderr, flush=True)
+            self._trans_model.compile()
+            self._trans_model.save_to_file(self._trans_model_file_name)
+            print('done', file=sys.stderr, flush=True)
 
     def _update_sent_end(self, sent_ends, row_nums):
         new_ends = array(self._data_sizes['sent_end'])
@@ -130,17 +431,21 @@ class Trainer:
         print('done!', file=sys.stderr, flush=True)
         return matrix
 
-    def cutoff_feats(self):
+    def cutoff_feats(self, cutoff=None):
+        if cutoff is None:
+            cutoff = self._cutoff
         self._tok_count += 1  # This actually was the token index which starts from 0...
         self._convert_to_np_array()
         col_num = self._feat_counter.num_of_names()
-        if self._cutoff < 2:  # Keep all...
+        if cutoff < 2:  # Keep all...
             self._matrix = self._make_sparse_array(self._tok_count, col_num)
         else:
-            print('discarding features with less than {0} occurences...'.format(self._cutoff), end='', file=sys.stderr,
+            print('discarding features with less than {0} occurences...'.format(cutoff), end='', file=sys.stderr,
                   flush=True)
 
-            to_delete = self._feat_counter.cutoff(self._cutoff)
+            to_delete = self._feat_counter.cutoff(cutoff, self._loaded_feat_num)
+            cols_to_keep = np.setdiff1d(np.arange(col_num), np.fromiter(to_delete, dtype=np.int64,
+                                                                         count=len(to_delete)))
             print('done!\nreducing training events by {0}...'.format(len(to_delete)), end='', file=sys.stderr,
                   flush=True)
             # ...that are not in featCounter anymore
@@ -161,8 +466,6 @@ class Trainer:
             # Reduce rows
             rows_np_new = self._rows[indices_to_keep_np]
             row_num_keep = np.unique(rows_np_new)
-            row_num = row_num_keep.shape[0]
-            col_num = indices_to_keep_np.max() + 1
             del self._rows
             self._rows = rows_np_new
             del indices_to_keep_np
@@ -179,7 +482,8 @@ class Trainer:
             del row_num_keep
 
             print('done!', file=sys.stderr, flush=True)
-            matrix = self._make_sparse_array(row_num, col_num)
+            # Rows and columns still have their original numbers, they are renumbered below
+            matrix = self._make_sparse_array(self._tok_count, col_num)
             print('updating indices...', end='', file=sys.stderr, flush=True)
 
             # Update rowNos
@@ -188,14 +492,57 @@ class Trainer:
             del matrix
             del rows
 
-            # Update featNos
-            _, cols = matrix_new.nonzero()
-            self._matrix = matrix_new[:, np.unique(cols)]
+            # Update featNos (the kept ones: loaded features may not occur in the data)
+            self._matrix = matrix_new[:, cols_to_keep]
             del matrix_new
-            del cols
+            del cols_to_keep
 
             print('done!', file=sys.stderr, flush=True)
 
+    def save_dataset(self, dataset_dir):
+        """
+        Write the training events as binary dataset with the feature counts to be able to apply cutoff when it is used
+         (call cutoff_feats(1) before to keep every feature)
+        """
+        print('saving featurized dataset...', end='', file=sys.stderr, flush=True)
+        save_featurized_dataset(dataset_dir, self._matrix, self._sent_end, self._feat_counter, self._label_counter,
+                                self._labels, self._feat_counter.counts())
+        print('done', file=sys.stderr, flush=True)
+
+    def load_dataset(self, dataset_dir):
+        """
+        Use the training events from a binary dataset (see save_dataset()) instead of featurizing the input
+         and cutoff_feats()
+        """
+        print('loading featurized dataset...', end='', file=sys.stderr, flush=True)
+        matrix, sent_end, labels, feat_counts = load_featurized_dataset(dataset_dir)
+        if labels is None or feat_counts is None:
+            print('Error: The dataset ({0}) does not contain labels and feature counts for training '
+                  '(made by tag-featurize?)!'.format(dataset_dir), file=sys.stderr, flush=True)
+            sys.exit(1)
+        self._feat_counter = BookKeeper(join(dataset_dir, dataset_files['featcounter']))
+        self._feat_counter.set_counts(feat_counts)
+        self._label_counter = BookKeeper(join(dataset_dir, dataset_files['labelcounter']))
+        sent_end = array(self._data_sizes['sent_end'], sent_end.tolist())
+        self._tok_count = matrix.shape[0]
+        print('done', file=sys.stderr, flush=True)
+
+        if self._cutoff >= 2:
+            print('discarding features with less than {0} occurences...'.format(self._cutoff), end='',
+                  file=sys.stderr, flush=True)
+            # Same as in cutoff_feats(): drop columns then the rows which became empty and renumber both
+            self._feat_counter.cutoff(self._cutoff)
+            matrix = matrix[:, np.flatnonzero(feat_counts >= self._cutoff)]
+            row_num_keep = np.flatnonzero(np.diff(matrix.indptr))
+            matrix = matrix[row_num_keep, :]
+            labels = labels[row_num_keep]
+            sent_end = self._update_sent_end(sent_end, row_num_keep)
+            print('done!', file=sys.stderr, flush=True)
+
+        self._matrix = matrix
+        self._labels = labels
+        self._sent_end = sent_end
+
     def prepare_fields(self, field_names):
         self._tag_field = field_names.get(self._tag_field_name)  # Bind tag field separately as it has no feature
         return bind_features_to_indices(self.features, self._tag_field, field_names)
@@ -207,11 +554,37 @@ class Trainer:
         :param features: the features bound to columns
         :return: dummy list of tokens which are list of features
         """
-        for label, *feats in self._featurize_sentence_fun(sen, features, self._feat_filter, self._tag_field):
+        sen_feats = self._featurize_sentence_fun(sen, features, self._feat_filter, self._tag_field)
+        if self._trans_model is not None and self._first_pass:
+            self._trans_model._obs_sequence(label for label, *_ in sen_feats)
+        self._add_sentence_fun(sen_feats)
+        return [[]]  # Dummy
+
+    def _add_sentence(self, sen_feats):
+        for label, *feats in sen_feats:
             self._tok_count += 1
             self._add_context(feats, label, self._tok_count)
         self._sent_end.append(self._tok_count)
-        return [[]]  # Dummy
+
+    def _count_sentence(self, sen_feats):
+        # Count the same way as _add_context() to get the same feature numbers and cutoff
+        for label, *feats in sen_feats:
+            self._tok_count += 1
+            for feat in sorted(feats):
+                self._feat_counter.get_no_train(feat)
+            self._label_counter.get_no_train(label)
+
+    def _buffer_sentence(self, sen_feats):
+        get_no_tag = self._feat_counter.get_no_tag
+        get_label_no = self._label_counter.get_no_tag
+        feat_numbers = []
+        labels = []
+        for label, *feats in sen_feats:
+            feat_numbers.append({feat_no for feat_no in map(get_no_tag, feats) if feat_no is not None})
+            labels.append(get_label_no(label))
+        self._shuffle_buffer.append((feat_numbers, labels))
+        if len(self._shuffle_buffer) >= self._shuffle_buffer_size:
+            self._train_on_buffer()
 
     def _add_context(self, tok_feats, label, cur_tok):
         rows_append = self._rows.append
@@ -247,44 +620,100 @@ class Trainer:
         #
         # min(C(feature=value, label1)/C(label1), for any label1)/
         # max(C(feature=value, label2)/C(label2), for any label2)
-        matrix = self._matrix  # For easiser handling
         self._feat_counter.makeno_to_name()
         self._label_counter.makeno_to_name()
         featno_to_name = self._feat_counter.no_to_name
         labelno_to_name = self._label_counter.no_to_name
-        labels = self._labels  # indexed by token rows (row = token number, column = feature number)
-        feat_val_counts = defaultdict(Counter)  # feat, val -> label: count
-
-        if count_zero:
-            # Every index (including zeros to consider negative correlation)
-            for feat in range(matrix.shape[1]):
-                for tok in range(matrix.shape[0]):
-                    feat_val_counts[feat, matrix[tok, feat]][labels[tok]] += 1
+        matrix = self._matrix.tocoo()  # Every nonzero index (row = token number, column = feature number)
+        feat_num = matrix.shape[1]
+        labels = np.asarray(self._labels, dtype=np.int64)  # indexed by token rows
+        label_num = int(labels.max()) + 1 if len(labels) > 0 else 0
+
+        # (C(label2), for any label2)
+        label_counts = np.bincount(labels, minlength=label_num)
+        num_of_labels = np.count_nonzero(label_counts)
+
+        # C(feature=value, label) as one sparse product: (features x tokens) x (tokens x labels indicator matrix)
+        # Currently data = {0, 1}, so the nonzero elements are the (feature=1) events
+        occurences = csr_matrix((np.ones(matrix.nnz, dtype=np.int64), (matrix.col, matrix.row)),
+                                shape=(feat_num, matrix.shape[0]))
+        label_indicator = csr_matrix((np.ones(len(labels), dtype=np.int64), (np.arange(len(labels)), labels)),
+                                     shape=(len(labels), label_num))
+        counts = (occurences @ label_indicator).tocsr()
+        counts.sort_indices()
+        del occurences
+        del label_indicator
+        # The position of the first occurence of each (feature, label) pair aligned with the elements of counts:
+        #  the labels of a feature are printed in this order
+        pair_first = np.unique(matrix.col.astype(np.int64) * label_num + labels[matrix.row], return_index=True)[1]
+        feat_first = np.full(feat_num, matrix.nnz, dtype=np.int64)
+        nonempty = np.flatnonzero(np.diff(counts.indptr))
+        if len(nonempty) > 0:
+            feat_first[nonempty] = np.minimum.reduceat(pair_first, counts.indptr[nonempty])
+        nonzero_value = matrix.data[0] if matrix.nnz > 0 else 1
+        first_tok_nnz = np.count_nonzero(matrix.row == 0)
+
+        if count_zero:  # Every index (including zeros to consider negative correlation): C(feature=0, label)
+            zero_counts = csr_matrix(label_counts[np.newaxis, :] - counts.toarray())
+            zero_counts.eliminate_zeros()
+            zero_counts.sort_indices()
+            # The zero events of a label are ordered by the first token of the label without the feature: the tokens
+            #  of the label with the feature form a prefix of the tokens of the label exactly as long as their rank
+            #  (among the tokens of the label) is equal to their position (among the tokens of the label with the
+            #  feature)
+            label_rows = np.argsort(labels, kind='stable')  # The tokens of each label in order
+            label_begs = np.concatenate(([0], np.cumsum(label_counts)[:-1]))
+            label_rank = np.empty(len(labels), dtype=np.int64)
+            label_rank[label_rows] = np.arange(len(labels)) - label_begs[labels[label_rows]]
+            pairs = matrix.col.astype(np.int64) * label_num + labels[matrix.row]
+            pair_order = np.lexsort((matrix.row, pairs))
+            pair_begs = np.flatnonzero(np.diff(pairs[pair_order], prepend=-1))
+            positions = np.arange(matrix.nnz) - np.repeat(pair_begs, np.diff(np.append(pair_begs, matrix.nnz)))
+            prefix_lens = np.add.reduceat(label_rank[matrix.row[pair_order]] == positions, pair_begs) \
+                if matrix.nnz > 0 else np.zeros(0, dtype=np.int64)
+            zero_first = np.tile(label_rows[np.minimum(label_begs, len(labels) - 1)], (feat_num, 1))
+            feat_of_pair = np.repeat(np.arange(feat_num), np.diff(counts.indptr))
+            first_absent = label_begs[counts.indices] + prefix_lens
+            has_absent = prefix_lens < label_counts[counts.indices]
+            zero_first[feat_of_pair[has_absent], counts.indices[has_absent]] = \
+                label_rows[first_absent[has_absent]]
+            entry_order = np.concatenate((pair_first, zero_first[np.repeat(np.arange(feat_num),
+                                                                           np.diff(zero_counts.indptr)),
+                                                                 zero_counts.indices]))
+            del zero_first
+            key_counts = vstack((counts, zero_counts), format='csr')
+            del zero_counts
+            # Key rows: feature (=nonzero_value) and feat_num + feature (=0), the value of the first token comes first
+            first_tok_has_feat = feat_first < first_tok_nnz
+            keys = np.where(first_tok_has_feat, np.arange(feat_num), np.arange(feat_num) + feat_num)
+            keys = np.column_stack((keys, np.where(first_tok_has_feat, keys + feat_num, keys - feat_num))).ravel()
         else:
-            matrix = matrix.tocoo()
-            # Every nonzero index
-            for tok, feat, val in zip(matrix.row, matrix.col, matrix.data):
-                feat_val_counts[feat, val][labels[tok]] += 1
+            key_counts = counts
+            entry_order = pair_first
+            keys = np.argsort(feat_first, kind='stable')  # By first occurence
+        del counts
         del matrix
+        key_sizes = np.diff(key_counts.indptr)
+        keys = keys[key_sizes[keys] > 0]  # Only (feature, val) touples that have nonzero count
 
-        # (C(label2), for any label2)
-        label_counts = Counter()
-        for k, v in zip(*np.unique(self._labels, return_counts=True)):
-            label_counts[k] = v
+        # Sum, min and max of C(feature=value, label)/C(label) for the labels of every key at once
+        key_begs = key_counts.indptr[:-1][key_sizes > 0]
+        probs = key_counts.data / label_counts[key_counts.indices]
+        maxprob = np.zeros(key_counts.shape[0])
+        minprob = np.ones(key_counts.shape[0])
+        sum_occurences = np.zeros(key_counts.shape[0], dtype=np.int64)
+        if len(key_begs) > 0:
+            maxprob[key_sizes > 0] = np.maximum.reduceat(probs, key_begs)
+            minprob[key_sizes > 0] = np.minimum.reduceat(probs, key_begs)
+            sum_occurences[key_sizes > 0] = np.add.reduceat(key_counts.data, key_begs)
 
-        num_of_labels = len(label_counts)
-        maxprob = defaultdict(lambda: 0.0)
-        minprob = defaultdict(lambda: 1.0)
+        # Equally informative features are kept in the (deterministic) iteration order of the set of
+        #  (feature, value) touples built in the order of their first occurence
         features = set()
-        # For every (feature, val) touple (that has nonzero count)
-        for feature, counts in feat_val_counts.items():
-            # For every label label...
-            features.add(feature)
-            for label, count in counts.items():
-                # prob can only be 0 if the nominator is 0, but this case is already filtered in the Counter...
-                prob = count/label_counts[label]
-                maxprob[feature] = max(prob, maxprob[feature])
-                minprob[feature] = min(prob, minprob[feature])
+        for key in keys.tolist():
+            features.add((key % feat_num, 0 if key >= feat_num else nonzero_value))
+        keys = np.fromiter((feat if val != 0 else feat + feat_num for feat, val in features), dtype=np.int64,
+                           count=len(features))
 
         # Convert features to a list, & sort it by how informative features are.
         """
@@ -299,46 +728,412 @@ class Trainer:
         print('"Feature name"=Value (True/False)', 'Sum of occurences', 'Counts per label', 'Probability per label',
               'Max prob.:Min prob.=Ratio:1.0', sep='\t', file=output_stream)  # Print header (legend)
         # To avoid division by zero...
-        for feature in sorted(features, key=lambda feature_: minprob[feature_]/maxprob[feature_])[:n]:
-            sum_occurences = sum(feat_val_counts[feature].values())
-            if len(feat_val_counts[feature]) < num_of_labels:
+        for key in keys[smallest_stable(minprob[keys] / maxprob[keys], n)].tolist():
+            key_maxprob, key_minprob = maxprob[key].item(), minprob[key].item()
+            beg, end = key_counts.indptr[key], key_counts.indptr[key + 1]
+            order = beg + np.argsort(entry_order[beg:end], kind='stable')
+            key_labels, key_label_counts = key_counts.indices[order].tolist(), key_counts.data[order].tolist()
+            if end - beg < num_of_labels:
                 ratio = 'INF'
             else:
-                ratio = maxprob[feature]/minprob[feature]
+                ratio = key_maxprob/key_minprob
             # NLTK notation
             # print('{0:50} = {1:} {2:6} : {3:-6} = {4} : 1.0'.format(featno_to_name(feature[0]), feature[1],
             #                                                                maxprob[feature],
             #                                                                minprob[feature], ratio))
             # More detailed notation
             print('"{0:50s}"={1}\t{2}\t{3}\t{4}\t{5:6}:{6:-6}={7}:1.0'.format(
-                featno_to_name[feature[0]],
-                bool(feature[1]),
-                sum_occurences,
+                featno_to_name[key % feat_num],
+                key < feat_num,
+                sum_occurences[key],
                 '/'.join(('{0}:{1}'.format(labelno_to_name[label], c)
-                          for label, c in feat_val_counts[feature].items())),
+                          for label, c in zip(key_labels, key_label_counts))),
                 '/'.join(('{0}:{1:.8f}'.format(labelno_to_name[label], c/label_counts[label])
-                          for label, c in feat_val_counts[feature].items())),
-                maxprob[feature], minprob[feature], ratio), file=output_stream)
+                          for label, c in zip(key_labels, key_label_counts))),
+                key_maxprob, key_minprob, ratio), file=output_stream)
 
-    def write_featurized_input(self, output_stream=sys.stdout):
+    def write_featurized_input(self, output_stream=sys.stdout, chunk_size=10000):
+        """
+        Write the featurized input (label and features of a token per line, empty line after each sentence)
+         by walking the CSR arrays and writing chunk_size lines at once
+        """
         self._feat_counter.makeno_to_name()
         self._label_counter.makeno_to_name()
         featno_to_name = self._feat_counter.no_to_name
+        escaped_names = [featno_to_name[no].replace(':', 'colon') for no in range(len(featno_to_name))]
         labelno_to_name = self._label_counter.no_to_name
-        sent_end = self._sent_end
-        matrix = self._matrix.tocsr()
-        labels = self._labels
+        matrix = self._matrix.tocsr()  # Currently data = {0, 1} without stored zeros: the indices are the features
+        indptr, indices = matrix.indptr.tolist(), matrix.indices.tolist()
+        labels = self._labels.tolist()
+        lines = []
         beg = 0
-        for end in sent_end:
+        for end in self._sent_end:
             for row in range(beg, end + 1):
-                print('{0}\t{1}'.format(labelno_to_name[labels[row]],
-                                        '\t'.join(featno_to_name[col].replace(':', 'colon')
-                                                  for col in matrix[row, :].nonzero()[1])),
-                      file=output_stream)
-            print(file=output_stream)  # Sentence separator blank line
+                lines.append('{0}\t{1}\n'.format(labelno_to_name[labels[row]],
+                                                 '\t'.join([escaped_names[col]
+                                                            for col in indices[indptr[row]:indptr[row + 1]]])))
+            lines.append('\n')  # Sentence separator blank line
             beg = end + 1
+            if len(lines) >= chunk_size:
+                output_stream.write(''.join(lines))
+                lines = []
+        output_stream.write(''.join(lines))
+
+    def stream_featurized_input(self, output_stream=sys.stdout, chunk_size=10000):
+        """
+        Write the featurized input while featurizing instead of building the matrix (there is no cutoff to apply).
+         The output is the same as of write_featurized_input(), call end_featurized_input() after the last sentence
+        """
+        self._output_stream = output_stream
+        self._output_chunk_size = chunk_size
+        self._output_lines = []
+        self._escaped_names = []  # Indexed by feature number, extended as new features come
+        self._add_sentence_fun = self._write_sentence
+
+    def _write_sentence(self, sen_feats):
+        escaped_names = self._escaped_names
+        get_no_train = self._feat_counter.get_no_train
+        for label, *feats in sen_feats:
+            feat_numbers = set()
+            for feat in sorted(feats):  # The same numbering as in _add_context()
+                feat_number = get_no_train(feat)
+                if feat_number == len(escaped_names):
+                    escaped_names.append(feat.replace(':', 'colon'))
+                feat_numbers.add(feat_number)
+            self._output_lines.append('{0}\t{1}\n'.format(label, '\t'.join([escaped_names[feat_number]
+                                                                            for feat_number in sorted(feat_numbers)])))
+        self._output_lines.append('\n')  # Sentence separator blank line
+        if len(self._output_lines) >= self._output_chunk_size:
+            self._output_stream.write(''.join(self._output_lines))
+            self._output_lines = []
+
+    def end_featurized_input(self):
+        self._output_stream.write(''.join(self._output_lines))
+        self._output_lines = []
+
+    def _training_events(self, matrix, labels):
+        """
+        Apply majority-class subsampling and deduplication (if set) on the training events
+        :return: the matrix, the labels and the sample weights (None if all events are kept with weight 1)
+        """
+        sample_weight = None
+        if self._subsample is not None:
+            if self._subsample_label is not None:
+                majority_label = self._label_counter.get_no_tag(self._subsample_label)
+                if majority_label is None:
+                    print('Error: --subsample-label {0} is not a label of the training data!'.
+                          format(self._subsample_label), file=sys.stderr)
+                    sys.exit(1)
+            else:
+                majority_label = np.bincount(labels).argmax()
+            print('subsampling training events...', end='', file=sys.stderr, flush=True)
+            rows, sample_weight = subsample_majority(labels, majority_label, self._subsample,
+                                                     np.random.RandomState(self._random_seed))
+            orig_num = matrix.shape[0]
+            matrix, labels = matrix[rows], labels[rows]
+            print('done! ({0} -> {1} events)'.format(orig_num, matrix.shape[0]), file=sys.stderr, flush=True)
+        if self._deduplicate:  # Same objective: the weight of an event is the number of its copies
+            print('deduplicating training events...', end='', file=sys.stderr, flush=True)
+            rows, sample_weight = deduplicate_rows(matrix, labels, sample_weight)
+            orig_num = matrix.shape[0]
+            matrix, labels = matrix[rows], labels[rows]
+            print('done! ({0} -> {1} events, compression ratio: {2:.2f})'.
+                  format(orig_num, matrix.shape[0], orig_num / max(matrix.shape[0], 1)), file=sys.stderr, flush=True)
+        return matrix, labels, sample_weight
+
+    def _warm_start(self, classes):
+        """
+        Initialise the coefficients of the mini-batch model for the given classes from the --continue-from model
+         (padded with zeros for the new features and labels)
+        """
+        coef, intercept = pad_coefficients(self._init_model, self._label_counter.num_of_names(),
+                                           self._feat_counter.num_of_names())
+        coef, intercept = coef[classes], intercept[classes]
+        if len(classes) == 2:  # Binary models have one row: the second class vs. the first
+            coef, intercept = coef[1:] - coef[:1], intercept[1:] - intercept[:1]
+        self._model.coef_ = coef
+        self._model.intercept_ = intercept
+
+    def _continue_training(self, matrix, labels, sample_weight):
+        """
+        Train the --continue-from model on the new data with every label of the extended label set (see
+         fit_from_prior()), the labels missing from the new data keep their coefficients
+        """
+        label_num = self._label_counter.num_of_names()
+        print('continuing the training of {0} with option(s) "{1}"...'.format(self._continue_from, self._parameters),
+              end='', file=sys.stderr, flush=True)
+        coef, intercept = pad_coefficients(self._init_model, label_num, self._feat_counter.num_of_names())
+        coef, intercept, n_iter = fit_from_prior(self._parameters, matrix, labels, coef, intercept, sample_weight)
+        if label_num == 2:  # Binary models have one row: the second class vs. the first
+            coef, intercept = coef[1:] - coef[:1], intercept[1:] - intercept[:1]
+        self._model = LogisticRegression(**dict(self._parameters, multi_class='auto'))  # Softmax if not binary
+        self._model.classes_ = np.arange(label_num, dtype=labels.dtype)
+        self._model.coef_ = coef
+        self._model.intercept_ = intercept
+        self._model.n_iter_ = np.array([n_iter], dtype=np.int32)
+        self._model.n_features_in_ = matrix.shape[1]
+        print('done', file=sys.stderr, flush=True)
 
     def train(self):
-        print('training with option(s) "{0}"...'.format(self._parameters), end='', file=sys.stderr, flush=True)
-        _ = self._model.fit(self._matrix, self._labels)
+        matrix, labels, sample_weight = self._training_events(self._matrix, self._labels)
+        if self._init_model is not None:
+            self._continue_training(matrix, labels, sample_weight)
+            return
+        if self._one_vs_rest:
+            print('training one-vs-rest models for each label in {0} processes with option(s) "{1}"...'.
+                  format(self._jobs, self._parameters), end='', file=sys.stderr, flush=True)
+            self._model = fit_one_vs_rest(self._solver, self._parameters, matrix.astype(np.float64), labels,
+                                          sample_weight, self._jobs)
+        else:
+            print('training with option(s) "{0}"...'.format(self._parameters), end='', file=sys.stderr, flush=True)
+            _ = self._model.fit(matrix, labels, sample_weight=sample_weight)
         print('done', file=sys.stderr, flush=True)
+
+    def _held_out_split(self, held_out):
+        """
+        Split the sentences randomly (by --random-seed) to train and held-out sentences and train the transition
+         model on the train sentences
+        :return: train matrix, train labels, held-out matrix, held-out labels, held-out sent_end, transition model
+         and labelno_to_name
+        """
+        self._label_counter.makeno_to_name()
+        labelno_to_name = self._label_counter.no_to_name
+        sent_num = len(self._sent_end)
+        test_sent_num = max(1, int(round(sent_num * held_out)))
+        sentence_ids = np.random.RandomState(self._random_seed).permutation(sent_num)
+        train_rows, train_sent_end = split_sentences(self._sent_end, np.sort(sentence_ids[test_sent_num:]))
+        test_rows, test_sent_end = split_sentences(self._sent_end, np.sort(sentence_ids[:test_sent_num]))
+        print('splitting {0} sentences to {1} train and {2} held-out sentences...'.
+              format(sent_num, sent_num - test_sent_num, test_sent_num), end='', file=sys.stderr, flush=True)
+        matrix = self._matrix.astype(np.float64)  # Convert only once (not in every fit), the workers share it
+        train_matrix = matrix[train_rows]
+        test_matrix = matrix[test_rows]
+        del matrix
+        train_labels = self._labels[train_rows]
+        test_labels = self._labels[test_rows]
+        print('done', file=sys.stderr, flush=True)
+        trans_model = train_trans_model(train_labels, train_sent_end, labelno_to_name, self._transmodel_order,
+                                        self._lmw)
+        return train_matrix, train_labels, test_matrix, test_labels, test_sent_end, trans_model, labelno_to_name
+
+    def sweep(self, grid, held_out=0.1, jobs=1, output_stream=sys.stdout):
+        """
+        Fit a model for each point of the parameter grid (over the default or supplied parameters) in parallel
+         on the same featurized data and evaluate them on held-out sentences (with transition model trained
+         on the rest). The results are written to output_stream and the best parameters are set for train()
+        """
+        train_matrix, train_labels, test_matrix, test_labels, test_sent_end, trans_model, labelno_to_name = \
+            self._held_out_split(held_out)
+
+        configs = [dict(self._parameters, **point) for point in ParameterGrid(grid)]
+        print('fitting {0} configurations in {1} processes...'.format(len(configs), jobs), end='', file=sys.stderr,
+              flush=True)
+        results = joblib.Parallel(n_jobs=jobs)(
+            joblib.delayed(fit_and_score)(self._solver, parameters, train_matrix, train_labels, test_matrix,
+                                          test_labels, test_sent_end, trans_model, labelno_to_name)
+            for parameters in configs)
+        print('done', file=sys.stderr, flush=True)
+
+        print('Parameters', 'Fit time (s)', 'Accuracy', sep='\t', file=output_stream)
+        for parameters, (fit_time, accuracy) in zip(configs, results):
+            print(parameters, '{0:.3f}'.format(fit_time), '{0:.6f}'.format(accuracy), sep='\t', file=output_stream)
+
+        best = max(range(len(configs)), key=lambda i: results[i][1])  # The first one on ties
+        self._parameters = configs[best]
+        self._model = self._solver(**self._parameters)
+
+    def subsample_report(self, held_out=0.1, jobs=1, output_stream=sys.stdout):
+        """
+        Fit a model on all the training events and one on the subsampled (and deduplicated if set) events of the same
+         train split in parallel, evaluate them on the held-out sentences and write the training-time saving and the
+         accuracy difference to output_stream
+        """
+        train_matrix, train_labels, test_matrix, test_labels, test_sent_end, trans_model, labelno_to_name = \
+            self._held_out_split(held_out)
+        sub_matrix, sub_labels, sub_weight = self._training_events(train_matrix, train_labels)
+
+        print('fitting on all and on the subsampled events in {0} processes...'.format(jobs), end='',
+              file=sys.stderr, flush=True)
+        (all_time, all_accuracy), (sub_time, sub_accuracy) = joblib.Parallel(n_jobs=jobs)(
+            joblib.delayed(fit_and_score)(self._solver, self._parameters, matrix, labels, test_matrix, test_labels,
+                                          test_sent_end, trans_model, labelno_to_name, weight)
+            for matrix, labels, weight in ((train_matrix, train_labels, None), (sub_matrix, sub_labels, sub_weight)))
+        print('done', file=sys.stderr, flush=True)
+
+        print('Training events', 'Events', 'Fit time (s)', 'Accuracy', sep='\t', file=output_stream)
+        print('all', train_matrix.shape[0], '{0:.3f}'.format(all_time), '{0:.6f}'.format(all_accuracy), sep='\t',
+              file=output_stream)
+        print('subsampled', sub_matrix.shape[0], '{0:.3f}'.format(sub_time), '{0:.6f}'.format(sub_accuracy),
+              sep='\t', file=output_stream)
+        print('difference', sub_matrix.shape[0] - train_matrix.shape[0],
+              '{0:+.1%}'.format((sub_time - all_time) / max(all_time, 1e-9)),
+              '{0:+.6f}'.format(sub_accuracy - all_accuracy), sep='\t', file=output_stream)
+
+    def sparsify(self, held_out=0.1, jobs=1, steps=8, tolerance=0.1, output_stream=sys.stdout):
+        """
+        Search C of the sparse (L1 or elastic-net) model for the target sparsity (the fraction of the features without
+         weight) on log scale: starting from the default or supplied C, C is multiplied or divided by 4 until the
+         target is crossed, then the interval between the largest sparse enough and the smallest not sparse enough C
+         is bisected (or divided into jobs + 1 parts fitted in parallel) until their ratio is below 1 + tolerance,
+         in at most steps rounds. The models are evaluated on held-out sentences and the number of surviving features
+         (nonzero weight for any label), the sparsity, the fit time and the accuracy are written to output_stream.
+         The C with the smallest sparsity reaching the target (the least accuracy loss) is set for train()
+        """
+        train_matrix, train_labels, test_matrix, test_labels, test_sent_end, trans_model, labelno_to_name = \
+            self._held_out_split(held_out)
+        feat_num = train_matrix.shape[1]
+        width = joblib.effective_n_jobs(jobs)  # The number of models fitted in one round
+
+        start_c = self._parameters.get('C', 1.0)
+        results = {}  # C -> (fit time, accuracy, surviving features, sparsity)
+        sparse_c, dense_c = None, None
+        for _ in range(steps):
+            if sparse_c is None and dense_c is None:  # First round: around the starting C
+                cs = [start_c * 4.0 ** (i - width // 2) for i in range(width)]
+            elif sparse_c is None:  # Every C is too large (not sparse enough): go downward
+                cs = [dense_c / 4.0 ** (i + 1) for i in range(width)]
+            elif dense_c is None:  # Every C is small enough (sparse enough): go upward
+                cs = [sparse_c * 4.0 ** (i + 1) for i in range(width)]
+            elif dense_c / sparse_c < 1 + tolerance:  # The target is crossed between two close C
+                break
+            else:  # Divide the interval into width + 1 equal parts on log scale
+                cs = [sparse_c * (dense_c / sparse_c) ** ((i + 1) / (width + 1)) for i in range(width)]
+
+            print('fitting {0} sparse models in {1} processes...'.format(len(cs), jobs), end='', file=sys.stderr,
+                  flush=True)
+            fitted = joblib.Parallel(n_jobs=jobs)(
+                joblib.delayed(fit_and_score)(self._solver, dict(self._parameters, C=c), train_matrix, train_labels,
+                                              test_matrix, test_labels, test_sent_end, trans_model, labelno_to_name,
+                                              count_features=True)
+                for c in cs)
+            print('done', file=sys.stderr, flush=True)
+            for c, (fit_time, accuracy, surviving) in zip(cs, fitted):
+                results[c] = (fit_time, accuracy, surviving, 1 - surviving / max(feat_num, 1))
+
+            # The largest sparse enough C and the smallest C above it which is not sparse enough
+            sparse_c = max((c for c, result in results.items() if result[3] >= self._sparsity), default=None)
+            dense_c = min((c for c, result in results.items() if result[3] < self._sparsity and
+                           (sparse_c is None or c > sparse_c)), default=None)
+
+        print('C', 'Surviving features', 'Sparsity', 'Fit time (s)', 'Accuracy', sep='\t', file=output_stream)
+        for c, (fit_time, accuracy, surviving, sparsity) in sorted(results.items(), reverse=True):
+            print(c, surviving, '{0:.1%}'.format(sparsity), '{0:.3f}'.format(fit_time), '{0:.6f}'.format(accuracy),
+                  sep='\t', file=output_stream)
+
+        # The weakest regularisation (the least accuracy loss) which is sparse enough: the closest to the target
+        best = min(((result[3], -c) for c, result in results.items() if result[3] >= self._sparsity), default=None)
+        if best is None:
+            best = max((result[3], c) for c, result in results.items())
+            print('WARNING: The target sparsity ({0:.1%}) is not reached, using the sparsest model: C={1}'.
+                  format(self._sparsity, best[1]), file=sys.stderr, flush=True)
+            best_c = best[1]
+        else:
+            best_c = -best[1]
+        self._parameters = dict(self._parameters, C=best_c)
+        self._model = self._solver(**self._parameters)
+
+    def template_report(self, output_stream=sys.stdout):
+        """
+        Write the number of features and the number of features with nonzero weight (for any label) of each feature
+         template (in the order of the config) of the trained model to output_stream.
+         The templates without surviving features are not needed for tagging and can be removed from the config
+        """
+        self._feat_counter.makeno_to_name()
+        featno_to_name = self._feat_counter.no_to_name
+        feat_num = self._feat_counter.num_of_names()
+        surviving = np.zeros(feat_num, dtype=bool)
+        surviving[surviving_features(self._model)] = True
+
+        # Feature names are template[position]=value
+        counts = {} if self.features is None else {name: [0, 0] for name in self.features.keys()}
+        for feat_no in range(feat_num):
+            template_counts = counts.setdefault(featno_to_name[feat_no].split('[', 1)[0], [0, 0])
+            template_counts[0] += 1
+            template_counts[1] += surviving[feat_no]
+
+        print('Template', 'Features', 'Surviving features', sep='\t', file=output_stream)
+        for name, (template_feat_num, surviving_num) in counts.items():
+            print(name, template_feat_num, surviving_num, sep='\t', file=output_stream)
+        removable = [name for name, (_, surviving_num) in counts.items() if surviving_num == 0]
+        print('templates without surviving features (can be removed from the config): {0}'.
+              format(', '.join(removable) if len(removable) > 0 else 'none'), file=sys.stderr, flush=True)
+
+    def evaluate(self, folds=10, jobs=1, output_stream=sys.stdout):
+        """
+        K-fold cross-validation on the featurized sentences: train the observation and the transition model
+         for each fold in parallel and write the token and chunk level precision, recall and F1 for each fold
+        """
+        self._label_counter.makeno_to_name()
+        sent_num = len(self._sent_end)
+        if not 2 <= folds <= sent_num:
+            print('Error: The number of folds ({0}) must be between 2 and the number of sentences ({1})!'.
+                  format(folds, sent_num), file=sys.stderr, flush=True)
+            sys.exit(1)
+        sentence_ids = np.random.RandomState(self._random_seed).permutation(sent_num)
+        matrix = self._matrix.astype(np.float64)  # Convert only once (not in every fit), the workers share it
+        print('evaluating {0} folds in {1} processes...'.format(folds, jobs), end='', file=sys.stderr, flush=True)
+        results = joblib.Parallel(n_jobs=jobs)(
+            joblib.delayed(evaluate_fold)(self._solver, self._parameters, matrix, self._labels, self._sent_end,
+                                          np.sort(test_sentence_ids), self._label_counter.no_to_name,
+                                          self._transmodel_order, self._lmw)
+            for test_sentence_ids in np.array_split(sentence_ids, folds))
+        print('done', file=sys.stderr, flush=True)
+
+        print('Fold', 'Tokens', 'Fit time (s)', 'Tagging (tokens/s)', 'Accuracy', 'Token P', 'Token R', 'Token F1',
+              'Chunk P', 'Chunk R', 'Chunk F1', sep='\t', file=output_stream)
+        for fold, counts in enumerate(results + [sum(results, Counter())], start=1):
+            print('Total' if fold > folds else fold, counts['tokens'], '{0:.3f}'.format(counts['fit_time']),
+                  '{0:.1f}'.format(counts['tokens'] / max(counts['tag_time'], 1e-9)),
+                  '{0:.6f}'.format(counts['token_correct'] / counts['tokens']),
+                  *('{0:.6f}'.format(score) for score in precision_recall_f1(counts['token_tp'],
+                                                                             counts['token_predicted'],
+                                                                             counts['token_gold'])),
+                  *('{0:.6f}'.format(score) for score in precision_recall_f1(counts['chunk_tp'],
+                                                                             counts['chunk_predicted'],
+                                                                             counts['chunk_gold'])),
+                  sep='\t', file=output_stream)
+
+    def fix_feature_space(self):
+        """
+        Close the counting pass of mini-batch training: apply cutoff and freeze the feature and label numbers
+         as partial_fit() requires the same number of features and the list of all labels on every call
+        """
+        self._tok_count += 1  # This actually was the token index which starts from 0...
+        print('counted {0} tokens, {1} features and {2} labels'.
+              format(self._tok_count, self._feat_counter.num_of_names(), self._label_counter.num_of_names()),
+              file=sys.stderr, flush=True)
+        if self._cutoff >= 2:
+            print('discarding features with less than {0} occurences...'.format(self._cutoff), end='',
+                  file=sys.stderr, flush=True)
+            to_delete = self._feat_counter.cutoff(self._cutoff, self._loaded_feat_num)
+            print('done! ({0} features discarded)'.format(len(to_delete)), file=sys.stderr, flush=True)
+        self._classes = np.arange(self._label_counter.num_of_names(), dtype=self._data_sizes['labels_np'])
+        if self._init_model is not None:
+            self._warm_start(self._classes)
+        self._add_sentence_fun = self._buffer_sentence
+        self._first_pass = False  # The mini-batch passes start
+
+    def _train_on_buffer(self):
+        col_num = self._feat_counter.num_of_names()
+        self._random.shuffle(self._shuffle_buffer)
+        for beg in range(0, len(self._shuffle_buffer), self._mini_batch_size):
+            rows = array(self._data_sizes['rows'])
+            cols = array(self._data_sizes['cols'])
+            labels = array(self._data_sizes['labels'])
+            for feat_numbers, sent_labels in self._shuffle_buffer[beg:beg + self._mini_batch_size]:
+                for feat_number_set, label in zip(feat_numbers, sent_labels):
+                    cols.extend(feat_number_set)
+                    rows.extend([len(labels)] * len(feat_number_set))
+                    labels.append(label)
+            matrix = csr_matrix((np.ones(len(cols), dtype=self._data_sizes['data_np']), (rows, cols)),
+                                shape=(len(labels), col_num), dtype=self._data_sizes['data_np'])
+            self._model.partial_fit(matrix, np.array(labels, dtype=self._data_sizes['labels_np']),
+                                    classes=self._classes)
+        self._shuffle_buffer = []
+
+    def end_epoch(self, epoch):
+        """
+        Train on the remaining sentences of the shuffle buffer at the end of each pass in mini-batch training
+        """
+        self._train_on_buffer()
+        print('epoch {0} done'.format(epoch), file=sys.stderr, flush=True)
@@ -11,6 +11,8 @@ import math
 import pickle
 from collections import Counter
 
+import numpy as np
+
 
 def safe_div(v1, v2):
     """
@@ -44,6 +46,7 @@ class TransModel:
         self._sent_count = 0
         self.tags = set()
         self.updated = True
+        self._dense_logprobs = None  # See _dense_transitions()
         self.reset()
 
         # Field names for e-magyar TSV
@@ -124,6 +127,7 @@ class TransModel:
 
     # Close model, and compute probabilities after (possibly incremental) training
     def compile(self):
+        self._dense_logprobs = None
         self.trigram_logprob = {}
         self.bigram_logprob = {}
         self.unigram_logprob = {}
@@ -140,7 +144,8 @@ class TransModel:
             self._sent_count = 0
 
         # Compute unigram probs: P(t_n) = C(t_n)/sum_i(C(t_i))
-        self.tags = set(self._unigram_count.keys())
+        # The boundary symbol is not a state of the Viterbi, so the model is usable without saving it
+        self.tags = set(self._unigram_count.keys()) - {self._boundary_symbol}
         self.unigram_logprob = {tag: math.log(count) - math.log(self._obs_count)
                                 for tag, count in self._unigram_count.items()}
 
@@ -253,7 +258,9 @@ class TransModel:
     def _log_prob(self, n_minus_two=None, n_minus_one=None, nth=None):
         if not self.updated:
             print(self._update_warning, file=sys.stderr, flush=True)
+        return self._interpolated_log_prob(n_minus_two, n_minus_one, nth)
 
+    def _interpolated_log_prob(self, n_minus_two=None, n_minus_one=None, nth=None):
         # Trigram, which is seen in training set or using smoothing
         tri = self.trigram_logprob.get((n_minus_two, n_minus_one, nth), self._log_smooth)
 
@@ -266,12 +273,15 @@ class TransModel:
         # Weighted by lambdas...
         return self._lambda1 * uni + self._lambda2 * bi + self._lambda3 * tri
 
+    def _obs_log_prob(self, prob):
+        if prob > 0.0:
+            return math.log(prob)
+        return self._log_smooth
+
     def prob(self, n_minus_two=None, n_minus_one=None, nth=None):
         return math.exp(self._log_prob(n_minus_two, n_minus_one, nth))
 
     def save_to_file(self, file_name):
-        self.tags.remove(self._boundary_symbol)
-
         obs = ((self._unigram_count, self.unigram_logprob, self._lambda1),
                (self._bigram_count, self.bigram_logprob, self._lambda2),
                (self._trigram_count, self.trigram_logprob, self._lambda3))
@@ -303,124 +313,146 @@ class TransModel:
 
             return m
 
+    def to_tensors(self):
+        """
+        The compiled log probabilities as dense arrays indexed by the symbols (the tags then the boundary symbol),
+         NaN marks the unseen n-grams. The counts are not included: the model can be used for tagging only
+        :return: the symbols, the unigram, bigram and trigram arrays and the parameters needed by from_tensors()
+        """
+        symbols = sorted(self.tags) + [self._boundary_symbol]
+        symbol_to_no = {symbol: no for no, symbol in enumerate(symbols)}
+        n = len(symbols)
+        tensors = (np.full(n, np.nan), np.full((n, n), np.nan), np.full((n, n, n), np.nan))
+        for tensor, logprobs in zip(tensors, (self.unigram_logprob, self.bigram_logprob, self.trigram_logprob)):
+            for key, logprob in logprobs.items():
+                if not isinstance(key, tuple):
+                    key = (key,)
+                if all(symbol in symbol_to_no for symbol in key):  # Only n-grams of observed sequences are used
+                    tensor[tuple(symbol_to_no[symbol] for symbol in key)] = logprob
+        params = {'lambdas': [self._lambda1, self._lambda2, self._lambda3], 'log_smooth': self._log_smooth,
+                  'boundary_symbol': self._boundary_symbol, 'lmw': self._language_model_weight, 'order': self._order}
+        return symbols, tensors, params
+
+    @staticmethod
+    def from_tensors(symbols, tensors, params):
+        """
+        Build a compiled model for tagging from the output of to_tensors()
+        """
+        m = TransModel(boundary_symbol=params['boundary_symbol'], lmw=params['lmw'], order=params['order'])
+        m._log_smooth = params['log_smooth']
+        m._lambda1, m._lambda2, m._lambda3 = params['lambdas']
+        unigram, bigram, trigram = tensors
+        m.unigram_logprob = {symbols[i]: float(unigram[i]) for i in np.flatnonzero(~np.isnan(unigram)).tolist()}
+        m.bigram_logprob = {(symbols[i], symbols[j]): float(bigram[i, j])
+                            for i, j in np.argwhere(~np.isnan(bigram)).tolist()}
+        m.trigram_logprob = {(symbols[i], symbols[j], symbols[k]): float(trigram[i, j, k])
+                             for i, j, k in np.argwhere(~np.isnan(trigram)).tolist()}
+        m.tags = set(symbols) - {m._boundary_symbol}
+        return m
+
+    def _dense_transitions(self):
+        """
+        The transition log probabilities (as _log_prob()) between the states (the sorted tags) as dense arrays:
+         start (from the boundary), first (bigram history: boundary, z), trans and end (to the boundary).
+         Computed on first use (threads computing them at once get the same arrays)
+        """
+        dense = self._dense_logprobs
+        if dense is None:
+            if not self.updated:
+                print(self._update_warning, file=sys.stderr, flush=True)
+            states = sorted(self.tags)
+            lp = self._interpolated_log_prob
+            bnd = self._boundary_symbol
+            end = np.array([lp(None, y, bnd) for y in states])
+            if self._order == 2:
+                start = np.array([lp(None, bnd, y) for y in states])
+                first = None
+                trans = np.array([[lp(None, y0, y) for y in states] for y0 in states])
+            else:
+                start = np.array([lp(bnd, bnd, y) for y in states])
+                first = np.array([[lp(bnd, z, y) for y in states] for z in states])
+                trans = np.array([[[lp(y0, z, y) for y in states] for z in states] for y0 in states])
+            dense = states, start, first, trans, end
+            self._dense_logprobs = dense
+        return dense
+
+    def _obs_log_probs(self, states, tagprobs_by_pos):
+        # Make logprob from probs... (SGD models can yield underflowed zero probabilities which are smoothed)
+        return np.array([[self._obs_log_prob(prob_dist[y]) for y in states] for prob_dist in tagprobs_by_pos])
+
+    @staticmethod
+    def _last_argmax(scores):
+        """
+        The index of the maximum along the first axis, the last one on ties (as max() on (score, state) tuples
+         of the sorted states)
+        """
+        return len(scores) - 1 - np.argmax(scores[::-1], axis=0)
+
     """
-    source: http://en.wikipedia.org/wiki/Viterbi_algorithm
-    The code has been modified to match our Bigram models:
-    - models are dictionaries with tuples as keys
-    - starting probabilities are not separate and end probabilities are also
-    taken into consideration
-    - transProbs should be a Bigram instance
+    The Viterbi algorithm on dense arrays: each step is a few numpy operations over all states at once (they release
+     the GIL, so threads can tag in parallel). The floating point operations are the same (in the same order) as in the
+     original per-state loops (http://en.wikipedia.org/wiki/Viterbi_algorithm), so are the results:
+    - starting probabilities are not separate and end probabilities are also taken into consideration
     - tagProbsByPos should be a list containing, for each position,
       the probability distribution over tags as returned by the maxent model
     - all probabilities are expected to be in log space
     """
     def _viterbi_bigram(self, tagprobs_by_pos):
-        # Make logprob from probs...
-        tagprobs_by_pos = [dict([(key, math.log(val))
-                                 for key, val in probDist.items()])
-                           for probDist in tagprobs_by_pos]
-        v = [{}]
-        path = {}
-        states = self.tags
-
-        # Initialize base cases (t == 0)
-        for y in states:
-            v[0][y] = (self._language_model_weight *
-                       # We can come only from boundary symbols, so there is no need for loop and max...
-                       # We must remember len(states) piece of states
-                       self._log_prob(None, self._boundary_symbol, y) +
-                       tagprobs_by_pos[0][y])
-            path[y] = [y]
-
-        # Run Viterbi for t > 0
-        for t in range(1, len(tagprobs_by_pos)):
-            v.append({})
-            newpath = {}
-            # We extend the graph to every possible states
-            # To every possible states, we can only come from the maximum
-            # We remember this particular state
-            for y in states:
-                # In t-1 we stand at y0 with some specific probability but we only could come from the maximum
-                (prob, state) = max([(v[t - 1][y0] +
-                                      self._language_model_weight *
-                                      # If we come from (z, y0)
-                                      self._log_prob(None, y0, y) +
-                                      # If we extend, we get this
-                                      tagprobs_by_pos[t][y],
-                                      # This is the history, that we check
-                                      # We compute max by y0
-                                      y0) for y0 in states])
-                # Now we stand at y, because it has the maximal probability 'prob'
-                v[t][y] = prob
-                # Extending the path with y, we came from state 'state'
-                newpath[y] = path[state] + [y]
-
-            # Don't need to remember the old paths
-            path = newpath
+        states, start, _, trans, end = self._dense_transitions()
+        obs = self._obs_log_probs(states, tagprobs_by_pos)
+        lmw = self._language_model_weight
+        lmw_trans = lmw * trans
+
+        # Initialize base cases (t == 0): we can come only from the boundary symbol
+        v = lmw * start + obs[0]
+        back = [None]
+        # Run Viterbi for t > 0: to every state y we can only come from the maximum (y0 is the history)
+        for t in range(1, len(obs)):
+            scores = v[:, np.newaxis] + lmw_trans + obs[t]  # [y0, y]
+            best = self._last_argmax(scores)
+            back.append(best)
+            v = scores[best, np.arange(len(states))]
 
         # At the end of the text we do a multiplication with a transition to check
         # 'If we were in the end, would we come this way or not?'...
-        (prob, state) = max([(v[len(tagprobs_by_pos) - 1][y] + self._log_prob(None, y, self._boundary_symbol), y)
-                             for y in states])
-        return prob, path[state]
+        scores = v + end
+        state = int(self._last_argmax(scores))
+        path = [state]
+        for t in range(len(obs) - 1, 0, -1):
+            path.append(int(back[t][path[-1]]))
+        return float(scores[state]), [states[y] for y in reversed(path)]
 
     def _viterbi_trigram(self, tag_probs_by_pos):
-        # Make logprob from probs...
-        tag_probs_by_pos = [dict([(key, math.log(val))
-                                  for key, val in probDist.items()])
-                            for probDist in tag_probs_by_pos]
-        v = [{}]
-        path = {}
-        states = self.tags
-
-        # Initialize base cases (t == 0)
-        for z in states:
-            for y in states:
-                v[0][z, y] = (self._language_model_weight *
-                              self._log_prob(self._boundary_symbol, self._boundary_symbol, y) +
-                              tag_probs_by_pos[0][y])
-                path[z, y] = [y]
-
-        if len(tag_probs_by_pos) > 1:
+        states, start, first, trans, end = self._dense_transitions()
+        obs = self._obs_log_probs(states, tag_probs_by_pos)
+        lmw = self._language_model_weight
+        n = len(states)
+        all_states = np.arange(n)
+
+        # Initialize base cases (t == 0): v[z, y] (the same for every z)
+        v = np.broadcast_to(lmw * start + obs[0], (n, n))
+        back = [None, None]  # The history of t == 1 is the boundary (any y0 of the equal ones)
+        if len(obs) > 1:
             # Run Viterbi for t == 1
-            v.append({})
-            newpath = {}
-
-            for z in states:
-                for y in states:
-                    (prob, state) = max([(v[0][y0, z] +
-                                          self._language_model_weight *
-                                          self._log_prob(self._boundary_symbol, z, y) +
-                                          tag_probs_by_pos[1][y],
-                                          y0) for y0 in states])
-                    v[1][z, y] = prob
-                    newpath[z, y] = path[state, z] + [y]
-
-            # Don't need to remember the old paths
-            path = newpath
+            scores = v[:, :, np.newaxis] + lmw * first + obs[1]  # [y0, z, y]
+            v = scores[self._last_argmax(scores), all_states[:, np.newaxis], all_states]
 
             # Run Viterbi for t > 1
-            for t in range(2, len(tag_probs_by_pos)):
-                v.append({})
-                newpath = {}
-
-                for z in states:
-                    for y in states:
-                        (prob, state) = max([(v[t - 1][y0, z] +
-                                              self._language_model_weight *
-                                              self._log_prob(y0, z, y) +
-                                              tag_probs_by_pos[t][y],
-                                              y0) for y0 in states])
-                        v[t][z, y] = prob
-                        newpath[z, y] = path[state, z] + [y]
-
-                # Don't need to remember the old paths
-                path = newpath
+            lmw_trans = lmw * trans
+            for t in range(2, len(obs)):
+                scores = v[:, :, np.newaxis] + lmw_trans + obs[t]  # [y0, z, y]
+                best = self._last_argmax(scores)
+                back.append(best)
+                v = scores[best, all_states[:, np.newaxis], all_states]
 
         # Micro-optimalization: Brants (2000) say self._log_prob(None, y, self._boundary_symbol),
         # but why not self._log_prob(z, y, self._boundary_symbol) ?
-        (prob, state, state2) = max([(v[len(tag_probs_by_pos) - 1][z, y] +
-                                      # self._log_prob(z, y, self._boundary_symbol), z, y)
-                                      self._log_prob(None, y, self._boundary_symbol), z, y)
-                                     for z in states for y in states])
-        return prob, path[state, state2]
+        scores = (v + end).ravel()  # The largest (z, y) on ties as max() on (prob, z, y)
+        state = int(self._last_argmax(scores))
+        z, y = divmod(state, n)
+        if len(obs) == 1:
+            return float(scores[state]), [states[y]]
+        path = [y, z]
+        for t in range(len(obs) - 1, 1, -1):
+            path.append(int(back[t][path[-1], path[-2]]))
+        return float(scores[state]), [states[y] for y in reversed(path)]
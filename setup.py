@@ -36,7 +36,7 @@ setuptools.setup(
         'License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)',
         'Operating System :: POSIX :: Linux',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=['xtsv>=1.0.0,<2.0.0',
                       'pyyaml',
                       'numpy',
@@ -16,6 +16,37 @@ time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train --model=testMNP --config-file=
 time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
     --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | head -n100) \
     && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train, deduplicated training events
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train --model=testNERDedup --config-file=configs/ner.szeged.emmorph.yaml \
+    --deduplicate --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train, parallel one-vs-rest
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train --model=testNEROneVsRest --config-file=configs/ner.szeged.emmorph.yaml \
+    --one-vs-rest -j 2 --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train, subsampled majority label with held-out comparison
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train --model=testNERSubsample --config-file=configs/ner.szeged.emmorph.yaml \
+    --subsample 0.3 --subsample-report --held-out 0.3 --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | \
+    head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train, sparse (L1) model with feature template report
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train --model=testNERSparse --config-file=configs/ner.szeged.emmorph.yaml \
+    --sparsity 0.9 --held-out 0.3 -j 2 --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | \
+    head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train, mini-batch (SGD)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train --model=testMNPMiniBatch \
+    --config-file=configs/maxnp.szeged.emmorph.yaml --mini-batch 10 --epochs 3 \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train-sweep
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train-sweep --model=testMNPSweep \
+    --config-file=configs/maxnp.szeged.emmorph.yaml --grid "{C: [0.1, 1.0]}" --held-out 0.3 -j 2 \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# evaluate (cross-validation)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} evaluate --model=testNER \
+    --config-file=configs/ner.szeged.emmorph.yaml --folds 2 -j 2 \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
 # train, featurize (for crfsuite)
 time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train-featurize --model=testMNP \
     --config-file=configs/maxnp.szeged.emmorph.yaml \
@@ -27,6 +58,17 @@ time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train-featurize --model=testNER \
     --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph | \
     diff -sy --suppress-common-lines - ${CURDIR}/tests/test.ner.CRFsuite.train 2>&1 | head -n100) \
     && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train, featurize to binary dataset and use it instead of the input
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train-featurize --model=testMNP \
+    --config-file=configs/maxnp.szeged.emmorph.yaml --save-dataset testMNP.dataset \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} train-featurize --model=testMNP --load-dataset testMNP.dataset | \
+    diff -sy --suppress-common-lines - ${CURDIR}/tests/test.maxnp.CRFsuite.train 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} most-informative-features --model=testMNP --load-dataset testMNP.dataset | \
+    diff -sy --suppress-common-lines - ${CURDIR}/tests/test.maxnp.mostInformativeFeatures 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
 # most-informative-features
 time (cd /tmp && ${VENVPYTHON} -m ${MODULE} most-informative-features --model=testMNP \
     --config-file=configs/maxnp.szeged.emmorph.yaml -i ${CURDIR}/tests/test.maxnp.emmorph | \
@@ -47,6 +89,50 @@ time (cd /tmp && ${VENVPYTHON} -m ${MODULE} transmodel-train --model=testNER \
     --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | head -n100) \
     && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
     # --trans-model-order [2 or 3, default: 3]
+# train and transmodel-train, continued from an earlier model on new data (new forms and a new label: S-NP)
+#  the loaded names keep their numbers, the new ones are numbered after them (unique and contiguous)
+time (cd /tmp && sed '1!s/^\([^\t][^\t]*\)\t/\1zz\t/; s/\t1-NP$/\tS-NP/' ${CURDIR}/tests/test.maxnp.emmorph \
+        > testMNPContinued.input &&
+    ${VENVPYTHON} -m ${MODULE} train --model=testMNPContinued --continue-from testMNP \
+    --config-file=configs/maxnp.szeged.emmorph.yaml --gold-tag-field gold -i testMNPContinued.input &&
+    ${VENVPYTHON} -c 'import sys, gzip
+for kind in ("featureNumbers", "labelNumbers"):
+    old, new = [dict(line.rstrip("\n").split("\t") for line in gzip.open("{0}.{1}.gz".format(model, kind), "rt"))
+                for model in sys.argv[1:]]
+    nos = sorted(int(no) for no in new.values())
+    assert nos == list(range(len(new))), "{0}: the numbers are not unique and contiguous!".format(kind)
+    assert all(new[name] == no for name, no in old.items()), "{0}: the loaded numbers changed!".format(kind)
+    assert len(new) > len(old), "{0}: no new name!".format(kind)' testMNP testMNPContinued 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} transmodel-train --model=testMNPContinued --continue-from testMNP \
+    --gold-tag-field gold -i testMNPContinued.input 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# continued on new data which lacks most of the labels (only O and 1-ORG): every label of the earlier model is kept
+#  and the continued model tags without errors
+time (cd /tmp && awk -F'\t' 'BEGIN {OFS="\t"} NR > 1 && NF == 4 && $4 != "" && $4 != "1-ORG" {$4 = "O"} {print}' \
+        ${CURDIR}/tests/test.ner.emmorph > testNERContinued.input &&
+    ${VENVPYTHON} -m ${MODULE} train-all --model=testNERContinued --continue-from testNER \
+    --config-file=configs/ner.szeged.emmorph.yaml --gold-tag-field gold -i testNERContinued.input &&
+    ${VENVPYTHON} -c 'import sys, gzip, joblib
+labels = [line for line in gzip.open(sys.argv[1] + ".labelNumbers.gz", "rt")]
+assert len(joblib.load(sys.argv[2] + ".model").classes_) == len(labels), "labels are missing from the model!"' \
+    testNER testNERContinued &&
+    ${VENVPYTHON} -m ${MODULE} tag --model=testNERContinued --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph > testNERContinued.output 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# train-all (train and transmodel-train in one pass) writes the same files as train and transmodel-train
+#  (the same hash seed: the labels of the transition model are pickled as a set)
+time (cd /tmp && export PYTHONHASHSEED=0 &&
+    ${VENVPYTHON} -m ${MODULE} train-all --model=testMNPAll --config-file=configs/maxnp.szeged.emmorph.yaml \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100 &&
+    ${VENVPYTHON} -m ${MODULE} train --model=testMNPSeparate --config-file=configs/maxnp.szeged.emmorph.yaml \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100 &&
+    ${VENVPYTHON} -m ${MODULE} transmodel-train --model=testMNPSeparate \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100 &&
+    cmp testMNPAll.model testMNPSeparate.model && cmp testMNPAll.transmodel testMNPSeparate.transmodel &&
+    cmp <(zcat testMNPAll.featureNumbers.gz) <(zcat testMNPSeparate.featureNumbers.gz) &&
+    cmp <(zcat testMNPAll.labelNumbers.gz) <(zcat testMNPSeparate.labelNumbers.gz)) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
 
 echo "Running eval tests..."
 # tag
@@ -69,6 +155,16 @@ time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag-featurize --model=models/ner.sze
     --config-file=configs/ner.szeged.emmorph.yaml -i ${CURDIR}/tests/test.ner.emmorph | \
     diff -sy --suppress-common-lines - ${CURDIR}/tests/test.ner.CRFsuite.tag 2>&1 | head -n100) \
     && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# tag-featurize to binary dataset, then tag it (one label per line)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag-featurize --model=models/maxnp.szeged.emmorph \
+    --config-file=configs/maxnp.szeged.emmorph.yaml --save-dataset testMNP.tag.dataset \
+    -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=models/maxnp.szeged.emmorph \
+    --load-dataset testMNP.tag.dataset | \
+    diff -sy --suppress-common-lines - <(tail -n +2 ${CURDIR}/tests/test.maxnp.tag | awk -F'\t' '{print $NF}') 2>&1 | \
+    head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
 # tag FeatureWeights
 time (cd /tmp && ${VENVPYTHON} -m ${MODULE} print-weights -w 100 --model=models/maxnp.szeged.emmorph \
     --config-file=configs/maxnp.szeged.emmorph.yaml | \
@@ -78,3 +174,157 @@ time (cd /tmp && ${VENVPYTHON} -m ${MODULE} print-weights -w 100 --model=models/
     --config-file=configs/ner.szeged.emmorph.yaml | \
     diff -sy --suppress-common-lines - ${CURDIR}/tests/test.ner.modelWeights 2>&1 | head -n100) \
     && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# FeatureWeights as machine-readable table
+#  (the whole table is read: a header and the 5 best and 5 worst features of each label in 5 columns)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} print-weights -w 5 --weights-format tsv --model=testMNP \
+    --config-file=configs/maxnp.szeged.emmorph.yaml |
+    awk -F'\t' -v labels="$(zcat testMNP.labelNumbers.gz | wc -l)" \
+    'NF != 5 {exit 1} END {exit NR != 1 + labels * 2 * 5}' 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# compact-model (the threshold must prune features), then tag with the compact model (a label for each token)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} compact-model --model=testMNP --weight-threshold 0.05 \
+    --compact-model testMNPCompact --config-file=configs/maxnp.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.maxnp.emmorph > testMNPCompact.report &&
+    awk -F'\t' '$1 == "original" {orig = $2} $1 == "compact" {comp = $2} END {exit !(comp < orig)}' \
+        testMNPCompact.report &&
+    ${VENVPYTHON} -m ${MODULE} tag --model=testMNPCompact --config-file=configs/maxnp.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.maxnp.emmorph > testMNPCompact.tag &&
+    [ "$(wc -l < testMNPCompact.tag)" -eq "$(wc -l < ${CURDIR}/tests/test.maxnp.emmorph)" ] &&
+    awk -F'\t' 'NR > 1 && NF > 1 && $NF == "" {exit 1}' testMNPCompact.tag 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# compact-model with int8 weights
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} compact-model --model=testMNP --quantize int8 \
+    --compact-model testMNPInt8 --config-file=configs/maxnp.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.maxnp.emmorph 2>&1 | head -n100) \
+    && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# bundle, then tag from the bundle
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} bundle --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    2>&1 | head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# the output must be the same as the one of the separate files (also with the checksum verified)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --bundle -i ${CURDIR}/tests/test.ner.emmorph | \
+    diff - <(${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph) 2>&1 | head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --bundle --verify-bundle \
+    -i ${CURDIR}/tests/test.ner.emmorph | \
+    diff - <(${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph) 2>&1 | head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# tag in worker processes sharing the memory-mapped bundle
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --bundle -j 2 -i ${CURDIR}/tests/test.ner.emmorph 2>&1 | \
+    head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# tag with the per-token score cache (the output must be the same as without it)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    --score-cache 100 -i ${CURDIR}/tests/test.ner.emmorph | \
+    diff - <(${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph) 2>&1 | head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+#  (a cache smaller than the number of the values evicts the least recently used blocks, shared by the threads)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    --score-cache 10 --threads 2 -i ${CURDIR}/tests/test.ner.emmorph | \
+    diff - <(${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph) 2>&1 | head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# tag twice with the persistent tagging cache: the second run takes every sentence from the cache
+time (cd /tmp && rm -f testNER.cache &&
+    ${VENVPYTHON} -m ${MODULE} tag --model=testNER --bundle --cache testNER.cache -i ${CURDIR}/tests/test.ner.emmorph \
+        > testNER.cache.tag &&
+    ${VENVPYTHON} -m ${MODULE} tag --model=testNER --bundle --cache testNER.cache -i ${CURDIR}/tests/test.ner.emmorph \
+        2> testNER.cache.log | diff - testNER.cache.tag && grep '(100.0%)' testNER.cache.log 2>&1 | head -n100) && \
+    echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# tag in threads sharing one Tagger (the output must be the same as the serial one)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    --threads 2 -i ${CURDIR}/tests/test.ner.emmorph | \
+    diff - <(${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph) 2>&1 | head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# the same with the scoring reports (only the unique rows of a chunk or a sentence are scored, the output must be
+#  the same)
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    --threads 2 -i ${CURDIR}/tests/test.ner.emmorph 2> testNER.scoring.log | \
+    diff - <(${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph 2> testNER.serial.scoring.log) &&
+    grep '^scoring: .* unique' testNER.scoring.log testNER.serial.scoring.log 2>&1 | head -n100) && \
+    echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+
+# two Taggers of the same model share the loaded components (see huntag/registry.py), close() releases them,
+#  evict() frees the unused ones and a model file changed on disk is loaded again
+time (cd /tmp && ${VENVPYTHON} -c 'import os, sys
+from xtsv import parser_skeleton
+from huntag.argparser import parse_args
+from huntag.tagger import Tagger
+from huntag.registry import registry
+sys.argv = ["huntag", "tag", "--model=testNER", "--config-file=configs/ner.szeged.emmorph.yaml"]
+opts = vars(parse_args(parser_skeleton()))
+new_tagger = lambda: Tagger(dict(opts), target_fields=[opts["label_tag_field"]])
+a, b = new_tagger(), new_tagger()
+assert a._model is b._model and a._trans_probs is b._trans_probs, "The taggers do not share the model!"
+entries = len(registry.entries())
+assert all(ref_count == 2 for _, _, ref_count in registry.entries()), registry.entries()
+a.close()
+assert all(ref_count == 1 for _, _, ref_count in registry.entries()) and registry.evict() == 0, registry.entries()
+b.close()
+assert registry.evict() == entries and registry.entries() == [], registry.entries()
+c = new_tagger()
+st = os.stat(opts["model_filename"])
+os.utime(opts["model_filename"], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))  # Changed on disk: loaded again
+d = new_tagger()
+os.utime(opts["model_filename"], ns=(st.st_atime_ns, st.st_mtime_ns))
+assert c._model is not d._model and c._trans_probs is d._trans_probs, "The changed model is not loaded again!"
+c.close()
+d.close()
+assert registry.evict() == entries + 1, registry.entries()
+print(entries, "components shared")' 2>&1 | head -n100) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+
+echo "Running startup time tests..."
+# Sum of the top-level imports (python -X importtime) of a command in ms below the target (the first argument)
+#  and the module in the second argument (if not empty) is not imported at all
+check_import_time() {
+    local target=$1 forbidden=$2
+    shift 2
+    (cd /tmp && ${VENVPYTHON} -X importtime "$@" 2>&1 >/dev/null) | awk -F'|' -v target="${target}" \
+        -v forbidden="${forbidden}" '
+        /^import time: +[0-9]/ {
+            if ($3 ~ /^ [^ ]/) total += $2
+            name = $3; gsub(/ /, "", name)
+            if (forbidden != "" && name == forbidden) found = 1
+        }
+        END {
+            printf "import time: %d ms (target: %d ms)\n", total / 1000, target
+            if (found) {print forbidden " is imported!"; exit 1}
+            exit (total / 1000 > target)
+        }'
+}
+time (check_import_time 100 sklearn -c "import huntag") && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (check_import_time 600 sklearn -m ${MODULE} transmodel-train --model=testStartup \
+    -i ${CURDIR}/tests/test.ner.emmorph) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (check_import_time 800 sklearn -m ${MODULE} tag --model=testNER --bundle \
+    -i ${CURDIR}/tests/test.ner.emmorph) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (check_import_time 2500 "" -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+time (check_import_time 2500 "" -m ${MODULE} train --model=testStartup --config-file=configs/ner.szeged.emmorph.yaml \
+    --gold-tag-field gold -i ${CURDIR}/tests/test.ner.emmorph) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+
+echo "Running server tests..."
+# the output of plain tag, the documents tagged by the servers must be the same
+time (cd /tmp && ${VENVPYTHON} -m ${MODULE} tag --model=testNER --config-file=configs/ner.szeged.emmorph.yaml \
+    -i ${CURDIR}/tests/test.ner.emmorph 2>&1 > testNER.server.reference | head -n100) && \
+    echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# serve on a Unix socket, tag with the client, then shut the server down gracefully
+time (cd /tmp && (${VENVPYTHON} -m ${MODULE} serve --model=testNER --bundle --socket /tmp/testNER.sock -j 2 &
+    SERVER=$!
+    for _ in $(seq 50); do [[ -S /tmp/testNER.sock ]] && break; sleep 0.2; done
+    ${VENVPYTHON} -m ${MODULE}.client --socket /tmp/testNER.sock -i ${CURDIR}/tests/test.ner.emmorph \
+        > testNER.socket.tag && diff testNER.socket.tag testNER.server.reference
+    STATUS=$?
+    kill -TERM ${SERVER}
+    wait ${SERVER} && exit ${STATUS}) 2>&1) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1
+# serve over HTTP with micro-batching, tag a document, measure the latency, then shut the server down gracefully
+time (cd /tmp && (${VENVPYTHON} -m ${MODULE} serve --model=testNER --bundle --http localhost:8765 &
+    SERVER=$!
+    for _ in $(seq 50); do ${VENVPYTHON} -c 'import socket; socket.create_connection(("localhost", 8765))' \
+        2>/dev/null && break; sleep 0.2; done
+    ${VENVPYTHON} -c 'import sys, urllib.request; sys.stdout.write(urllib.request.urlopen(urllib.request.Request(
+        "http://localhost:8765/tag", data=open(sys.argv[1], "rb").read())).read().decode("UTF-8"))' \
+        ${CURDIR}/tests/test.ner.emmorph > testNER.http.tag && diff testNER.http.tag testNER.server.reference &&
+    ${VENVPYTHON} -m ${MODULE}.loadgen --url http://localhost:8765/tag -i ${CURDIR}/tests/test.ner.emmorph -c 1,4 \
+        -d 1 > testNER.loadgen.tsv && cat testNER.loadgen.tsv &&
+    awk -F'\t' 'NR > 1 && $3 != 0 {exit 1}' testNER.loadgen.tsv  # No failed requests
+    STATUS=$?
+    kill -TERM ${SERVER}
+    wait ${SERVER} && exit ${STATUS}) 2>&1) && echo "${GREEN}Test OK${NOCOLOR}" || exit 1